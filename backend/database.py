@@ -1,16 +1,59 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
+from sqlalchemy import (
+    create_engine, event, inspect, text, Column, Integer, String, Text, DateTime, Float, LargeBinary, UniqueConstraint
+)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.pool import NullPool
 from datetime import datetime
+import json
 import os
+import zlib
 
 # Database URL
-DATABASE_URL = "sqlite:///./lessons.db"
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./lessons.db")
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+if DATABASE_URL.startswith("sqlite"):
+    # Requests keep their session open while awaiting the LLM, so a bounded pool
+    # runs dry under load and the next checkout blocks the event loop. SQLite
+    # connections are cheap to open: don't pool them. Wait up to 30s for locks
+    # held by other worker processes.
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False, "timeout": 30},
+        poolclass=NullPool
+    )
+
+    @event.listens_for(engine, "connect")
+    def _configure_sqlite(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL lets readers in other processes work while one process writes
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+else:
+    engine = create_engine(DATABASE_URL, pool_pre_ping=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# zlib level for lesson text (1 = fastest, 9 = smallest)
+CONTENT_COMPRESSION_LEVEL = int(os.getenv("CONTENT_COMPRESSION_LEVEL", "6"))
+
+class LessonContent(Base):
+    """Extracted lesson text, zlib-compressed and kept out of the `lessons` table"""
+    __tablename__ = "lesson_contents"
+
+    lesson_id = Column(Integer, primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    length = Column(Integer, nullable=False)  # characters before compression
+
+    @staticmethod
+    def compress(content: str) -> bytes:
+        return zlib.compress(content.encode("utf-8"), CONTENT_COMPRESSION_LEVEL)
+
+    @property
+    def text(self) -> str:
+        return zlib.decompress(self.data).decode("utf-8")
+
 class Lesson(Base):
     __tablename__ = "lessons"
     
@@ -18,9 +61,26 @@ class Lesson(Base):
     title = Column(String, nullable=False)
     filename = Column(String, nullable=False)
     file_type = Column(String, nullable=False)  # 'pdf' or 'txt'
-    content = Column(Text, nullable=False)
     explanation = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Bumped whenever the lesson or what is served with it changes (drives the ETags)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # The text is only read (and decompressed) when `content` is used, so
+    # listings and other row scans never touch it
+    stored_content = relationship(
+        LessonContent,
+        primaryjoin="Lesson.id == foreign(LessonContent.lesson_id)",
+        uselist=False,
+        cascade="all, delete-orphan"
+    )
+    
+    @property
+    def content(self) -> str:
+        return self.stored_content.text if self.stored_content is not None else ""
+    
+    @content.setter
+    def content(self, content: str):
+        self.stored_content = LessonContent(data=LessonContent.compress(content), length=len(content))
     
     def to_dict(self):
         return {
@@ -29,11 +89,232 @@ class Lesson(Base):
             "filename": self.filename,
             "file_type": self.file_type,
             "explanation": self.explanation,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class BankQuestion(Base):
+    """A pre-generated quiz question; quizzes are assembled from these without an LLM call"""
+    __tablename__ = "question_bank"
+
+    id = Column(Integer, primary_key=True, index=True)
+    lesson_id = Column(Integer, nullable=False, index=True)
+    question = Column(Text, nullable=False)
+    options = Column(Text, nullable=False)  # JSON array of 4 options
+    correct_answer = Column(Integer, nullable=False)
+    difficulty = Column(String, nullable=False)  # 'easy', 'medium' or 'hard'
+    topic = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "question": self.question,
+            "options": json.loads(self.options),
+            "correct_answer": self.correct_answer,
+            "difficulty": self.difficulty,
+            "topic": self.topic
+        }
+
+class LessonFAQ(Base):
+    """A likely student question answered at upload time, served on a close match"""
+    __tablename__ = "lesson_faqs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    lesson_id = Column(Integer, nullable=False, index=True)
+    section = Column(Integer, nullable=True)  # section index for long lessons, None = whole lesson
+    question = Column(Text, nullable=False)
+    answer = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "lesson_id": self.lesson_id,
+            "section": self.section,
+            "question": self.question,
+            "answer": self.answer
+        }
+
+class LessonEmbedding(Base):
+    """A lesson's embedding: the normalized mean of its chunk vectors"""
+    __tablename__ = "lesson_embeddings"
+
+    lesson_id = Column(Integer, primary_key=True)
+    model = Column(String, nullable=False, index=True)  # embedding model the vector comes from
+    vector = Column(LargeBinary, nullable=False)  # float32 array
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class RelatedLesson(Base):
+    """One of a lesson's nearest lessons, precomputed for recommendations"""
+    __tablename__ = "related_lessons"
+    __table_args__ = (UniqueConstraint("lesson_id", "related_lesson_id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    lesson_id = Column(Integer, nullable=False, index=True)
+    related_lesson_id = Column(Integer, nullable=False, index=True)
+    score = Column(Float, nullable=False)  # cosine similarity
+
+class QASession(Base):
+    """A student's conversation about one lesson; turns older than the recent few are folded into `summary`"""
+    __tablename__ = "qa_sessions"
+
+    id = Column(String, primary_key=True)  # random hex token
+    lesson_id = Column(Integer, nullable=False, index=True)
+    summary = Column(Text, nullable=True)
+    turn_count = Column(Integer, nullable=False, default=0)
+    summarized_turns = Column(Integer, nullable=False, default=0)  # turns folded into the summary
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "session_id": self.id,
+            "lesson_id": self.lesson_id,
+            "summary": self.summary,
+            "turn_count": self.turn_count,
+            "summarized_turns": self.summarized_turns,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class QATurn(Base):
+    """One question and answer of a Q&A session"""
+    __tablename__ = "qa_turns"
+    __table_args__ = (UniqueConstraint("session_id", "position"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String, nullable=False, index=True)
+    position = Column(Integer, nullable=False)  # 0-based turn number within the session
+    question = Column(Text, nullable=False)
+    answer = Column(Text, nullable=False)
+    chunks = Column(Text, nullable=True)  # JSON array of the chunk indexes the answer was given from
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "position": self.position,
+            "question": self.question,
+            "answer": self.answer,
+            "chunks": json.loads(self.chunks) if self.chunks else [],
             "created_at": self.created_at.isoformat() if self.created_at else None
         }
 
+class EmbeddingIndex(Base):
+    """One vector collection per embedding model; at most one is 'active' for reads"""
+    __tablename__ = "embedding_indexes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    model = Column(String, nullable=False, unique=True)
+    status = Column(String, nullable=False)  # 'active', 'backfilling' or 'retired'
+    backfilled_through = Column(Integer, default=0)  # last lesson id re-embedded
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "model": self.model,
+            "status": self.status,
+            "backfilled_through": self.backfilled_through,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class LLMUsage(Base):
+    """LLM calls, tokens and latency aggregated per day, endpoint, operation and lesson"""
+    __tablename__ = "llm_usage"
+    __table_args__ = (UniqueConstraint("day", "endpoint", "operation", "lesson_id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(String, nullable=False, index=True)  # YYYY-MM-DD (UTC)
+    endpoint = Column(String, nullable=False)  # API route or caller, e.g. 'ask-question'
+    operation = Column(String, nullable=False)  # llm_service function, e.g. 'answer'
+    lesson_id = Column(Integer, nullable=False, default=0)  # 0 = not tied to a lesson
+    calls = Column(Integer, nullable=False, default=0)
+    errors = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    candidate_tokens = Column(Integer, nullable=False, default=0)
+    cached_tokens = Column(Integer, nullable=False, default=0)
+    latency_ms_total = Column(Float, nullable=False, default=0.0)
+
+    def to_dict(self):
+        return {
+            "day": self.day,
+            "endpoint": self.endpoint,
+            "operation": self.operation,
+            "lesson_id": self.lesson_id or None,
+            "calls": self.calls,
+            "errors": self.errors,
+            "prompt_tokens": self.prompt_tokens,
+            "candidate_tokens": self.candidate_tokens,
+            "cached_tokens": self.cached_tokens,
+            "avg_latency_ms": round(self.latency_ms_total / self.calls, 1) if self.calls else None
+        }
+
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    """Create missing tables and run pending migrations
+
+    Safe to run from several processes at once (e.g. `uvicorn --workers 4`):
+    everything runs in one transaction holding an exclusive database lock,
+    so the others wait and then find nothing left to do.
+    """
+    with engine.begin() as conn:
+        _lock_schema(conn)
+        Base.metadata.create_all(bind=conn)
+        migrate_lesson_contents(conn)
+        migrate_lesson_updated_at(conn)
+        migrate_qa_turn_chunks(conn)
+
+def _lock_schema(conn):
+    """Hold the database's schema lock until `conn`'s transaction ends"""
+    if engine.dialect.name == "sqlite":
+        # The sqlite3 driver only opens transactions before DML; take the write lock up front
+        conn.exec_driver_sql("BEGIN EXCLUSIVE")
+    elif engine.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('ischool init_db'))"))
+
+def _columns(conn, table: str) -> set:
+    return {column["name"] for column in inspect(conn).get_columns(table)}
+
+def migrate_lesson_updated_at(conn):
+    """Add `lessons.updated_at` to databases created before it, starting at `created_at`"""
+    if "updated_at" in _columns(conn, "lessons"):
+        return
+    conn.execute(text("ALTER TABLE lessons ADD COLUMN updated_at DATETIME"))
+    conn.execute(text("UPDATE lessons SET updated_at = created_at"))
+
+def migrate_qa_turn_chunks(conn):
+    """Add `qa_turns.chunks` to databases whose sessions predate it"""
+    if "chunks" in _columns(conn, "qa_turns"):
+        return
+    conn.execute(text("ALTER TABLE qa_turns ADD COLUMN chunks TEXT"))
+
+def migrate_lesson_contents(conn, batch_size: int = 200) -> int:
+    """Move lesson text from the old `lessons.content` column into `lesson_contents`
+
+    Runs once, from `init_db`, on databases created before the text was moved
+    out; returns the number of lessons moved. Dropping the column needs
+    SQLite 3.35+. Run `maintenance compact` afterwards to give the space back.
+    """
+    if "content" not in _columns(conn, "lessons"):
+        return 0
+    moved = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, content FROM lessons WHERE id > :last_id"
+            " AND id NOT IN (SELECT lesson_id FROM lesson_contents) ORDER BY id LIMIT :batch_size"
+        ), {"last_id": last_id, "batch_size": batch_size}).fetchall()
+        if not rows:
+            break
+        conn.execute(LessonContent.__table__.insert(), [
+            {"lesson_id": lesson_id, "data": LessonContent.compress(content or ""), "length": len(content or "")}
+            for lesson_id, content in rows
+        ])
+        moved += len(rows)
+        last_id = rows[-1][0]
+    conn.execute(text("ALTER TABLE lessons DROP COLUMN content"))
+    print(f"Moved the content of {moved} lessons to the compressed lesson_contents table")
+    return moved
 
 def get_db():
     db = SessionLocal()
@@ -0,0 +1,52 @@
+"""Gunicorn settings for running the API with several worker processes.
+
+Each worker is a separate process with its own event loop, so the embedded
+Chroma client can't be shared: run a Chroma server and point the workers at
+it (start_workers.sh does both):
+
+    chroma run --path ./chroma_db --port 8001
+    CHROMA_SERVER_HOST=localhost gunicorn -c gunicorn.conf.py main:app
+
+The master creates the database tables once before forking; workers only
+open connections. SQLite runs in WAL mode (see database.py) so workers can
+read while another one writes.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+backend_path = Path(__file__).parent
+load_dotenv(backend_path / ".env")
+
+chdir = str(backend_path)
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(4, (os.cpu_count() or 1) + 1))))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Uploads wait on several LLM calls; don't let gunicorn kill a worker mid-upload
+timeout = int(os.getenv("WORKER_TIMEOUT", "180"))
+graceful_timeout = 30
+keepalive = 5
+
+# Workers inherit these: the LLM client splits GEMINI_RPM between WEB_CONCURRENCY
+# processes and /metrics aggregates every worker
+os.environ["WEB_CONCURRENCY"] = str(workers)
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="ischool-metrics-"))
+
+def on_starting(server):
+    if workers > 1 and not os.getenv("CHROMA_SERVER_HOST"):
+        server.log.error("Several workers need a shared Chroma server: set CHROMA_SERVER_HOST "
+                         "(see start_workers.sh) or run with WEB_CONCURRENCY=1")
+        sys.exit(1)
+
+    sys.path.insert(0, str(backend_path))
+    os.chdir(backend_path)
+    from database import init_db
+    init_db()
+    os.environ["DB_INITIALIZED"] = "1"
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,17 +1,81 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
+import time
+IMPORT_STARTED_AT = time.perf_counter()
+
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
 from typing import List, Optional
+import asyncio
+import math
 import os
 from dotenv import load_dotenv
-import uvicorn
 
-from routes import teachers, students
+# Load .env before the imports below read their settings
+load_dotenv()
+
+from routes import teachers, students, admin
 from database import init_db
+from utils.llm_client import WORKER_PROCESSES, LLMOverloadedError, LLMUnavailableError
+from utils.llm_usage import flush_usage
+from utils.http_cache import CompressionMiddleware
+from utils.metrics import HTTP_LATENCY, metrics_app
+from utils.tracing import setup_tracing, span
+from utils.vector_db import CHROMA_SERVER_HOST, warm_up as warm_up_vector_db
 
-load_dotenv()
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED_AT
+
+# Imports plus startup slower than this are reported as a warning
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "2.0"))
+# Open Chroma and load the embedding model in the background once the app is up,
+# so the first upload or question doesn't pay for it
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() in ("1", "true", "yes")
+
+def log_startup(steps: dict):
+    total = sum(steps.values())
+    details = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in steps.items())
+    status = "Warning: startup over budget" if total > STARTUP_BUDGET_SECONDS else "Startup"
+    print(f"{status}: ready in {total:.2f}s ({details}; budget {STARTUP_BUDGET_SECONDS:.1f}s)")
+
+def warm_up():
+    started_at = time.perf_counter()
+    try:
+        warm_up_vector_db()
+        print(f"Warm-up finished in {time.perf_counter() - started_at:.2f}s (vector store, embedding model)")
+    except Exception as e:
+        print(f"Warning: warm-up failed, the first request will load the vector store: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Per-process startup and shutdown (runs in every worker)"""
+    steps = {"imports": IMPORT_SECONDS}
+
+    def run_step(name, function):
+        started_at = time.perf_counter()
+        function()
+        steps[name] = time.perf_counter() - started_at
 
-app = FastAPI(title="AI Learning Assistant", version="1.0.0")
+    # Same check as gunicorn.conf.py, for `uvicorn --workers` (which takes its default from WEB_CONCURRENCY)
+    if WORKER_PROCESSES > 1 and not CHROMA_SERVER_HOST:
+        raise RuntimeError("Several workers need a shared Chroma server: set CHROMA_SERVER_HOST "
+                           "(see start_workers.sh) or run with WEB_CONCURRENCY=1")
+    # Under gunicorn the master creates the tables once before forking (gunicorn.conf.py);
+    # otherwise every worker runs init_db, which waits for the others under a lock
+    if not os.getenv("DB_INITIALIZED"):
+        run_step("init_db", init_db)
+    if teachers.KEEP_UPLOADED_FILES:
+        run_step("uploads_dir", lambda: os.makedirs(teachers.UPLOAD_DIR, exist_ok=True))
+    # Export spans if TRACING_EXPORTER is set
+    run_step("tracing", setup_tracing)
+    log_startup(steps)
+
+    warmup = asyncio.create_task(asyncio.to_thread(warm_up)) if STARTUP_WARMUP else None
+    yield
+    if warmup is not None and not warmup.done():
+        warmup.cancel()
+    flush_usage()
+
+app = FastAPI(title="AI Learning Assistant", version="1.0.0", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -22,12 +86,61 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize database
-init_db()
+def route_template(request: Request) -> str:
+    """Request path with its parameters put back as placeholders (/lessons/{lesson_id})
+
+    Keeps one metrics label per route instead of one per lesson id.
+    """
+    if "endpoint" not in request.scope and "route" not in request.scope:
+        return "unmatched"
+    values = {str(value): name for name, value in request.path_params.items()}
+    segments = [f"{{{values[segment]}}}" if segment in values else segment
+                for segment in request.url.path.split("/")]
+    return "/".join(segments)
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started_at = time.perf_counter()
+    status = 500
+    with span("http.request", **{"http.method": request.method}) as request_span:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = route_template(request)
+            request_span.update_name(f"{request.method} {route}")
+            request_span.set_attributes({"http.route": route, "http.status_code": status})
+            HTTP_LATENCY.labels(request.method, route, str(status)).observe(time.perf_counter() - started_at)
+
+@app.exception_handler(LLMUnavailableError)
+async def llm_unavailable_handler(request, exc: LLMUnavailableError):
+    """The LLM is rate limited or down: tell clients when to retry"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, int(exc.retry_after)))}
+    )
+
+@app.exception_handler(LLMOverloadedError)
+async def llm_overloaded_handler(request, exc: LLMOverloadedError):
+    """Admission control: too many requests are already queued for the LLM"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
+    )
+
+# Brotli/GZip for large responses (lesson content, lesson lists)
+app.add_middleware(CompressionMiddleware)
 
 # Include routers
 app.include_router(teachers.router, prefix="/api/teachers", tags=["teachers"])
 app.include_router(students.router, prefix="/api/students", tags=["students"])
+app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
+
+# Prometheus metrics (request and stage latency, LLM calls, tokens, queue depth)
+app.mount("/metrics", metrics_app())
 
 @app.get("/")
 async def root():
@@ -38,5 +151,6 @@ async def health_check():
     return {"status": "healthy"}
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
 
@@ -0,0 +1,318 @@
+"""Vector store maintenance: consistency check, repair and compaction.
+
+Run from the repository root or the backend directory:
+
+    python -m backend.maintenance check
+    python -m backend.maintenance repair --batch-size 200
+    python -m backend.maintenance compact
+    python -m backend.maintenance migrate-embeddings --model all-mpnet-base-v2 --rate 30
+    python -m backend.maintenance migration-status
+    python -m backend.maintenance drop-retired
+    python -m backend.maintenance build-question-banks --rate 10
+    python -m backend.maintenance rebuild-related
+
+The exit code is 1 when `check` finds problems (or `repair` leaves some
+behind), so the command can be scheduled from cron and alert on failure.
+Run `compact` while the API is stopped; VACUUM needs exclusive access.
+It also deletes the HNSW index directories Chroma leaves behind for dropped
+collections (e.g. after `drop-retired`), and shrinks lessons.db after the
+lesson text was moved out (`init_db`). Vectors deleted from a live
+collection stay in its index files until `migrate-embeddings` rebuilds it.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import sqlite3
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+# The stores use paths relative to the backend directory
+backend_path = Path(__file__).parent
+sys.path.insert(0, str(backend_path))
+os.chdir(backend_path)
+
+from database import DATABASE_URL, SessionLocal, Lesson, LessonContent, BankQuestion, init_db
+from utils.embedding_migration import (
+    drop_retired_collections,
+    get_migration_status,
+    run_backfill,
+    start_migration,
+)
+from utils.llm_client import llm_priority
+from utils.llm_service import generate_question_bank
+from utils.llm_usage import flush_usage, usage_scope
+from utils.question_bank import bank_rows
+from utils.related_lessons import rebuild_related_lessons
+from utils.vector_db import (
+    CHROMA_PATH,
+    CHUNK_SIZE,
+    add_lesson_to_vector_db,
+    delete_chunks,
+    iter_vector_chunks,
+)
+
+@contextmanager
+def timed(step: str):
+    """Print how long a maintenance step took"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        print(f"[maintenance] {step}: {time.perf_counter() - start:.2f}s")
+
+def scan_vector_store(page_size: int):
+    """Index stored chunks by lesson id and chunk index"""
+    chunks_by_lesson = {}
+    unlabeled = []
+    total = 0
+    for chunk in iter_vector_chunks(page_size=page_size):
+        total += 1
+        metadata = chunk["metadata"] or {}
+        lesson_id = metadata.get("lesson_id")
+        if lesson_id is None:
+            unlabeled.append(chunk["id"])
+            continue
+        chunk_index = metadata.get("chunk_index", -1)
+        chunks_by_lesson.setdefault(lesson_id, {}).setdefault(chunk_index, []).append(chunk["id"])
+    return chunks_by_lesson, unlabeled, total
+
+def iter_lessons(page_size: int):
+    """Yield (id, content length) for every lesson using keyset pagination"""
+    db = SessionLocal()
+    try:
+        last_id = 0
+        while True:
+            rows = (
+                db.query(Lesson.id, LessonContent.length)
+                .outerjoin(LessonContent, LessonContent.lesson_id == Lesson.id)
+                .filter(Lesson.id > last_id)
+                .order_by(Lesson.id)
+                .limit(page_size)
+                .all()
+            )
+            if not rows:
+                break
+            yield from rows
+            last_id = rows[-1][0]
+    finally:
+        db.close()
+
+def check(page_size: int) -> dict:
+    """Compare SQLite lessons with the Chroma collection"""
+    with timed("scan vector store"):
+        chunks_by_lesson, unlabeled, total_chunks = scan_vector_store(page_size)
+
+    missing = []      # lessons with no chunks or an incomplete set
+    duplicates = []   # extra ids for an existing chunk, or chunks past the end
+    total_lessons = 0
+    with timed("scan lessons"):
+        for lesson_id, content_length in iter_lessons(page_size):
+            total_lessons += 1
+            expected = math.ceil((content_length or 0) / CHUNK_SIZE)
+            stored = chunks_by_lesson.pop(lesson_id, {})
+            for chunk_index, ids in stored.items():
+                if 0 <= chunk_index < expected:
+                    # Keep the canonical "<lesson_id>_<chunk_index>" id
+                    canonical = f"{lesson_id}_{chunk_index}"
+                    keep = canonical if canonical in ids else ids[0]
+                    duplicates.extend(i for i in ids if i != keep)
+                else:
+                    duplicates.extend(ids)
+            if any(i not in stored for i in range(expected)):
+                missing.append(lesson_id)
+
+    # Whatever is left belongs to lessons that no longer exist
+    orphans = list(unlabeled)
+    for stored in chunks_by_lesson.values():
+        for ids in stored.values():
+            orphans.extend(ids)
+
+    report = {
+        "lessons": total_lessons,
+        "chunks": total_chunks,
+        "orphans": orphans,
+        "missing": missing,
+        "duplicates": duplicates,
+    }
+    print(
+        f"[maintenance] lessons={total_lessons} chunks={total_chunks} "
+        f"orphan_chunks={len(orphans)} lessons_missing_chunks={len(missing)} "
+        f"duplicate_chunks={len(duplicates)}"
+    )
+    return report
+
+def repair(report: dict, batch_size: int):
+    """Delete orphan/duplicate chunks and re-index lessons with missing chunks"""
+    stale = report["orphans"] + report["duplicates"]
+    if stale:
+        with timed(f"delete {len(stale)} stale chunks"):
+            delete_chunks(stale, batch_size=batch_size)
+
+    missing = report["missing"]
+    if missing:
+        with timed(f"re-index {len(missing)} lessons"):
+            for i in range(0, len(missing), batch_size):
+                db = SessionLocal()
+                try:
+                    lessons = db.query(Lesson).filter(Lesson.id.in_(missing[i:i+batch_size])).all()
+                    for lesson in lessons:
+                        # Replace any partial set so ids stay contiguous
+                        delete_chunks([f"{lesson.id}_{n}" for n in range(math.ceil(len(lesson.content) / CHUNK_SIZE))])
+                        add_lesson_to_vector_db(lesson.id, lesson.title, lesson.content)
+                finally:
+                    db.close()
+
+def compact():
+    """VACUUM the Chroma and lesson SQLite files and delete index files of dropped collections"""
+    db_file = os.path.join(CHROMA_PATH, "chroma.sqlite3")
+    if not os.path.exists(db_file):
+        print(f"[maintenance] nothing to compact at {db_file}")
+    else:
+        before = _dir_size(CHROMA_PATH)
+        with timed("compact chroma"):
+            removed = _remove_orphan_segments(db_file)
+            _vacuum(db_file)
+        print(f"[maintenance] removed {removed} index directories of dropped collections")
+        after = _dir_size(CHROMA_PATH)
+        print(f"[maintenance] chroma size: {before / 1e6:.1f}MB -> {after / 1e6:.1f}MB")
+
+    lessons_file = DATABASE_URL[len("sqlite:///"):] if DATABASE_URL.startswith("sqlite:///") else None
+    if lessons_file and os.path.exists(lessons_file):
+        before = os.path.getsize(lessons_file)
+        with timed("compact lessons database"):
+            _vacuum(lessons_file)
+        print(f"[maintenance] lessons database size: {before / 1e6:.1f}MB -> {os.path.getsize(lessons_file) / 1e6:.1f}MB")
+
+def _remove_orphan_segments(db_file: str) -> int:
+    """Delete segment directories (named by segment id) no collection refers to any more"""
+    conn = sqlite3.connect(db_file)
+    try:
+        segments = {row[0] for row in conn.execute("SELECT id FROM segments")}
+    finally:
+        conn.close()
+    removed = 0
+    for entry in Path(CHROMA_PATH).iterdir():
+        if entry.is_dir() and _is_uuid(entry.name) and entry.name not in segments:
+            shutil.rmtree(entry)
+            removed += 1
+    return removed
+
+def _is_uuid(name: str) -> bool:
+    try:
+        uuid.UUID(name)
+    except ValueError:
+        return False
+    return True
+
+def _vacuum(db_file: str):
+    conn = sqlite3.connect(db_file)
+    try:
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+async def build_question_banks(lessons_per_minute: float) -> int:
+    """Generate question banks for lessons uploaded before the bank existed
+
+    Returns the number of lessons still without a bank.
+    """
+    db = SessionLocal()
+    try:
+        banked = db.query(BankQuestion.lesson_id).distinct()
+        lesson_ids = [row[0] for row in db.query(Lesson.id).filter(Lesson.id.notin_(banked)).order_by(Lesson.id)]
+    finally:
+        db.close()
+
+    built = 0
+    interval = 60 / lessons_per_minute if lessons_per_minute > 0 else 0
+    for lesson_id in lesson_ids:
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            lesson = db.query(Lesson).filter(Lesson.id == lesson_id).first()
+            if lesson is None:
+                continue
+            # Backfills only get the LLM tokens students and uploads leave
+            with llm_priority("backfill", "maintenance"), usage_scope("maintenance", lesson_id):
+                questions = await generate_question_bank(lesson.content)
+            if questions:
+                db.add_all(bank_rows(lesson_id, questions))
+                # The teacher view now serves its quiz from the bank: new ETag
+                lesson.updated_at = datetime.utcnow()
+                db.commit()
+                built += 1
+            print(f"[maintenance] lesson {lesson_id}: {len(questions)} questions")
+        finally:
+            db.close()
+        await asyncio.sleep(max(0.0, interval - (time.perf_counter() - started)))
+    flush_usage()
+    return len(lesson_ids) - built
+
+def _dir_size(path: str) -> int:
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file())
+
+def _has_issues(report: dict) -> bool:
+    return bool(report["orphans"] or report["missing"] or report["duplicates"])
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Check, repair and compact the lesson vector store")
+    parser.add_argument("command", choices=[
+        "check", "repair", "compact", "migrate-embeddings", "migration-status", "drop-retired",
+        "build-question-banks", "rebuild-related"
+    ])
+    parser.add_argument("--page-size", type=int, default=500, help="rows/chunks read per page")
+    parser.add_argument("--batch-size", type=int, default=200, help="chunks/lessons written per batch")
+    parser.add_argument("--model", help="embedding model id to migrate to (migrate-embeddings)")
+    parser.add_argument("--rate", type=float, default=60,
+                        help="lessons processed per minute (migrate-embeddings, build-question-banks)")
+    args = parser.parse_args(argv)
+
+    init_db()
+    start = time.perf_counter()
+    exit_code = 0
+
+    if args.command == "check":
+        exit_code = 1 if _has_issues(check(args.page_size)) else 0
+    elif args.command == "repair":
+        report = check(args.page_size)
+        if _has_issues(report):
+            repair(report, args.batch_size)
+            exit_code = 1 if _has_issues(check(args.page_size)) else 0
+    elif args.command == "compact":
+        compact()
+    elif args.command == "migrate-embeddings":
+        if not args.model:
+            parser.error("migrate-embeddings requires --model")
+        # Resumes from the last checkpoint if a backfill was interrupted
+        state = get_migration_status()
+        if not any(i["model"] == args.model and i["status"] == "backfilling" for i in state["indexes"]):
+            start_migration(args.model)
+        with timed(f"backfill {args.model}"):
+            print(json.dumps(run_backfill(args.model, lessons_per_minute=args.rate), indent=2))
+    elif args.command == "migration-status":
+        print(json.dumps(get_migration_status(), indent=2))
+    elif args.command == "drop-retired":
+        print(f"[maintenance] dropped {drop_retired_collections()} retired collections")
+    elif args.command == "build-question-banks":
+        with timed("build question banks"):
+            exit_code = 1 if asyncio.run(build_question_banks(args.rate)) else 0
+    elif args.command == "rebuild-related":
+        db = SessionLocal()
+        try:
+            with timed("rebuild related lessons"):
+                print(f"[maintenance] embedded {rebuild_related_lessons(db, args.batch_size)} lessons")
+        finally:
+            db.close()
+
+    print(f"[maintenance] {args.command} finished in {time.perf_counter() - start:.2f}s")
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main())
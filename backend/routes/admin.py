@@ -0,0 +1,37 @@
+from fastapi import APIRouter, HTTPException, Header, Query
+from typing import Optional
+import asyncio
+import hmac
+import os
+
+from utils.llm_usage import get_usage_summary
+
+router = APIRouter()
+
+# Shared secret for admin endpoints (sent as X-Admin-Token); unset, they are disabled
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def check_admin_token(token: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them")
+    if not hmac.compare_digest((token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@router.get("/llm-usage")
+async def llm_usage(
+    days: int = Query(7, ge=1, le=365),
+    group_by: str = Query("endpoint", pattern="^(day|endpoint|operation|lesson)$"),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """LLM calls, tokens and latency over the last days, largest prompt spend first"""
+    check_admin_token(x_admin_token)
+    usage = await asyncio.to_thread(get_usage_summary, days=days, group_by=group_by)
+    return {
+        "days": days,
+        "group_by": group_by,
+        "totals": {
+            name: sum(item[name] for item in usage)
+            for name in ("calls", "errors", "prompt_tokens", "candidate_tokens", "cached_tokens")
+        },
+        "usage": usage
+    }
@@ -1,66 +1,369 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Annotated, Dict, List, Literal, Optional, Tuple
+import asyncio
+import json
+import os
+import random
 
-from database import get_db, Lesson
-from utils.vector_db import search_similar_content
-from utils.llm_service import answer_question
+from database import get_db, Lesson, QASession, SessionLocal
+from utils.vector_db import embed_queries, get_lesson_chunks, search_similar_content, search_similar_content_batch
+from utils.faq import FAQ_PREGENERATION, find_faq
+from utils.http_cache import lesson_etag, lessons_etag, not_modified
+from utils.llm_client import LLMUnavailableError, check_llm_admission, client_id, llm_priority
+from utils.llm_service import answer_question, answer_questions, stream_answer
+from utils.context_cache import get_context_cache
+from utils.llm_usage import usage_scope
+from utils.metrics import stage_timer
+from utils.qa_sessions import (
+    carried_chunks,
+    create_session,
+    get_session,
+    history_prompt,
+    recent_turns,
+    record_turn,
+    retrieval_query,
+    session_history,
+)
+from utils.question_bank import assemble_quiz, load_question_bank
+from utils.related_lessons import RELATED_LESSONS_K, related_lessons
 
 router = APIRouter()
 
+# Most questions accepted by /ask-questions in one request
+MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", "10"))
+
 class QuestionRequest(BaseModel):
     lesson_id: int
     question: str
+    session_id: Optional[str] = None  # from POST /sessions, for follow-up questions
+
+class SessionRequest(BaseModel):
+    lesson_id: int
+
+class QuestionsRequest(BaseModel):
+    lesson_id: int
+    questions: List[Annotated[str, Field(min_length=1)]] = Field(min_length=1, max_length=MAX_BATCH_QUESTIONS)
 
 @router.get("/lessons")
-async def list_lessons(db: Session = Depends(get_db)):
-    """Get list of all available lessons"""
+async def list_lessons(request: Request, response: Response, db: Session = Depends(get_db)):
+    """Get list of all available lessons (304 if unchanged since the client's ETag)"""
+    cached = not_modified(request, response, lessons_etag(db))
+    if cached:
+        return cached
     lessons = db.query(Lesson).all()
     return {
         "lessons": [lesson.to_dict() for lesson in lessons]
     }
 
 @router.get("/lessons/{lesson_id}")
-async def get_lesson(lesson_id: int, db: Session = Depends(get_db)):
+async def get_lesson(lesson_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
     """Get lesson details"""
     lesson = db.query(Lesson).filter(Lesson.id == lesson_id).first()
     if not lesson:
         raise HTTPException(status_code=404, detail="Lesson not found")
+    cached = not_modified(request, response, lesson_etag(lesson))
+    if cached:
+        return cached
     
     lesson_dict = lesson.to_dict()
     # Don't include full content in list view for performance
     return {"lesson": lesson_dict}
 
-@router.post("/ask-question")
-async def ask_question(request: QuestionRequest, db: Session = Depends(get_db)):
-    """Ask a question about a specific lesson"""
-    # Get lesson from database
-    lesson = db.query(Lesson).filter(Lesson.id == request.lesson_id).first()
-    if not lesson:
+@router.get("/lessons/{lesson_id}/quiz")
+async def get_quiz(
+    lesson_id: int,
+    n: int = Query(5, ge=1, le=50),
+    difficulty: Optional[Literal["easy", "medium", "hard"]] = None,
+    seed: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """Assemble a quiz from the lesson's question bank (no LLM call)
+
+    The same seed returns the same questions in the same order; without one
+    a random seed is used and returned so the quiz can be reproduced.
+    """
+    if not db.query(Lesson.id).filter(Lesson.id == lesson_id).first():
         raise HTTPException(status_code=404, detail="Lesson not found")
     
-    # Search for relevant context in vector database
-    similar_content = search_similar_content(request.question, lesson_id=request.lesson_id, top_k=3)
+    questions = load_question_bank(db, lesson_id, difficulty)
+    if not questions:
+        raise HTTPException(status_code=404, detail="No questions in the question bank for this lesson"
+                            + (f" at {difficulty} difficulty" if difficulty else ""))
+    
+    if seed is None:
+        seed = random.randrange(2**31)
+    return {
+        "lesson_id": lesson_id,
+        "difficulty": difficulty,
+        "seed": seed,
+        "quiz": assemble_quiz(questions, n, seed)
+    }
+
+@router.get("/lessons/{lesson_id}/related")
+async def get_related_lessons(
+    lesson_id: int,
+    limit: int = Query(RELATED_LESSONS_K, ge=1, le=RELATED_LESSONS_K),
+    db: Session = Depends(get_db)
+):
+    """Lessons most similar to this one, precomputed at upload (no vector search)"""
+    if not db.query(Lesson.id).filter(Lesson.id == lesson_id).first():
+        raise HTTPException(status_code=404, detail="Lesson not found")
+    return {"lesson_id": lesson_id, "related": related_lessons(db, lesson_id, limit)}
+
+def _load_lesson(db: Session, lesson_id: int, operation: str = "ask-question") -> Lesson:
+    with stage_timer(operation, "load_lesson"):
+        lesson = db.query(Lesson).filter(Lesson.id == lesson_id).first()
+    if not lesson:
+        raise HTTPException(status_code=404, detail="Lesson not found")
+    return lesson
+
+def _load_session(db: Session, request: QuestionRequest) -> Tuple[Optional[QASession], List[Dict]]:
+    """The request's Q&A session and its turns not yet summarized, or (None, [])"""
+    if not request.session_id:
+        return None, []
+    with stage_timer("ask-question", "load_session"):
+        session = get_session(db, request.session_id, request.lesson_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Session not found for this lesson")
+        return session, recent_turns(db, session)
+
+async def _match_faq(db: Session, lesson_id: int, question: str) -> Tuple[Optional[Dict], Optional[List[float]]]:
+    """Pre-generated FAQ matching the question, and the question's embedding for retrieval"""
+    if not FAQ_PREGENERATION:
+        return None, None
+    with stage_timer("ask-question", "faq_lookup"):
+        # The embedding model would block the event loop
+        query_embedding = (await asyncio.to_thread(embed_queries, [question]))[0]
+        return find_faq(db, question, lesson_id, query_embedding), query_embedding
+
+async def _answer_context(lesson: Lesson, question: str, query_embedding: Optional[List[float]] = None,
+                          carried: Optional[List[int]] = None) -> Tuple[List[Dict], str, bool, List[int]]:
+    """Lesson chunks relevant to the question, the context to answer from, and its chunk indexes
+
+    The flag tells whether the context is the whole lesson; the lesson text
+    is only loaded in that case. `carried` chunks (a session's previous context) are fetched by index and
+    left out of the search, so the search only adds chunks not used yet.
+    """
+    # Search for relevant context in vector database (in a thread: embedding and reranking block)
+    with stage_timer("ask-question", "retrieve"):
+        similar_content = await asyncio.to_thread(
+            search_similar_content, question, lesson_id=lesson.id, top_k=3, rerank=True,
+            query_embedding=query_embedding, exclude_chunks=carried
+        )
+        previous = get_lesson_chunks(lesson.id, carried) if carried else []
     
     # Combine relevant chunks with full lesson content for context
-    context_parts = [chunk["content"] for chunk in similar_content]
+    context_parts = [chunk["content"] for chunk in previous + similar_content]
     context = "\n\n".join(context_parts)
+    chunks = [chunk["metadata"].get("chunk_index") for chunk in similar_content + previous]
     
     # If no specific chunks found, use full lesson content
-    if not context or len(context) < 100:
+    whole_lesson = not context or len(context) < 100
+    if whole_lesson:
         context = lesson.content
+    return similar_content, context, whole_lesson, [index for index in chunks if index is not None]
+
+def _relevant_sections(similar_content: List[Dict]) -> List[str]:
+    return [chunk["content"][:200] + "..." for chunk in similar_content[:2]]
+
+@router.post("/ask-question")
+async def ask_question(request: QuestionRequest, http_request: Request, db: Session = Depends(get_db)):
+    """Ask a question about a specific lesson
+
+    Questions close to a pre-generated FAQ get its stored answer ("source": "faq").
+    With a `session_id` the question is answered as a follow-up of the
+    session's earlier questions, and stored in the session.
+    """
+    lesson = _load_lesson(db, request.lesson_id)
+    session, turns = _load_session(db, request)
+    # Follow-ups ("and the second one?") only make sense with the conversation
+    faq, query_embedding = (None, None) if turns else await _match_faq(db, lesson.id, request.question)
+    if faq:
+        if session:
+            record_turn(db, session.id, request.question, faq["answer"])
+        return {
+            "question": request.question,
+            "answer": faq["answer"],
+            "lesson_title": lesson.title,
+            "relevant_sections": [],
+            "source": "faq",
+            "session_id": request.session_id
+        }
+    similar_content, context, whole_lesson, chunks = await _answer_context(
+        lesson, retrieval_query(request.question, turns), query_embedding, carried_chunks(turns)
+    )
     
-    # Generate answer using LLM
-    answer = await answer_question(request.question, context)
+    with llm_priority("interactive", client_id(http_request)), usage_scope("ask-question", lesson.id):
+        # Referenced from the context cache only when answering from the whole lesson
+        with stage_timer("ask-question", "context_cache"):
+            cached_content = await get_context_cache(context, whole_lesson, lesson.id)
+        
+        # Generate answer using LLM
+        with stage_timer("ask-question", "llm"):
+            history = history_prompt(session, turns) if session else None
+            answer = await answer_question(request.question, context, cached_content, history)
+        
+        if session:
+            with stage_timer("ask-question", "record_turn"):
+                record_turn(db, session.id, request.question, answer, chunks)
     
     return {
         "question": request.question,
         "answer": answer,
         "lesson_title": lesson.title,
-        "relevant_sections": [chunk["content"][:200] + "..." for chunk in similar_content[:2]]
+        "relevant_sections": _relevant_sections(similar_content),
+        "source": "llm",
+        "session_id": request.session_id
     }
 
+@router.post("/sessions")
+async def start_session(request: SessionRequest, db: Session = Depends(get_db)):
+    """Start a Q&A session about a lesson; pass its `session_id` with each question"""
+    lesson = _load_lesson(db, request.lesson_id, "start-session")
+    return create_session(db, lesson.id).to_dict()
+
+@router.get("/sessions/{session_id}")
+async def get_session_history(session_id: str, db: Session = Depends(get_db)):
+    """A Q&A session with all of its questions and answers"""
+    session = get_session(db, session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return dict(session.to_dict(), turns=session_history(db, session_id))
+
+def _merged_context(lesson: Lesson, results: List[List[Dict]]) -> Tuple[str, bool]:
+    """Chunks retrieved for any of the questions, once each, in lesson order
+
+    Also returns whether the context fell back to the whole lesson.
+    """
+    chunks = {}
+    for similar_content in results:
+        for chunk in similar_content:
+            chunks.setdefault(chunk["metadata"].get("chunk_index", len(chunks)), chunk["content"])
+    context = "\n\n".join(chunks[index] for index in sorted(chunks))
+    
+    # If no specific chunks found, use full lesson content
+    whole_lesson = not context or len(context) < 100
+    if whole_lesson:
+        context = lesson.content
+    return context, whole_lesson
+
+@router.post("/ask-questions")
+async def ask_questions(request: QuestionsRequest, http_request: Request, db: Session = Depends(get_db)):
+    """Ask several questions about one lesson at once
+
+    The lesson is loaded once, all questions are embedded in one batch and
+    searched in one vector query, and the questions not answered by a
+    pre-generated FAQ are answered together in one structured LLM call over
+    the merged context. Answers come back in the order of the questions.
+    """
+    lesson = _load_lesson(db, request.lesson_id, "ask-questions")
+    questions = request.questions
+    
+    with stage_timer("ask-questions", "embed"):
+        query_embeddings = await asyncio.to_thread(embed_queries, questions)
+    
+    with stage_timer("ask-questions", "faq_lookup"):
+        faqs = [find_faq(db, question, lesson.id, embedding) for question, embedding in zip(questions, query_embeddings)]
+    pending = [i for i, faq in enumerate(faqs) if faq is None]
+    
+    results = {}
+    answers = {}
+    if pending:
+        with stage_timer("ask-questions", "retrieve"):
+            similar = await asyncio.to_thread(
+                search_similar_content_batch,
+                [questions[i] for i in pending], lesson_id=lesson.id, top_k=3, rerank=True,
+                query_embeddings=[query_embeddings[i] for i in pending]
+            )
+        results = dict(zip(pending, similar))
+        context, whole_lesson = _merged_context(lesson, similar)
+        
+        with llm_priority("interactive", client_id(http_request)), usage_scope("ask-questions", lesson.id):
+            with stage_timer("ask-questions", "context_cache"):
+                cached_content = await get_context_cache(context, whole_lesson, lesson.id)
+            with stage_timer("ask-questions", "llm", **{"questions": len(pending)}):
+                answers = dict(zip(pending, await answer_questions([questions[i] for i in pending], context, cached_content)))
+    
+    return {
+        "lesson_id": lesson.id,
+        "lesson_title": lesson.title,
+        "answers": [
+            {
+                "question": question,
+                "answer": faqs[i]["answer"] if faqs[i] else answers[i],
+                "relevant_sections": [] if faqs[i] else _relevant_sections(results[i]),
+                "source": "faq" if faqs[i] else "llm"
+            }
+            for i, question in enumerate(questions)
+        ]
+    }
+
+def _event(**fields) -> str:
+    return json.dumps(fields) + "\n"
+
+@router.post("/ask-question/stream")
+async def ask_question_stream(request: QuestionRequest, http_request: Request, db: Session = Depends(get_db)):
+    """Ask a question and stream the answer as it is generated
+
+    The response is newline-delimited JSON: a "meta" event (lesson title and
+    relevant sections), "delta" events with pieces of the answer, then "done".
+    If the AI service fails the stream ends with an "error" event carrying
+    `retry_after` instead, since the 200 status has already been sent.
+    """
+    lesson = _load_lesson(db, request.lesson_id)
+    session, turns = _load_session(db, request)
+    faq, query_embedding = (None, None) if turns else await _match_faq(db, lesson.id, request.question)
+    if faq:
+        if session:
+            record_turn(db, session.id, request.question, faq["answer"])
+        faq_events = [
+            _event(type="meta", question=request.question, lesson_title=lesson.title,
+                   relevant_sections=[], source="faq", session_id=request.session_id),
+            _event(type="delta", text=faq["answer"]),
+            _event(type="done")
+        ]
+        return StreamingResponse(iter(faq_events), media_type="application/x-ndjson")
+
+    # Turn the request away with a 429 while the status can still be set
+    client = client_id(http_request)
+    check_llm_admission("interactive", client)
+    similar_content, context, whole_lesson, chunks = await _answer_context(
+        lesson, retrieval_query(request.question, turns), query_embedding, carried_chunks(turns)
+    )
+    lesson_id, lesson_title = lesson.id, lesson.title
+    history = history_prompt(session, turns) if session else None
+
+    async def events():
+        yield _event(type="meta", question=request.question, lesson_title=lesson_title,
+                     relevant_sections=_relevant_sections(similar_content), source="llm",
+                     session_id=request.session_id)
+        pieces = []
+        with usage_scope("ask-question", lesson_id):
+            try:
+                with llm_priority("interactive", client):
+                    with stage_timer("ask-question", "context_cache"):
+                        cached_content = await get_context_cache(context, whole_lesson, lesson_id)
+                    with stage_timer("ask-question", "llm"):
+                        async for piece in stream_answer(request.question, context, cached_content, history):
+                            pieces.append(piece)
+                            yield _event(type="delta", text=piece)
+                    if request.session_id:
+                        # The request's session is closed once the response starts
+                        session_db = SessionLocal()
+                        try:
+                            record_turn(session_db, request.session_id, request.question, "".join(pieces), chunks)
+                        finally:
+                            session_db.close()
+            except LLMUnavailableError as e:
+                yield _event(type="error", detail=str(e), retry_after=max(1, int(e.retry_after)))
+                return
+        yield _event(type="done")
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
 @router.get("/search-lessons")
 async def search_lessons(query: str, db: Session = Depends(get_db)):
     """Search for lessons using semantic search"""
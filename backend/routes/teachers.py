@@ -1,20 +1,32 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Request, Response
 from sqlalchemy.orm import Session
 from typing import Optional
+import asyncio
 import os
 
 from database import get_db, Lesson
 from utils.file_processor import process_uploaded_file
-from utils.llm_service import generate_lesson_title, generate_explanation, generate_quiz
+from utils.llm_service import generate_lesson_materials, generate_question_bank, generate_quiz
+from utils.llm_client import LLMUnavailableError, client_id, llm_priority
+from utils.context_cache import assign_lesson_cache, get_lesson_cache
+from utils.llm_usage import usage_scope
+from utils.metrics import stage_timer
+from utils.question_bank import assemble_quiz, bank_rows, has_question_bank, load_question_bank
+from utils.faq import index_faqs, pregenerate_faqs, save_faqs
+from utils.http_cache import lesson_etag, lessons_etag, not_modified
+from utils.related_lessons import index_related_lessons
 from utils.vector_db import add_lesson_to_vector_db
 
 router = APIRouter()
 
+# Created by the app's lifespan hook at startup
 UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# The extracted text is stored in the database; keep the original files too?
+KEEP_UPLOADED_FILES = os.getenv("KEEP_UPLOADED_FILES", "false").lower() in ("1", "true", "yes")
 
 @router.post("/upload-lesson")
 async def upload_lesson(
+    http_request: Request,
     file: UploadFile = File(...),
     db: Session = Depends(get_db)
 ):
@@ -29,64 +41,111 @@ async def upload_lesson(
         file_contents = await file.read()
         
         # Process file and extract text
-        content = await process_uploaded_file(file_contents, file.content_type)
+        with stage_timer("upload-lesson", "extract"):
+            content = await process_uploaded_file(file_contents, file.content_type)
         
         if not content or len(content.strip()) < 50:
             raise HTTPException(status_code=400, detail="File content is too short or empty")
         
-        # Generate title, explanation, and quiz using LLM
-        title = await generate_lesson_title(content)
-        explanation = await generate_explanation(content)
-        quiz = await generate_quiz(content, num_questions=5)
+        # Uploads wait behind students' questions for the LLM
+        with llm_priority("upload", client_id(http_request)), usage_scope("upload-lesson") as usage:
+            # Generate title, explanation, quiz, the question bank and FAQs using LLM
+            with stage_timer("upload-lesson", "generate"):
+                materials, question_bank, faqs = await asyncio.gather(
+                    generate_lesson_materials(content, num_questions=5),
+                    generate_question_bank(content),
+                    pregenerate_faqs(content)
+                )
+            title = materials["title"]
+            explanation = materials["explanation"]
+            quiz = materials["quiz"]
+            
+            # Save lesson to database
+            lesson = Lesson(
+                title=title,
+                filename=file.filename,
+                file_type="pdf" if file.content_type == "application/pdf" else "txt",
+                content=content,
+                explanation=explanation
+            )
+            with stage_timer("upload-lesson", "db_commit", **{"content.length": len(content)}):
+                db.add(lesson)
+                db.flush()
+                db.add_all(bank_rows(lesson.id, question_bank))
+                faq_rows = save_faqs(db, lesson.id, faqs)
+                db.commit()
+                db.refresh(lesson)
+            usage.lesson_id = lesson.id
         
-        # Save lesson to database
-        lesson = Lesson(
-            title=title,
-            filename=file.filename,
-            file_type="pdf" if file.content_type == "application/pdf" else "txt",
-            content=content,
-            explanation=explanation
-        )
-        db.add(lesson)
-        db.commit()
-        db.refresh(lesson)
+        # Reuse the upload's context cache for questions about this lesson
+        assign_lesson_cache(content, lesson.id)
         
         # Add to vector database for semantic search
-        add_lesson_to_vector_db(lesson.id, title, content)
+        with stage_timer("upload-lesson", "vector_add"):
+            add_lesson_to_vector_db(lesson.id, title, content)
+            index_faqs(lesson.id, faq_rows)
+        
+        with stage_timer("upload-lesson", "related_lessons"):
+            # Scores the lesson against every other one: keep it off the event loop
+            await asyncio.to_thread(index_related_lessons, db, lesson.id)
         
         # Save file to disk (optional, for future reference)
-        file_path = os.path.join(UPLOAD_DIR, f"{lesson.id}_{file.filename}")
-        with open(file_path, "wb") as f:
-            f.write(file_contents)
+        if KEEP_UPLOADED_FILES:
+            with stage_timer("upload-lesson", "disk_write"):
+                file_path = os.path.join(UPLOAD_DIR, f"{lesson.id}_{file.filename}")
+                with open(file_path, "wb") as f:
+                    f.write(file_contents)
         
         return {
             "message": "Lesson uploaded successfully",
             "lesson": lesson.to_dict(),
-            "quiz": quiz
+            "quiz": quiz,
+            "question_bank_size": len(question_bank),
+            "faqs": len(faq_rows)
         }
         
+    except LLMUnavailableError:
+        # Handled in main.py: 503 with Retry-After, nothing is stored
+        raise
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
 @router.get("/lessons")
-async def list_lessons(db: Session = Depends(get_db)):
-    """Get list of all lessons"""
+async def list_lessons(request: Request, response: Response, db: Session = Depends(get_db)):
+    """Get list of all lessons (304 if unchanged since the client's ETag)"""
+    cached = not_modified(request, response, lessons_etag(db))
+    if cached:
+        return cached
     lessons = db.query(Lesson).all()
     return {
         "lessons": [lesson.to_dict() for lesson in lessons]
     }
 
 @router.get("/lessons/{lesson_id}")
-async def get_lesson(lesson_id: int, db: Session = Depends(get_db)):
-    """Get a specific lesson with its quiz"""
+async def get_lesson(lesson_id: int, http_request: Request, response: Response, db: Session = Depends(get_db)):
+    """Get a specific lesson with a quiz from its question bank
+
+    With a bank the quiz is the same on every request for a lesson version,
+    so clients can revalidate with If-None-Match and get a 304 without a
+    body. Lessons without one get a newly generated quiz and no ETag.
+    """
     lesson = db.query(Lesson).filter(Lesson.id == lesson_id).first()
     if not lesson:
         raise HTTPException(status_code=404, detail="Lesson not found")
     
-    # Regenerate quiz (or you could store it in DB)
-    quiz = await generate_quiz(lesson.content, num_questions=5)
+    if has_question_bank(db, lesson.id):
+        cached = not_modified(http_request, response, lesson_etag(lesson))
+        if cached:
+            return cached
+        quiz = assemble_quiz(load_question_bank(db, lesson.id), 5, seed=lesson.id)
+    else:
+        # Lessons uploaded before the question bank: generate a quiz (different every time)
+        response.headers["Cache-Control"] = "no-store"
+        with llm_priority("interactive", client_id(http_request)), usage_scope("teacher-lesson", lesson.id):
+            cached_content = await get_lesson_cache(lesson.content, lesson.id)
+            quiz = await generate_quiz(lesson.content, num_questions=5, cached_content=cached_content)
     
     lesson_dict = lesson.to_dict()
     lesson_dict["content"] = lesson.content  # Include full content
@@ -0,0 +1,20 @@
+#!/bin/bash
+# Multi-worker mode: a local Chroma server shared by several API workers
+cd "$(dirname "$0")"
+
+CHROMA_SERVER_PORT=${CHROMA_SERVER_PORT:-8001}
+export CHROMA_SERVER_HOST=${CHROMA_SERVER_HOST:-localhost}
+export CHROMA_SERVER_PORT
+
+echo "Starting Chroma server on port $CHROMA_SERVER_PORT..."
+chroma run --path ./chroma_db --port "$CHROMA_SERVER_PORT" > chroma.log 2>&1 &
+CHROMA_PID=$!
+trap 'kill $CHROMA_PID' EXIT
+
+until curl -sf "http://$CHROMA_SERVER_HOST:$CHROMA_SERVER_PORT/api/v2/heartbeat" > /dev/null ||
+      curl -sf "http://$CHROMA_SERVER_HOST:$CHROMA_SERVER_PORT/api/v1/heartbeat" > /dev/null; do
+    sleep 0.5
+done
+
+echo "Starting AI Learning Assistant Backend with ${WEB_CONCURRENCY:-auto} workers..."
+gunicorn -c gunicorn.conf.py main:app
@@ -0,0 +1,116 @@
+"""Per-lesson context caching for repeated lesson-scoped LLM calls.
+
+Long lessons are uploaded to the provider's context cache once (Gemini
+explicit caching) and referenced by handle afterwards, so explanation, quiz,
+question bank and FAQ generation stop resending the full text. The cache is
+created during upload and reused by quiz regeneration and by questions that
+are answered from the whole lesson (`get_context_cache`); after a restart or
+expiry it is recreated on first use.
+
+Handles are keyed by lesson id (and content hash, so edited content never
+reuses a stale cache); caching a lesson's new content deletes the handles of
+its previous versions. Providers without caching simply get no handle and
+callers send the content inline.
+"""
+import asyncio
+import hashlib
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from utils.llm_client import create_cache, delete_cache
+
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Time to live of a cached lesson on the provider side
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", "3600"))
+# Gemini requires a minimum prompt size for caching (~1024 tokens); below it caching doesn't pay off
+CONTEXT_CACHE_MIN_CHARS = int(os.getenv("CONTEXT_CACHE_MIN_CHARS", "4096"))
+# Recreate a cache this many seconds before it expires rather than risk using an expired handle
+CONTEXT_CACHE_REFRESH_MARGIN = 60
+# After a failed creation, send the content inline for this long before trying again
+CONTEXT_CACHE_RETRY_AFTER = float(os.getenv("CONTEXT_CACHE_RETRY_AFTER", "600"))
+
+# cache key -> (handle, expires_at)
+_handles: Dict[str, Tuple[str, float]] = {}
+# content hash -> when creation may be tried again
+_failures: Dict[str, float] = {}
+# cache key -> lock held while the handle is being created
+_locks: Dict[str, asyncio.Lock] = {}
+
+def _digest(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+def _cache_key(content: str, lesson_id: Optional[int]) -> str:
+    digest = _digest(content)
+    return f"lesson-{lesson_id}-{digest}" if lesson_id is not None else f"upload-{digest}"
+
+def lesson_cache_prefix(content: str) -> str:
+    """Text stored in the cache; prompts that use the handle omit it"""
+    return f"Lesson content:\n{content}"
+
+async def get_lesson_cache(content: str, lesson_id: Optional[int] = None) -> Optional[str]:
+    """Handle for the cached lesson content, creating it if needed
+
+    Returns None when caching is disabled, the lesson is too short to
+    benefit, or the provider doesn't support it. A failed creation is not
+    retried for CONTEXT_CACHE_RETRY_AFTER seconds, so questions don't each
+    spend a rate-limit token on it.
+    """
+    if not CONTEXT_CACHE_ENABLED or len(content) < CONTEXT_CACHE_MIN_CHARS:
+        return None
+    digest = _digest(content)
+    if _failures.get(digest, 0) > time.monotonic():
+        return None
+
+    key = _cache_key(content, lesson_id)
+    cached = _handles.get(key)
+    if cached and cached[1] - time.monotonic() > CONTEXT_CACHE_REFRESH_MARGIN:
+        return cached[0]
+
+    # One creation per key even when many students ask at once
+    lock = _locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        try:
+            cached = _handles.get(key)
+            if cached and cached[1] - time.monotonic() > CONTEXT_CACHE_REFRESH_MARGIN:
+                return cached[0]
+            if _failures.get(digest, 0) > time.monotonic():
+                return None
+            handle = await create_cache(key, lesson_cache_prefix(content), CONTEXT_CACHE_TTL)
+            if handle is None:
+                _failures[digest] = time.monotonic() + CONTEXT_CACHE_RETRY_AFTER
+                return None
+            _failures.pop(digest, None)
+            _handles[key] = (handle, time.monotonic() + CONTEXT_CACHE_TTL)
+        finally:
+            # Later callers find the handle or the failure; the lock is only needed during creation
+            if _locks.get(key) is lock:
+                del _locks[key]
+    if lesson_id is not None:
+        await _drop_previous_versions(lesson_id, key)
+    return handle
+
+async def get_context_cache(context: str, whole_lesson: bool, lesson_id: Optional[int] = None) -> Optional[str]:
+    """Handle for a prompt built from `context`, only if that context is the whole lesson
+
+    Answers built from retrieved chunks keep the chunks in the prompt: they
+    are a fraction of the lesson, while a cached lesson bills all its tokens
+    (and the model would answer from the whole lesson, not the chunks). The
+    caller says which it is, so chunk answers never load the lesson text.
+    """
+    if not whole_lesson:
+        return None
+    return await get_lesson_cache(context, lesson_id)
+
+def assign_lesson_cache(content: str, lesson_id: int):
+    """Re-key a cache created during upload (before the lesson had an id)"""
+    upload_key = _cache_key(content, None)
+    if upload_key in _handles:
+        _handles[_cache_key(content, lesson_id)] = _handles.pop(upload_key)
+
+async def _drop_previous_versions(lesson_id: int, current_key: str):
+    """Delete the caches of a lesson's earlier content once its new content is cached"""
+    prefix = f"lesson-{lesson_id}-"
+    for key in [k for k in _handles if k.startswith(prefix) and k != current_key]:
+        handle, _ = _handles.pop(key)
+        await delete_cache(handle)
@@ -0,0 +1,156 @@
+"""Embedding model migration: dual-write, rate-limited backfill, atomic switch.
+
+1. `start_migration(model)` records the new model as 'backfilling'. From then
+   on `add_lesson_to_vector_db` writes every new lesson to both collections.
+2. `run_backfill(model)` re-embeds existing lessons from `Lesson.content`
+   into the new collection at a bounded rate, checkpointing progress in
+   `embedding_indexes.backfilled_through` so it can be stopped and resumed.
+3. When the backfill reaches the last lesson, the new model becomes 'active'
+   and the old one 'retired' in a single transaction. Searches keep reading
+   the old (complete) collection until then, so there is no search downtime.
+   Related-lesson recommendations are then recomputed from the new model's
+   lesson embeddings.
+"""
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from database import SessionLocal, Lesson, LessonFAQ, EmbeddingIndex
+from utils.related_lessons import rebuild_related_lessons
+from utils.vector_db import add_faqs_to_vector_db, add_lesson_to_vector_db, drop_collection, get_index_state
+
+def start_migration(model: str) -> dict:
+    """Register a new embedding model and begin dual-writing to it"""
+    db = SessionLocal()
+    try:
+        current = get_index_state(refresh=True)["active"]
+        if model == current:
+            raise ValueError(f"Embedding model '{model}' is already active")
+
+        # Record the current model explicitly so the switch has a row to retire
+        if not db.query(EmbeddingIndex).filter(EmbeddingIndex.model == current).first():
+            db.add(EmbeddingIndex(model=current, status="active"))
+
+        index = db.query(EmbeddingIndex).filter(EmbeddingIndex.model == model).first()
+        if index is None:
+            index = EmbeddingIndex(model=model, status="backfilling", backfilled_through=0)
+            db.add(index)
+        elif index.status != "backfilling":
+            # Re-activating a retired model: its collection is stale, start over
+            index.status = "backfilling"
+            index.backfilled_through = 0
+        db.commit()
+        db.refresh(index)
+        return index.to_dict()
+    finally:
+        db.close()
+        get_index_state(refresh=True)
+
+def run_backfill(model: str, lessons_per_minute: float = 60, batch_size: int = 20,
+                 stop_event: Optional[threading.Event] = None) -> dict:
+    """Re-embed lessons into the model's collection, then switch reads to it"""
+    interval = 60.0 / lessons_per_minute if lessons_per_minute > 0 else 0.0
+
+    while not (stop_event and stop_event.is_set()):
+        db = SessionLocal()
+        try:
+            index = db.query(EmbeddingIndex).filter(EmbeddingIndex.model == model).first()
+            if index is None or index.status != "backfilling":
+                raise ValueError(f"No backfill in progress for '{model}'")
+
+            lessons = (
+                db.query(Lesson)
+                .filter(Lesson.id > (index.backfilled_through or 0))
+                .order_by(Lesson.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not lessons:
+                return _switch_active(db, index)
+
+            for lesson in lessons:
+                started = time.monotonic()
+                add_lesson_to_vector_db(lesson.id, lesson.title, lesson.content, model=model)
+                faqs = db.query(LessonFAQ).filter(LessonFAQ.lesson_id == lesson.id).all()
+                add_faqs_to_vector_db(lesson.id, [faq.to_dict() for faq in faqs], model=model)
+                index.backfilled_through = lesson.id
+                db.commit()
+                print(f"[backfill] {model}: lesson {lesson.id} re-embedded")
+
+                # Pace the backfill so it doesn't starve interactive traffic
+                remaining = interval - (time.monotonic() - started)
+                if remaining > 0 and stop_event is not None:
+                    if stop_event.wait(remaining):
+                        break
+                elif remaining > 0:
+                    time.sleep(remaining)
+        finally:
+            db.close()
+
+    return get_migration_status()
+
+def _switch_active(db, index: EmbeddingIndex) -> dict:
+    """Atomically retire the current active model and activate the backfilled one"""
+    now = datetime.utcnow()
+    db.query(EmbeddingIndex).filter(EmbeddingIndex.status == "active").update(
+        {"status": "retired", "updated_at": now}, synchronize_session=False
+    )
+    index.status = "active"
+    index.updated_at = now
+    db.commit()
+    get_index_state(refresh=True)
+    print(f"[backfill] {index.model}: backfill complete, now serving reads")
+    # Lesson embeddings of the old model can't be compared with new uploads
+    try:
+        print(f"[backfill] {index.model}: embedded {rebuild_related_lessons(db)} lessons for related lessons")
+    except Exception as e:
+        db.rollback()
+        print(f"Warning: Could not rebuild related lessons, run `maintenance rebuild-related`: {e}")
+    return get_migration_status()
+
+def get_migration_status() -> dict:
+    """All known embedding indexes and their progress"""
+    db = SessionLocal()
+    try:
+        last_lesson = db.query(Lesson.id).order_by(Lesson.id.desc()).first()
+        return {
+            "active": get_index_state(refresh=True)["active"],
+            "last_lesson_id": last_lesson[0] if last_lesson else 0,
+            "indexes": [i.to_dict() for i in db.query(EmbeddingIndex).order_by(EmbeddingIndex.id).all()]
+        }
+    finally:
+        db.close()
+
+def drop_retired_collections() -> int:
+    """Delete collections of retired models once the switch has been verified"""
+    db = SessionLocal()
+    try:
+        retired = db.query(EmbeddingIndex).filter(EmbeddingIndex.status == "retired").all()
+        for index in retired:
+            drop_collection(index.model)
+            db.delete(index)
+        db.commit()
+        return len(retired)
+    finally:
+        db.close()
+
+class BackfillWorker(threading.Thread):
+    """Run `run_backfill` in a daemon thread (e.g. next to the API process)"""
+
+    def __init__(self, model: str, lessons_per_minute: float = 60, batch_size: int = 20):
+        super().__init__(name=f"backfill-{model}", daemon=True)
+        self.model = model
+        self.lessons_per_minute = lessons_per_minute
+        self.batch_size = batch_size
+        self.stop_event = threading.Event()
+        self.result = None
+
+    def run(self):
+        try:
+            self.result = run_backfill(self.model, self.lessons_per_minute, self.batch_size, self.stop_event)
+        except Exception as e:
+            print(f"[backfill] {self.model} failed: {e}")
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,61 @@
+"""Pre-generated FAQs: likely student questions answered once, at upload.
+
+With FAQ_PREGENERATION enabled, upload asks the LLM for the questions
+students are most likely to ask about a lesson (and about each section of a
+long lesson, see `llm_service.generate_faqs`). They are stored in the
+`lesson_faqs` table and their questions are embedded in the "faqs" vector
+collection. A student question within FAQ_MAX_DISTANCE of a stored one is
+answered from the table, without retrieval or an LLM call.
+"""
+import os
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from database import LessonFAQ
+from utils.llm_service import generate_faqs
+from utils.metrics import FAQ_LOOKUPS
+from utils.vector_db import add_faqs_to_vector_db, search_faqs
+
+FAQ_PREGENERATION = os.getenv("FAQ_PREGENERATION", "false").lower() in ("1", "true", "yes")
+
+# Chroma's L2 distance; for normalized embeddings (the default model) it is
+# 2 - 2 * cosine similarity, so 0.15 means a cosine similarity of ~0.93
+FAQ_MAX_DISTANCE = float(os.getenv("FAQ_MAX_DISTANCE", "0.15"))
+
+async def pregenerate_faqs(content: str) -> List[Dict]:
+    """FAQs for a new lesson, or [] when FAQ_PREGENERATION is off"""
+    if not FAQ_PREGENERATION:
+        return []
+    return await generate_faqs(content)
+
+def save_faqs(db: Session, lesson_id: int, faqs: List[Dict]) -> List[LessonFAQ]:
+    """Add FAQ rows to the session (the caller commits, then calls `index_faqs`)"""
+    rows = [
+        LessonFAQ(lesson_id=lesson_id, section=faq.get("section"), question=faq["question"], answer=faq["answer"])
+        for faq in faqs
+    ]
+    db.add_all(rows)
+    return rows
+
+def index_faqs(lesson_id: int, rows: List[LessonFAQ]):
+    add_faqs_to_vector_db(lesson_id, [row.to_dict() for row in rows])
+
+def find_faq(db: Session, question: str, lesson_id: int,
+             query_embedding: Optional[List[float]] = None) -> Optional[Dict]:
+    """The stored FAQ closest to the question, if it is close enough to reuse its answer"""
+    if not FAQ_PREGENERATION:
+        return None
+    try:
+        match = search_faqs(question, lesson_id, query_embedding)
+    except Exception as e:
+        print(f"Warning: FAQ lookup failed: {e}")
+        return None
+
+    faq = None
+    if match is not None and match["distance"] <= FAQ_MAX_DISTANCE:
+        faq = db.query(LessonFAQ).filter(LessonFAQ.id == match["faq_id"]).first()
+    FAQ_LOOKUPS.labels("hit" if faq else "miss").inc()
+    if faq is None:
+        return None
+    return dict(faq.to_dict(), distance=match["distance"])
@@ -1,15 +1,19 @@
-import PyPDF2
 import io
 from typing import Optional
 
+from utils.tracing import span
+
 async def extract_text_from_pdf(file_contents: bytes) -> str:
     """Extract text from PDF file"""
+    import PyPDF2  # imported on first PDF upload rather than at startup
     try:
         pdf_file = io.BytesIO(file_contents)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
+        with span("file.extract_pdf") as pdf_span:
+            pdf_reader = PyPDF2.PdfReader(pdf_file)
+            text = ""
+            for page in pdf_reader.pages:
+                text += page.extract_text() + "\n"
+            pdf_span.set_attribute("pdf.pages", len(pdf_reader.pages))
         return text.strip()
     except Exception as e:
         raise ValueError(f"Error extracting text from PDF: {str(e)}")
@@ -24,10 +28,13 @@ async def extract_text_from_txt(file_contents: bytes) -> str:
 
 async def process_uploaded_file(file_contents: bytes, file_type: str) -> str:
     """Process uploaded file and return extracted text"""
-    if file_type == "application/pdf":
-        return await extract_text_from_pdf(file_contents)
-    elif file_type == "text/plain":
-        return await extract_text_from_txt(file_contents)
-    else:
-        raise ValueError(f"Unsupported file type: {file_type}")
+    with span("file.process", **{"file.type": file_type, "file.bytes": len(file_contents)}) as file_span:
+        if file_type == "application/pdf":
+            text = await extract_text_from_pdf(file_contents)
+        elif file_type == "text/plain":
+            text = await extract_text_from_txt(file_contents)
+        else:
+            raise ValueError(f"Unsupported file type: {file_type}")
+        file_span.set_attribute("content.length", len(text))
+        return text
 
@@ -0,0 +1,68 @@
+"""Conditional GETs and response compression for the lesson read endpoints.
+
+Lesson responses carry a weak ETag built from the lesson id and its
+`updated_at`; lesson lists from the number of lessons and the latest change.
+A request whose If-None-Match matches gets an empty 304 before the response
+is built (and before a quiz is assembled or generated). Large responses are
+compressed with Brotli when brotli-asgi is installed, GZip otherwise.
+"""
+import hashlib
+import os
+from typing import Optional
+
+from fastapi import Request, Response
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from starlette.middleware.gzip import GZipMiddleware
+
+from database import Lesson
+
+# Seconds clients may reuse a lesson response without asking; 0 = revalidate every time
+LESSON_CACHE_MAX_AGE = int(os.getenv("LESSON_CACHE_MAX_AGE", "0"))
+# Smaller responses are sent uncompressed
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1000"))
+
+def lesson_etag(lesson: Lesson) -> str:
+    version = lesson.updated_at or lesson.created_at
+    return f'W/"lesson-{lesson.id}-{version.timestamp() if version else 0}"'
+
+def lessons_etag(db: Session) -> str:
+    """ETag of the lesson list: changes when a lesson is added, updated or deleted"""
+    count, last_id, last_update = db.query(
+        func.count(Lesson.id), func.max(Lesson.id), func.max(func.coalesce(Lesson.updated_at, Lesson.created_at))
+    ).one()
+    digest = hashlib.sha1(f"{count}:{last_id}:{last_update}".encode()).hexdigest()[:16]
+    return f'W/"lessons-{digest}"'
+
+def cache_headers(etag: str) -> dict:
+    cache_control = f"private, max-age={LESSON_CACHE_MAX_AGE}" if LESSON_CACHE_MAX_AGE > 0 else "no-cache"
+    return {"ETag": etag, "Cache-Control": cache_control}
+
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """A 304 response if the client already has this version; else set the cache headers on `response`"""
+    headers = cache_headers(etag)
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        # Weak comparison: compression changes the bytes, not the lesson
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in tags or etag.removeprefix("W/") in tags:
+            return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+class CompressionMiddleware:
+    """Brotli or GZip for large responses, except streamed answers (compressors buffer them)"""
+
+    def __init__(self, app):
+        self.app = app
+        try:
+            from brotli_asgi import BrotliMiddleware
+            self.compressed = BrotliMiddleware(app, minimum_size=COMPRESSION_MINIMUM_SIZE, gzip_fallback=True)
+        except ImportError:
+            self.compressed = GZipMiddleware(app, minimum_size=COMPRESSION_MINIMUM_SIZE)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].endswith("/stream"):
+            await self.app(scope, receive, send)
+            return
+        await self.compressed(scope, receive, send)
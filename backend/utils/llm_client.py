@@ -0,0 +1,507 @@
+"""Shared LLM client with rate limiting, retries, a circuit breaker and request coalescing.
+
+All `llm_service` calls go through `generate()` (or `stream()`), whichever
+provider is configured (see `utils.llm_providers`):
+
+- a token bucket keeps us within the project's requests-per-minute quota,
+- retryable errors (429/500/503/504, timeouts) are retried with exponential
+  backoff and full jitter,
+- after repeated failures the circuit opens and calls fail fast with
+  `LLMUnavailableError` until a cooldown has passed,
+- identical in-flight prompts share a single API call,
+- tokens and latency of every call are recorded (see `utils.llm_usage`),
+- rate-limit tokens are handed out by priority class (interactive Q&A before
+  uploads before backfills) and round-robin between clients within a class;
+  requests entering `llm_priority` when their class (or client) already has
+  too many requests waiting on the LLM fail fast with `LLMOverloadedError`.
+
+    with llm_priority("upload", client_id(request)):
+        ...llm_service calls...
+"""
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+
+from utils.llm_providers import LLMResponse, get_provider
+from utils.llm_usage import record_usage
+from utils.metrics import (
+    LLM_IN_FLIGHT,
+    LLM_QUEUE_DEPTH,
+    LLM_SCHEDULER_QUEUED,
+    LLM_SCHEDULER_REJECTED,
+    LLM_SCHEDULER_WAIT,
+)
+from utils.tracing import span
+
+# Quota: sustained requests per minute and how many may be sent back to back
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "5"))
+
+# Retries for transient errors
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "1.0"))
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "20.0"))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "60"))
+
+# Worker processes sharing the quota (uvicorn/gunicorn read the same variable);
+# each process gets an equal share of GEMINI_RPM and GEMINI_BURST
+WORKER_PROCESSES = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+# Circuit breaker: open after this many consecutive failed calls, for this many seconds
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+GEMINI_BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30"))
+
+# Priority classes, most urgent first
+PRIORITIES = ("interactive", "upload", "backfill")
+
+# Admission control: requests admitted at once per priority class, and per client
+# within a class. A request may make several LLM calls (an upload makes 5-10),
+# so only new requests are turned away, never the calls of an admitted one.
+LLM_QUEUE_LIMITS = {
+    "interactive": int(os.getenv("LLM_QUEUE_LIMIT_INTERACTIVE", "100")),
+    "upload": int(os.getenv("LLM_QUEUE_LIMIT_UPLOAD", "10")),
+    "backfill": int(os.getenv("LLM_QUEUE_LIMIT_BACKFILL", "4")),
+}
+LLM_QUEUE_LIMIT_PER_CLIENT = int(os.getenv("LLM_QUEUE_LIMIT_PER_CLIENT", "5"))
+
+class LLMUnavailableError(Exception):
+    """The LLM could not be reached (quota exhausted, outage, circuit open)"""
+
+    def __init__(self, message: str, retry_after: float = GEMINI_BREAKER_COOLDOWN):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class LLMOverloadedError(LLMUnavailableError):
+    """Too many requests are already waiting for this priority class or client (HTTP 429)"""
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second, holding at most `capacity`"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token; return how long to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    async def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            with LLM_QUEUE_DEPTH.track_inprogress():
+                await asyncio.sleep(wait)
+
+    def try_acquire(self) -> bool:
+        """Take a token only if one is available right now"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def refund(self):
+        """Return a token taken by `_reserve` that ended up unused"""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+class FairScheduler:
+    """Hand out rate-limit tokens by priority class, round-robin between clients within a class
+
+    Calls pass straight through while nobody is waiting. Otherwise they queue
+    and a dispatcher task grants each new token to the oldest call of the
+    next client (in turn) in the most urgent non-empty class. Lower classes
+    only get tokens when higher ones have nothing waiting.
+    """
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        # priority -> client -> waiting calls; clients rotate to the back when served
+        self._queues: Dict[str, "OrderedDict[str, Deque[asyncio.Future]]"] = {p: OrderedDict() for p in PRIORITIES}
+        self._queued = dict.fromkeys(PRIORITIES, 0)
+        self._dispatcher: Optional[asyncio.Task] = None
+        # Requests admitted by `llm_priority` and not finished yet
+        self._admitted = dict.fromkeys(PRIORITIES, 0)
+        self._admitted_by_client: Dict[Tuple[str, str], int] = {}
+
+    def retry_after(self, priority: str) -> float:
+        """Rough time until a new call of this class would be served"""
+        ahead = sum(self._queued[p] for p in PRIORITIES[:PRIORITIES.index(priority) + 1])
+        return max(1.0, (ahead + 1) / self.bucket.rate)
+
+    def check_admission(self, priority: str, client: str):
+        reason = None
+        if self._admitted[priority] >= LLM_QUEUE_LIMITS[priority]:
+            reason = "class_full"
+        elif self._admitted_by_client.get((priority, client), 0) >= LLM_QUEUE_LIMIT_PER_CLIENT:
+            reason = "client_full"
+        if reason:
+            LLM_SCHEDULER_REJECTED.labels(priority, reason).inc()
+            raise LLMOverloadedError(
+                "Too many requests are waiting for the AI service. Please try again shortly.",
+                retry_after=self.retry_after(priority)
+            )
+
+    def admit(self, priority: str, client: str):
+        self.check_admission(priority, client)
+        self._admitted[priority] += 1
+        self._admitted_by_client[(priority, client)] = self._admitted_by_client.get((priority, client), 0) + 1
+
+    def release(self, priority: str, client: str):
+        self._admitted[priority] -= 1
+        remaining = self._admitted_by_client.pop((priority, client)) - 1
+        if remaining:
+            self._admitted_by_client[(priority, client)] = remaining
+
+    async def acquire(self, priority: str, client: str):
+        if not any(self._queued.values()) and self.bucket.try_acquire():
+            LLM_SCHEDULER_WAIT.labels(priority).observe(0)
+            return
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queues[priority].setdefault(client, deque()).append(future)
+        self._queued[priority] += 1
+        LLM_SCHEDULER_QUEUED.labels(priority).inc()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch())
+
+        started_at = time.perf_counter()
+        try:
+            with LLM_QUEUE_DEPTH.track_inprogress():
+                await future
+        except asyncio.CancelledError:
+            self._discard(priority, client, future)
+            raise
+        LLM_SCHEDULER_WAIT.labels(priority).observe(time.perf_counter() - started_at)
+
+    def _discard(self, priority: str, client: str, future: asyncio.Future):
+        """Forget a cancelled call that is still queued"""
+        waiters = self._queues[priority].get(client)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            if not waiters:
+                del self._queues[priority][client]
+            self._queued[priority] -= 1
+            LLM_SCHEDULER_QUEUED.labels(priority).dec()
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        for priority in PRIORITIES:
+            clients = self._queues[priority]
+            while clients:
+                client, waiters = clients.popitem(last=False)
+                future = waiters.popleft()
+                if waiters:
+                    clients[client] = waiters
+                self._queued[priority] -= 1
+                LLM_SCHEDULER_QUEUED.labels(priority).dec()
+                if not future.done():
+                    return future
+        return None
+
+    async def _dispatch(self):
+        while any(self._queued.values()):
+            wait = self.bucket._reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            future = self._next_waiter()
+            if future is None:
+                # Everyone waiting was cancelled meanwhile
+                self.bucket.refund()
+            else:
+                future.set_result(None)
+
+class CircuitBreaker:
+    """Fail fast after repeated failures; let one trial call through after the cooldown"""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.cooldown - (time.monotonic() - self.opened_at)
+            if remaining > 0 or self._trial_in_progress:
+                raise LLMUnavailableError(
+                    "The AI service is temporarily unavailable. Please try again shortly.",
+                    retry_after=max(remaining, 1.0)
+                )
+            # Half-open: this call is the trial
+            self._trial_in_progress = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_progress = False
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    def cancel_trial(self):
+        """The call says nothing about the service's health: let another one be the trial
+
+        For calls abandoned (cancelled) before they had an outcome, and
+        calls rejected for a reason of their own (bad request, invalid key).
+        The failure count is left as it is.
+        """
+        with self._lock:
+            self._trial_in_progress = False
+
+_bucket = TokenBucket(rate=GEMINI_RPM / 60.0 / WORKER_PROCESSES, capacity=GEMINI_BURST // WORKER_PROCESSES)
+_breaker = CircuitBreaker(GEMINI_BREAKER_THRESHOLD, GEMINI_BREAKER_COOLDOWN)
+_in_flight: Dict[Tuple[int, str], asyncio.Task] = {}
+# Futures belong to one event loop: one scheduler per loop, all sharing the bucket
+_schedulers: Dict[int, FairScheduler] = {}
+# (priority class, client) of the LLM calls made in the current context
+_scheduling: contextvars.ContextVar = contextvars.ContextVar("llm_scheduling", default=("interactive", "anonymous"))
+
+def _scheduler() -> FairScheduler:
+    loop_id = id(asyncio.get_running_loop())
+    if loop_id not in _schedulers:
+        _schedulers[loop_id] = FairScheduler(_bucket)
+    return _schedulers[loop_id]
+
+def client_id(request) -> str:
+    """Fair-queuing key for an HTTP request: the X-User-Id header, else the caller's address"""
+    user_id = request.headers.get("X-User-Id")
+    if user_id:
+        return f"user:{user_id}"
+    return f"ip:{request.client.host}" if request.client else "anonymous"
+
+def check_llm_admission(priority: str, client: Optional[str] = None):
+    """Raise LLMOverloadedError if `llm_priority` would turn this request away
+
+    For streaming responses, whose LLM calls start after the status is sent.
+    """
+    _scheduler().check_admission(priority, client or "anonymous")
+
+@contextmanager
+def llm_priority(priority: str, client: Optional[str] = None):
+    """Admit a request and schedule its LLM calls in a priority class, queued fairly per client
+
+    Calls outside any block are "interactive" and never rejected. Raises
+    LLMOverloadedError when the class (or the client) already has its limit
+    of admitted requests, before the request has spent anything.
+    """
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown LLM priority class '{priority}'")
+    client = client or "anonymous"
+    scheduler = _scheduler()
+    scheduler.admit(priority, client)
+    token = _scheduling.set((priority, client))
+    try:
+        yield
+    finally:
+        _scheduling.reset(token)
+        scheduler.release(priority, client)
+
+async def _acquire_slot():
+    """Wait for a rate-limit token according to the current priority class and client"""
+    await _scheduler().acquire(*_scheduling.get())
+
+def _backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * (2 ** attempt)))
+
+async def _call_with_retries(prompt: str, generation_config: Optional[dict],
+                             cached_content: Optional[str] = None, operation: str = "generate") -> LLMResponse:
+    provider = get_provider()
+    with span(f"llm.{operation}", **{
+        "llm.provider": provider.name,
+        "llm.prompt_chars": len(prompt),
+        "llm.context_cached": cached_content is not None
+    }) as llm_span:
+        response = await _attempt_calls(provider, prompt, generation_config, cached_content, operation, llm_span)
+        llm_span.set_attributes({
+            "llm.finish_reason": response.finish_reason,
+            "llm.prompt_tokens": response.prompt_tokens,
+            "llm.candidate_tokens": response.candidate_tokens,
+            "llm.cached_tokens": response.cached_tokens
+        })
+        return response
+
+async def _attempt_calls(provider, prompt: str, generation_config: Optional[dict],
+                         cached_content: Optional[str], operation: str, llm_span) -> LLMResponse:
+    _breaker.before_call()
+    started_at = time.perf_counter()
+
+    last_error = None
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        llm_span.set_attribute("llm.attempts", attempt + 1)
+        await _acquire_slot()
+        try:
+            with LLM_IN_FLIGHT.track_inprogress():
+                response = await asyncio.wait_for(
+                    provider.generate(prompt, generation_config, cached_content),
+                    timeout=GEMINI_TIMEOUT
+                )
+        except provider.retryable_errors as e:
+            last_error = e
+            if attempt < GEMINI_MAX_RETRIES:
+                delay = _backoff_delay(attempt)
+                print(f"Warning: {provider.name} call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                with LLM_QUEUE_DEPTH.track_inprogress():
+                    await asyncio.sleep(delay)
+            continue
+        except Exception:
+            # Not transient (bad request, invalid key...): don't retry, and don't count it
+            # either way (as a success it would close the circuit while the service fails)
+            _breaker.cancel_trial()
+            record_usage(provider.name, operation, latency_ms=_elapsed_ms(started_at), error=True)
+            raise
+        _breaker.record_success()
+        record_usage(provider.name, operation, response, latency_ms=_elapsed_ms(started_at))
+        return response
+
+    _breaker.record_failure()
+    record_usage(provider.name, operation, latency_ms=_elapsed_ms(started_at), error=True)
+    raise LLMUnavailableError(
+        f"The AI service is unavailable after {GEMINI_MAX_RETRIES + 1} attempts: {last_error}",
+        retry_after=GEMINI_BACKOFF_MAX
+    )
+
+def _elapsed_ms(started_at: float) -> float:
+    return (time.perf_counter() - started_at) * 1000
+
+def _request_key(prompt: str, generation_config: Optional[dict], cached_content: Optional[str]) -> str:
+    payload = json.dumps([prompt, generation_config or {}, cached_content], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+async def generate(prompt: str, generation_config: Optional[dict] = None,
+                   cached_content: Optional[str] = None, operation: str = "generate") -> LLMResponse:
+    """Generate content; concurrent identical requests share one API call
+
+    `cached_content` is a handle from `create_cache`; its content is treated
+    as a prefix of the prompt. `operation` names the call in usage accounting;
+    a shared call is accounted once, to the request that started it.
+    """
+    loop = asyncio.get_running_loop()
+    key = (id(loop), _request_key(prompt, generation_config, cached_content))
+
+    task = _in_flight.get(key)
+    if task is None:
+        # Run the call as its own task so a cancelled caller doesn't cancel the others
+        task = loop.create_task(_call_with_retries(prompt, generation_config, cached_content, operation))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+    return await asyncio.shield(task)
+
+async def stream(prompt: str, generation_config: Optional[dict] = None,
+                 cached_content: Optional[str] = None, operation: str = "stream") -> AsyncIterator[str]:
+    """Stream generated text; retried only until the first piece has been received
+
+    Streamed pieces carry no usage metadata, so token counts are estimated
+    (~4 characters per token) rather than spending a count_tokens call.
+    """
+    provider = get_provider()
+    _breaker.before_call()
+    started_at = time.perf_counter()
+    pieces = []
+
+    try:
+        for attempt in range(GEMINI_MAX_RETRIES + 1):
+            await _acquire_slot()
+            started = False
+            try:
+                with LLM_IN_FLIGHT.track_inprogress():
+                    async for piece in provider.stream(prompt, generation_config, cached_content):
+                        started = True
+                        pieces.append(piece)
+                        yield piece
+            except provider.retryable_errors as e:
+                if started or attempt == GEMINI_MAX_RETRIES:
+                    _breaker.record_failure()
+                    record_usage(provider.name, operation, latency_ms=_elapsed_ms(started_at), error=True)
+                    raise LLMUnavailableError(f"The AI service is unavailable: {e}", retry_after=GEMINI_BACKOFF_MAX)
+                with LLM_QUEUE_DEPTH.track_inprogress():
+                    await asyncio.sleep(_backoff_delay(attempt))
+                continue
+            except Exception:
+                # Not transient: don't retry, don't count it (see _call_with_retries)
+                _breaker.cancel_trial()
+                record_usage(provider.name, operation, latency_ms=_elapsed_ms(started_at), error=True)
+                raise
+            _breaker.record_success()
+            usage = LLMResponse(
+                text="",
+                finish_reason="STOP",
+                prompt_tokens=len(prompt) // 4,
+                candidate_tokens=len("".join(pieces)) // 4
+            )
+            record_usage(provider.name, operation, usage, latency_ms=_elapsed_ms(started_at))
+            return
+    except BaseException:
+        # Outcomes above are already recorded; this also ends the trial when the
+        # client goes away (generator closed or cancelled) mid-answer
+        _breaker.cancel_trial()
+        raise
+
+async def count_tokens(prompt: str) -> int:
+    """Count prompt tokens with the configured provider"""
+    return await get_provider().count_tokens(prompt)
+
+async def create_cache(display_name: str, content: str, ttl_seconds: int) -> Optional[str]:
+    """Create a cached prompt prefix; None if unsupported or the call fails"""
+    provider = get_provider()
+    try:
+        _breaker.before_call()
+    except LLMUnavailableError as e:
+        print(f"Warning: could not create context cache '{display_name}': {e}")
+        return None
+    # Like generate: every call let through the breaker reports its outcome,
+    # or a half-open trial would never end and the circuit would stay open
+    try:
+        await _acquire_slot()
+        handle = await asyncio.wait_for(provider.create_cache(display_name, content, ttl_seconds), timeout=GEMINI_TIMEOUT)
+    except provider.retryable_errors as e:
+        _breaker.record_failure()
+        # Caching is an optimization: callers fall back to sending the content inline
+        print(f"Warning: could not create context cache '{display_name}': {e}")
+        return None
+    except Exception as e:
+        # Not an outage (unsupported model, content too short...): don't count it
+        _breaker.cancel_trial()
+        print(f"Warning: could not create context cache '{display_name}': {e}")
+        return None
+    except BaseException:
+        _breaker.cancel_trial()
+        raise
+    _breaker.record_success()
+    return handle
+
+async def delete_cache(handle: str):
+    try:
+        await get_provider().delete_cache(handle)
+    except Exception as e:
+        print(f"Warning: could not delete context cache '{handle}': {e}")
@@ -0,0 +1,387 @@
+"""LLM providers behind a common interface, selected with LLM_PROVIDER.
+
+- "gemini" (default): Google Gemini via google-generativeai.
+- "fake": deterministic offline stand-in with simulated latency, for load
+  tests and benchmarks that must not burn quota or need the network.
+- "local": any OpenAI-compatible server running a local model
+  (Ollama, llama.cpp server, vLLM...).
+
+Providers only talk to the model; rate limiting, retries and coalescing
+live in `utils.llm_client`.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import AsyncIterator, Optional
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini").lower()
+
+@dataclass
+class LLMResponse:
+    text: str
+    finish_reason: str  # "STOP", "MAX_TOKENS", "SAFETY", ... or "BLOCKED" when no candidates
+    # Token usage as reported by the provider (prompt_tokens includes cached_tokens)
+    prompt_tokens: int = 0
+    candidate_tokens: int = 0
+    cached_tokens: int = 0
+
+class LLMProvider:
+    """Interface every provider implements"""
+
+    name = "base"
+    # Exceptions worth retrying (rate limits, transient server errors)
+    retryable_errors = (asyncio.TimeoutError, ConnectionError)
+
+    async def generate(self, prompt: str, generation_config: Optional[dict] = None,
+                       cached_content: Optional[str] = None) -> LLMResponse:
+        raise NotImplementedError
+
+    async def stream(self, prompt: str, generation_config: Optional[dict] = None,
+                     cached_content: Optional[str] = None) -> AsyncIterator[str]:
+        """Yield the answer text in pieces as it is generated"""
+        response = await self.generate(prompt, generation_config, cached_content)
+        yield response.text
+
+    async def count_tokens(self, prompt: str) -> int:
+        # Rough estimate; providers with a tokenizer endpoint override this
+        return max(1, len(prompt) // 4)
+
+    async def create_cache(self, display_name: str, content: str, ttl_seconds: int) -> Optional[str]:
+        """Cache a prompt prefix server-side; return a handle for `cached_content`
+
+        Providers without context caching return None and callers send the
+        content inline instead.
+        """
+        return None
+
+    async def delete_cache(self, handle: str):
+        pass
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    FINISH_REASONS = {
+        1: "STOP",
+        2: "SAFETY",
+        3: "RECITATION",
+        4: "OTHER",
+        5: "MAX_TOKENS"
+    }
+
+    def __init__(self):
+        import google.generativeai as genai
+        from google.api_core import exceptions as google_exceptions
+
+        self.model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+        self.retryable_errors = (
+            google_exceptions.TooManyRequests,
+            google_exceptions.ResourceExhausted,
+            google_exceptions.InternalServerError,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.DeadlineExceeded,
+            asyncio.TimeoutError,
+            ConnectionError,
+        )
+        # Remove safety filters - set to BLOCK_NONE for educational content
+        self.safety_settings = {
+            genai.types.HarmCategory.HARM_CATEGORY_HARASSMENT: genai.types.HarmBlockThreshold.BLOCK_NONE,
+            genai.types.HarmCategory.HARM_CATEGORY_HATE_SPEECH: genai.types.HarmBlockThreshold.BLOCK_NONE,
+            genai.types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: genai.types.HarmBlockThreshold.BLOCK_NONE,
+            genai.types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: genai.types.HarmBlockThreshold.BLOCK_NONE,
+        }
+        self._genai = genai
+        self._model = None
+        self._cached_models = {}
+
+    def _get_model(self):
+        """Lazy initialization of Gemini model"""
+        if self._model is None:
+            api_key = os.getenv("GEMINI_API_KEY")
+            if not api_key:
+                raise ValueError(
+                    "GEMINI_API_KEY environment variable is not set. "
+                    "Please create a .env file in the backend directory with: GEMINI_API_KEY=your_key_here"
+                )
+
+            self._genai.configure(api_key=api_key)
+            self._model = self._genai.GenerativeModel(self.model_name)
+
+        return self._model
+
+    def _to_llm_response(self, response) -> LLMResponse:
+        """Extract text, finish reason and token usage from a Gemini response"""
+        usage = getattr(response, "usage_metadata", None)
+        tokens = {
+            "prompt_tokens": getattr(usage, "prompt_token_count", 0) or 0,
+            "candidate_tokens": getattr(usage, "candidates_token_count", 0) or 0,
+            "cached_tokens": getattr(usage, "cached_content_token_count", 0) or 0,
+        }
+        if not response.candidates:
+            return LLMResponse(text="", finish_reason="BLOCKED", **tokens)
+
+        candidate = response.candidates[0]
+        finish_reason = self.FINISH_REASONS.get(int(candidate.finish_reason), f"UNKNOWN ({candidate.finish_reason})")
+        text = ""
+        if candidate.content and candidate.content.parts:
+            text = "".join([part.text for part in candidate.content.parts if hasattr(part, 'text')])
+        return LLMResponse(text=text.strip(), finish_reason=finish_reason, **tokens)
+
+    async def _model_for(self, cached_content: Optional[str]):
+        """The plain model, or one bound to a cached prompt prefix (looked up once per handle)"""
+        if cached_content is None:
+            return self._get_model()
+        if cached_content not in self._cached_models:
+            from google.generativeai import caching
+
+            self._get_model()
+            # A blocking API call: keep it off the event loop
+            cache = await asyncio.to_thread(caching.CachedContent.get, cached_content)
+            self._cached_models[cached_content] = self._genai.GenerativeModel.from_cached_content(cached_content=cache)
+        return self._cached_models[cached_content]
+
+    async def create_cache(self, display_name: str, content: str, ttl_seconds: int) -> Optional[str]:
+        from google.generativeai import caching
+
+        self._get_model()
+        cache = await asyncio.to_thread(
+            caching.CachedContent.create,
+            model=f"models/{self.model_name}",
+            display_name=display_name,
+            contents=[content],
+            ttl=timedelta(seconds=ttl_seconds)
+        )
+        self._cached_models[cache.name] = self._genai.GenerativeModel.from_cached_content(cached_content=cache)
+        return cache.name
+
+    async def delete_cache(self, handle: str):
+        from google.generativeai import caching
+
+        self._cached_models.pop(handle, None)
+        cache = await asyncio.to_thread(caching.CachedContent.get, handle)
+        await asyncio.to_thread(cache.delete)
+
+    async def generate(self, prompt: str, generation_config: Optional[dict] = None,
+                       cached_content: Optional[str] = None) -> LLMResponse:
+        model = await self._model_for(cached_content)
+        response = await model.generate_content_async(
+            prompt,
+            generation_config=generation_config,
+            safety_settings=self.safety_settings
+        )
+        return self._to_llm_response(response)
+
+    async def stream(self, prompt: str, generation_config: Optional[dict] = None,
+                     cached_content: Optional[str] = None) -> AsyncIterator[str]:
+        model = await self._model_for(cached_content)
+        response = await model.generate_content_async(
+            prompt,
+            generation_config=generation_config,
+            safety_settings=self.safety_settings,
+            stream=True
+        )
+        async for chunk in response:
+            try:
+                if chunk.text:
+                    yield chunk.text
+            except ValueError:
+                # Chunk without text parts (e.g. final chunk carrying only the finish reason)
+                continue
+
+    async def count_tokens(self, prompt: str) -> int:
+        result = await self._get_model().count_tokens_async(prompt)
+        return result.total_tokens
+
+class FakeProvider(LLMProvider):
+    """Deterministic offline provider: same prompt, same answer, realistic timing
+
+    FAKE_LLM_LATENCY_MS        fixed latency per call (time to first token)
+    FAKE_LLM_MS_PER_TOKEN      additional latency per generated token
+    FAKE_LLM_OUTPUT_TOKENS     tokens generated for free-text answers
+    FAKE_LLM_ERROR_RATE        fraction of calls failing with a retryable error
+    """
+
+    name = "fake"
+
+    WORDS = (
+        "lesson concept example learning students explain important idea process "
+        "result principle method analysis structure summary knowledge practice"
+    ).split()
+
+    def __init__(self):
+        self.latency_ms = float(os.getenv("FAKE_LLM_LATENCY_MS", "300"))
+        self.ms_per_token = float(os.getenv("FAKE_LLM_MS_PER_TOKEN", "5"))
+        self.output_tokens = int(os.getenv("FAKE_LLM_OUTPUT_TOKENS", "120"))
+        self.error_rate = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+        self._calls = 0
+        self._caches = {}
+
+    def _rng(self, prompt: str) -> random.Random:
+        return random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+
+    def _text(self, prompt: str, generation_config: Optional[dict]) -> str:
+        rng = self._rng(prompt)
+        limit = (generation_config or {}).get("max_output_tokens", self.output_tokens)
+        # Prefer words from the prompt so answers look topical
+        vocabulary = [w for w in prompt.split() if w.isalpha() and len(w) > 3][:200] or self.WORDS
+        return " ".join(rng.choice(vocabulary) for _ in range(min(self.output_tokens, limit)))
+
+    def _fake_json(self, schema: dict, rng: random.Random, depth: int = 0):
+        """Build a value that satisfies a (JSON/OpenAPI subset) response schema"""
+        kind = str(schema.get("type", "string")).lower()
+        if kind == "object":
+            return {
+                name: self._fake_json(prop, rng, depth + 1)
+                for name, prop in schema.get("properties", {}).items()
+            }
+        if kind == "array":
+            count = schema.get("min_items", 3 if depth == 0 else 4)
+            return [self._fake_json(schema.get("items", {}), rng, depth + 1) for _ in range(count)]
+        if kind == "integer":
+            if "enum" in schema:
+                return rng.choice(schema["enum"])
+            return rng.randint(schema.get("minimum", 0), schema.get("maximum", 3))
+        if kind == "number":
+            return round(rng.random(), 3)
+        if kind == "boolean":
+            return rng.random() < 0.5
+        if "enum" in schema:
+            return rng.choice(schema["enum"])
+        return " ".join(rng.choice(self.WORDS) for _ in range(rng.randint(3, 8))).capitalize()
+
+    async def _simulate(self, tokens: int):
+        await asyncio.sleep((self.latency_ms + self.ms_per_token * tokens) / 1000)
+
+    def _maybe_fail(self):
+        self._calls += 1
+        if self.error_rate and random.Random(self._calls).random() < self.error_rate:
+            raise ConnectionError("Simulated rate limit (FakeProvider)")
+
+    async def create_cache(self, display_name: str, content: str, ttl_seconds: int) -> Optional[str]:
+        # Local stand-in for Gemini context caching
+        handle = f"cachedContents/fake-{hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]}"
+        self._caches[handle] = content
+        await asyncio.sleep(self.latency_ms / 1000)
+        return handle
+
+    async def delete_cache(self, handle: str):
+        self._caches.pop(handle, None)
+
+    def _with_cache(self, prompt: str, cached_content: Optional[str]) -> str:
+        if cached_content is None:
+            return prompt
+        if cached_content not in self._caches:
+            raise LookupError(f"Unknown cached content '{cached_content}'")
+        return self._caches[cached_content] + "\n\n" + prompt
+
+    async def generate(self, prompt: str, generation_config: Optional[dict] = None,
+                       cached_content: Optional[str] = None) -> LLMResponse:
+        self._maybe_fail()
+        full_prompt = self._with_cache(prompt, cached_content)
+        config = generation_config or {}
+        if config.get("response_mime_type") == "application/json" and config.get("response_schema"):
+            text = json.dumps(self._fake_json(config["response_schema"], self._rng(full_prompt)))
+        else:
+            text = self._text(full_prompt, config)
+        await self._simulate(len(text) // 4)
+        return LLMResponse(
+            text=text,
+            finish_reason="STOP",
+            prompt_tokens=await self.count_tokens(full_prompt),
+            candidate_tokens=await self.count_tokens(text),
+            cached_tokens=await self.count_tokens(self._caches[cached_content]) if cached_content else 0
+        )
+
+    async def stream(self, prompt: str, generation_config: Optional[dict] = None,
+                     cached_content: Optional[str] = None) -> AsyncIterator[str]:
+        self._maybe_fail()
+        prompt = self._with_cache(prompt, cached_content)
+        await asyncio.sleep(self.latency_ms / 1000)
+        for word in self._text(prompt, generation_config).split():
+            await asyncio.sleep(self.ms_per_token / 1000)
+            yield word + " "
+
+class LocalProvider(LLMProvider):
+    """Local model behind an OpenAI-compatible chat completions endpoint
+
+    LOCAL_LLM_URL    base URL, e.g. http://localhost:11434/v1 (Ollama)
+    LOCAL_LLM_MODEL  model name served by that endpoint
+    """
+
+    name = "local"
+
+    def __init__(self):
+        import httpx
+
+        self.base_url = os.getenv("LOCAL_LLM_URL", "http://localhost:11434/v1").rstrip("/")
+        self.model_name = os.getenv("LOCAL_LLM_MODEL", "llama3.2")
+        self.retryable_errors = (httpx.TransportError, asyncio.TimeoutError, ConnectionError)
+        self._client = httpx.AsyncClient(base_url=self.base_url, timeout=120)
+
+    def _payload(self, prompt: str, generation_config: Optional[dict], stream: bool) -> dict:
+        config = generation_config or {}
+        payload = {
+            "model": self.model_name,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": config.get("temperature", 0.7),
+            "stream": stream
+        }
+        if "max_output_tokens" in config:
+            payload["max_tokens"] = config["max_output_tokens"]
+        if config.get("response_mime_type") == "application/json":
+            payload["response_format"] = {"type": "json_object"}
+        return payload
+
+    def _raise_for_status(self, response):
+        """Rate limits and server errors as retryable ConnectionErrors, other errors as HTTPStatusError"""
+        if response.status_code in (429, 500, 502, 503, 504):
+            raise ConnectionError(f"Local LLM returned {response.status_code}")
+        response.raise_for_status()
+
+    async def generate(self, prompt: str, generation_config: Optional[dict] = None,
+                       cached_content: Optional[str] = None) -> LLMResponse:
+        response = await self._client.post("/chat/completions", json=self._payload(prompt, generation_config, False))
+        self._raise_for_status(response)
+        data = response.json()
+        choice = data["choices"][0]
+        usage = data.get("usage") or {}
+        finish_reason = {"stop": "STOP", "length": "MAX_TOKENS"}.get(choice.get("finish_reason"), "OTHER")
+        return LLMResponse(
+            text=(choice["message"]["content"] or "").strip(),
+            finish_reason=finish_reason,
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            candidate_tokens=usage.get("completion_tokens", 0)
+        )
+
+    async def stream(self, prompt: str, generation_config: Optional[dict] = None,
+                     cached_content: Optional[str] = None) -> AsyncIterator[str]:
+        payload = self._payload(prompt, generation_config, True)
+        async with self._client.stream("POST", "/chat/completions", json=payload) as response:
+            self._raise_for_status(response)
+            async for line in response.aiter_lines():
+                if not line.startswith("data: ") or line == "data: [DONE]":
+                    continue
+                delta = json.loads(line[len("data: "):])["choices"][0].get("delta", {})
+                if delta.get("content"):
+                    yield delta["content"]
+
+PROVIDERS = {
+    "gemini": GeminiProvider,
+    "fake": FakeProvider,
+    "local": LocalProvider,
+}
+
+_provider = None
+
+def get_provider() -> LLMProvider:
+    """Provider selected by LLM_PROVIDER (created once per process)"""
+    global _provider
+
+    if _provider is None:
+        if LLM_PROVIDER not in PROVIDERS:
+            raise ValueError(f"Unknown LLM_PROVIDER '{LLM_PROVIDER}'. Choose one of: {', '.join(PROVIDERS)}")
+        _provider = PROVIDERS[LLM_PROVIDER]()
+    return _provider
@@ -1,292 +1,516 @@
+import asyncio
 import os
-import google.generativeai as genai
-from typing import Dict, List
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 import json
 
-# Global variables for model initialization
-_model = None
-_genai_configured = False
-
-def _get_model():
-    """Lazy initialization of Gemini model"""
-    global _model, _genai_configured
-    
-    if _model is None:
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError(
-                "GEMINI_API_KEY environment variable is not set. "
-                "Please create a .env file in the backend directory with: GEMINI_API_KEY=your_key_here"
-            )
-        
-        genai.configure(api_key=api_key)
-        _genai_configured = True
-        _model = genai.GenerativeModel('gemini-2.5-flash')
-    
-    return _model
+from utils.llm_client import generate, stream, LLMUnavailableError
+from utils.context_cache import get_lesson_cache
+from utils.metrics import stage_timer
+from utils.quiz_parser import (
+    BATCH_ANSWER_SCHEMA,
+    FAQ_ITEM_SCHEMA,
+    QUIZ_QUESTION_SCHEMA,
+    TAGGED_QUIZ_QUESTION_SCHEMA,
+    BatchAnswer,
+    FAQItem,
+    QuizQuestion,
+    QuizStreamParser,
+    TaggedQuizQuestion,
+    dedupe_questions,
+    parse_quiz,
+    quiz_schema,
+    validate_questions,
+)
+
+# Generate title, explanation and quiz in one structured call during upload
+LLM_COMBINED_GENERATION = os.getenv("LLM_COMBINED_GENERATION", "false").lower() in ("1", "true", "yes")
+
+# Extra generation rounds for questions lost to truncation or validation
+QUIZ_TOP_UP_ATTEMPTS = 2
+
+# Questions generated per lesson at upload, split evenly between difficulties
+QUESTION_BANK_SIZE = int(os.getenv("QUESTION_BANK_SIZE", "30"))
+DIFFICULTIES = ("easy", "medium", "hard")
+
+# Anticipated student questions answered at upload (see utils/faq.py): FAQ_COUNT
+# for the whole lesson, plus FAQ_PER_SECTION for each FAQ_SECTION_CHARS of long lessons
+FAQ_COUNT = int(os.getenv("FAQ_COUNT", "10"))
+FAQ_PER_SECTION = int(os.getenv("FAQ_PER_SECTION", "3"))
+FAQ_SECTION_CHARS = int(os.getenv("FAQ_SECTION_CHARS", "8000"))
+
+# Individual calls in flight for questions a batch answer left out
+BATCH_ANSWER_CONCURRENCY = int(os.getenv("BATCH_ANSWER_CONCURRENCY", "3"))
+
+def _lesson_block(content: str, cached_content: Optional[str]) -> str:
+    """Lesson content for a prompt, or a pointer to it when it is in the context cache"""
+    if cached_content:
+        return "Use the lesson content provided above."
+    return f"Lesson content:\n{content}"
+
+def _fallback_title(content: str) -> str:
+    return f"Lesson {hash(content) % 10000}"
 
 async def generate_lesson_title(content: str) -> str:
     """Generate a title for the lesson based on content"""
     try:
-        model = _get_model()
         prompt = f"""You are an educational content expert. Generate a concise, descriptive title (maximum 10 words) for the given lesson content.
 
 Lesson content:
 {content[:1000]}
 
 Generate a title:"""
-        
-        response = model.generate_content(prompt)
-        
-        # Check if response was blocked or filtered
-        if not response.candidates or len(response.candidates) == 0:
-            return f"Lesson {hash(content) % 10000}"  # Fallback title
-        
-        candidate = response.candidates[0]
-        if candidate.finish_reason != 1:  # 1 = STOP (normal completion)
-            return f"Lesson {hash(content) % 10000}"  # Fallback title
-        
-        try:
-            return response.text.strip()
-        except Exception:
-            # Try to get text from parts
-            if candidate.content and candidate.content.parts:
-                text = "".join([part.text for part in candidate.content.parts if hasattr(part, 'text')])
-                return text.strip() if text else f"Lesson {hash(content) % 10000}"
-            return f"Lesson {hash(content) % 10000}"  # Fallback title
-    except ValueError as e:
-        # Re-raise ValueError (API key missing) with clear message
+
+        response = await generate(prompt, operation="title")
+
+        # Check if response was blocked, filtered or empty
+        if response.finish_reason != "STOP" or not response.text:
+            return _fallback_title(content)
+
+        return response.text
+    except (ValueError, LLMUnavailableError):
+        # Re-raise configuration (API key missing) and availability errors
         raise
     except Exception as e:
-        return f"Lesson {hash(content) % 10000}"  # Fallback title
+        return _fallback_title(content)
 
-async def generate_explanation(content: str) -> str:
-    """Generate an explanation/summary of the lesson"""
-    try:
-        model = _get_model()
-        
-        # Use full content (don't limit to avoid truncating important info)
-        prompt = f"""You are an educational assistant. Provide a clear, comprehensive explanation of the lesson content in 2-3 paragraphs.
+async def generate_explanation(content: str, cached_content: Optional[str] = None) -> str:
+    """Generate an explanation/summary of the lesson
 
-Lesson content:
-{content}
+    Raises LLMUnavailableError when the service cannot be reached, so a
+    transient outage never ends up stored as the lesson's explanation.
+    """
+    # Use full content (don't limit to avoid truncating important info)
+    prompt = f"""You are an educational assistant. Provide a clear, comprehensive explanation of the lesson content in 2-3 paragraphs.
+
+{_lesson_block(content, cached_content)}
 
 Explanation:"""
-        
-        # Configure generation settings
-        generation_config = {
-            "temperature": 0.7,
-            "max_output_tokens": 1000,
-        }
-        
-        # Remove safety filters - set to BLOCK_NONE for educational content
-        safety_settings = {
-            genai.types.HarmCategory.HARM_CATEGORY_HARASSMENT: genai.types.HarmBlockThreshold.BLOCK_NONE,
-            genai.types.HarmCategory.HARM_CATEGORY_HATE_SPEECH: genai.types.HarmBlockThreshold.BLOCK_NONE,
-            genai.types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: genai.types.HarmBlockThreshold.BLOCK_NONE,
-            genai.types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: genai.types.HarmBlockThreshold.BLOCK_NONE,
-        }
-        
-        response = model.generate_content(
-            prompt,
-            generation_config=generation_config,
-            safety_settings=safety_settings
-        )
-        
-        # Check if response was blocked or filtered
-        if not response.candidates or len(response.candidates) == 0:
-            return "Explanation generation failed. No response from API. Please try again."
-        
-        candidate = response.candidates[0]
-        
-        # Handle different finish reasons
-        if candidate.finish_reason != 1:  # 1 = STOP (normal completion)
-            # If blocked despite no safety filters, return informative message
-            finish_reason_map = {
-                2: "SAFETY",
-                3: "RECITATION", 
-                4: "OTHER",
-                5: "MAX_TOKENS"
-            }
-            reason = finish_reason_map.get(candidate.finish_reason, f"UNKNOWN ({candidate.finish_reason})")
-            return f"Explanation generation stopped early (reason: {reason}). Please try again or review the lesson content manually."
-        
-        try:
-            return response.text.strip()
-        except Exception as e:
-            # Try to get text from parts
-            if candidate.content and candidate.content.parts:
-                text = "".join([part.text for part in candidate.content.parts if hasattr(part, 'text')])
-                return text.strip() if text else f"Explanation generation failed: {str(e)}. Please review the lesson content manually."
-            return f"Explanation generation failed: {str(e)}. Please review the lesson content manually."
-    except ValueError as e:
-        # Re-raise ValueError (API key missing) with clear message
-        raise
-    except Exception as e:
-        return f"Explanation generation failed: {str(e)}. Please review the lesson content manually."
 
-async def generate_quiz(content: str, num_questions: int = 5) -> List[Dict]:
-    """Generate multiple choice questions for the lesson"""
-    try:
-        model = _get_model()
-        
-        # Use full content (don't limit to avoid truncating important info)
-        prompt = f"""You are an educational assessment expert. Generate {num_questions} multiple choice questions based on the lesson content.
+    # Configure generation settings
+    generation_config = {
+        "temperature": 0.7,
+        "max_output_tokens": 1000,
+    }
+
+    response = await generate(prompt, generation_config, cached_content, operation="explanation")
+
+    # Check if response was blocked or filtered
+    if response.finish_reason == "BLOCKED":
+        return "Explanation generation failed. No response from API. Please try again."
+
+    # Handle different finish reasons
+    if response.finish_reason != "STOP":
+        # If blocked despite no safety filters, return informative message
+        return f"Explanation generation stopped early (reason: {response.finish_reason}). Please try again or review the lesson content manually."
+
+    if not response.text:
+        return "Explanation generation failed: empty response. Please review the lesson content manually."
+    return response.text
+
+async def _request_questions(content: str, count: int, existing: List[Dict],
+                             cached_content: Optional[str] = None,
+                             difficulty: Optional[str] = None) -> List[Dict]:
+    """Ask for `count` new questions and return the valid ones (partial responses included)
+
+    With a `difficulty` the questions are for the question bank: all of that
+    difficulty, each tagged with the topic it covers.
+    """
+    avoid = ""
+    if existing:
+        avoid = "\n\nDo not repeat any of these existing questions:\n" + "\n".join(f"- {q['question']}" for q in existing)
+
+    topic_field = ""
+    level = ""
+    if difficulty:
+        topic_field = ',\n    "topic": "Short topic name"'
+        level = f" All questions must be {difficulty} difficulty. Cover different parts of the lesson, and set topic to the 2-4 word topic each question tests."
+
+    # Use full content (don't limit to avoid truncating important info)
+    prompt = f"""You are an educational assessment expert. Generate {count} multiple choice questions based on the lesson content.
 
 Return the response as a JSON array with this exact format:
 [
   {{
     "question": "Question text here",
     "options": ["Option A", "Option B", "Option C", "Option D"],
-    "correct_answer": 0
+    "correct_answer": 0{topic_field}
   }}
 ]
 
-The correct_answer should be the index (0-3) of the correct option. Return ONLY the JSON array, no other text.
+The correct_answer should be the index (0-3) of the correct option.{level} Return ONLY the JSON array, no other text.{avoid}
 
-Lesson content:
-{content}
+{_lesson_block(content, cached_content)}
 
-Generate {num_questions} MCQs:"""
-        
-        generation_config = {
-            "temperature": 0.7,
-            "max_output_tokens": 2000,
-        }
-        
-        # Remove safety filters - set to BLOCK_NONE for educational content
-        safety_settings = {
-            genai.types.HarmCategory.HARM_CATEGORY_HARASSMENT: genai.types.HarmBlockThreshold.BLOCK_NONE,
-            genai.types.HarmCategory.HARM_CATEGORY_HATE_SPEECH: genai.types.HarmBlockThreshold.BLOCK_NONE,
-            genai.types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: genai.types.HarmBlockThreshold.BLOCK_NONE,
-            genai.types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: genai.types.HarmBlockThreshold.BLOCK_NONE,
-        }
-        
-        response = model.generate_content(
-            prompt,
-            generation_config=generation_config,
-            safety_settings=safety_settings
-        )
-        
-        # Check if response was blocked or filtered
-        if not response.candidates or len(response.candidates) == 0:
-            print("Warning: No candidates returned from Gemini API")
-            return []
-        
-        candidate = response.candidates[0]
-        
-        # Handle finish reasons - even with BLOCK_NONE, some reasons may still occur
-        if candidate.finish_reason != 1:  # 1 = STOP (normal completion)
-            finish_reason_map = {
-                2: "SAFETY",
-                3: "RECITATION",
-                4: "OTHER",
-                5: "MAX_TOKENS"
-            }
-            reason = finish_reason_map.get(candidate.finish_reason, f"UNKNOWN ({candidate.finish_reason})")
-            print(f"Warning: Quiz generation stopped early (reason: {reason})")
-            # Still try to extract text if available
-            if candidate.content and candidate.content.parts:
-                try:
-                    text = "".join([part.text for part in candidate.content.parts if hasattr(part, 'text')])
-                    if text:
-                        # Try to parse what we got
-                        result = text.strip()
-                        # Continue with normal parsing...
-                except:
-                    pass
-            return []
-        
-        # Safely get text from response
+Generate {count} MCQs:"""
+
+    generation_config = {
+        "temperature": 0.7,
+        "max_output_tokens": max(2000, 400 * count),
+        "response_mime_type": "application/json",
+        "response_schema": quiz_schema(count, TAGGED_QUIZ_QUESTION_SCHEMA if difficulty else QUIZ_QUESTION_SCHEMA),
+    }
+
+    operation = "question_bank" if difficulty else "quiz"
+    response = await generate(prompt, generation_config, cached_content, operation=operation)
+
+    # Check if response was blocked or filtered
+    if response.finish_reason == "BLOCKED":
+        print("Warning: No candidates returned from LLM provider")
+        return []
+
+    # Handle finish reasons - e.g. MAX_TOKENS: keep every question that was completed
+    if response.finish_reason != "STOP":
+        print(f"Warning: Quiz generation stopped early (reason: {response.finish_reason}), salvaging complete questions")
+
+    return parse_quiz(response.text, TaggedQuizQuestion if difficulty else QuizQuestion)
+
+async def complete_quiz(content: str, quiz: List[Dict], num_questions: int,
+                        cached_content: Optional[str] = None,
+                        difficulty: Optional[str] = None) -> List[Dict]:
+    """Top up a partial quiz by generating only the missing questions"""
+    quiz = validate_questions(quiz, TaggedQuizQuestion if difficulty else QuizQuestion)
+    for _ in range(QUIZ_TOP_UP_ATTEMPTS + 1):
+        missing = num_questions - len(quiz)
+        if missing <= 0:
+            break
         try:
-            result = response.text.strip()
+            new_questions = await _request_questions(content, missing, quiz, cached_content, difficulty)
+        except ValueError:
+            # Re-raise ValueError (API key missing) with clear message
+            raise
         except Exception as e:
-            print(f"Error accessing response.text: {str(e)}")
-            # Try to get text from parts
-            if candidate.content and candidate.content.parts:
-                result = "".join([part.text for part in candidate.content.parts if hasattr(part, 'text')])
-            else:
-                return []
-        
-        if not result:
-            return []
-        
-        # Try to extract JSON from markdown code blocks if present
-        if "```json" in result:
-            result = result.split("```json")[1].split("```")[0].strip()
-        elif "```" in result:
-            result = result.split("```")[1].split("```")[0].strip()
-        
-        # Remove any leading/trailing text that's not JSON
-        start_idx = result.find('[')
-        end_idx = result.rfind(']') + 1
-        if start_idx != -1 and end_idx > start_idx:
-            result = result[start_idx:end_idx]
-        
-        try:
-            quiz_data = json.loads(result)
-            return quiz_data if isinstance(quiz_data, list) else []
-        except json.JSONDecodeError as e:
-            print(f"Error parsing JSON from quiz response: {str(e)}")
-            return []
-    except ValueError as e:
-        # Re-raise ValueError (API key missing) with clear message
-        raise
-    except Exception as e:
-        print(f"Error generating quiz: {str(e)}")
-        # Return empty quiz on error
-        return []
+            # Includes LLMUnavailableError: keep what we have, the quiz is not stored
+            print(f"Error generating quiz: {str(e)}")
+            break
+        quiz = dedupe_questions(quiz + new_questions)
+    return quiz[:num_questions]
 
-async def answer_question(question: str, context: str) -> str:
-    """Answer a question based on lesson context"""
-    try:
-        model = _get_model()
-        prompt = f"""You are an educational assistant. Answer questions based on the provided lesson content. Be clear and concise.
+async def generate_quiz(content: str, num_questions: int = 5, cached_content: Optional[str] = None) -> List[Dict]:
+    """Generate multiple choice questions for the lesson
 
-Lesson content:
-{context}
+    Questions are validated one by one; questions lost to a malformed item or
+    a truncated response are regenerated individually instead of the whole quiz.
+    """
+    return await complete_quiz(content, [], num_questions, cached_content)
+
+async def generate_question_bank(content: str, size: int = QUESTION_BANK_SIZE,
+                                 cached_content: Optional[str] = None) -> List[Dict]:
+    """Generate a bank of questions tagged with difficulty and topic
+
+    One request per difficulty, run concurrently, each topped up like
+    `complete_quiz`. Quizzes are later assembled from the bank without an
+    LLM call (see `utils.question_bank`). May return fewer than `size`
+    questions, or none if the service is unavailable.
+    """
+    if cached_content is None:
+        cached_content = await get_lesson_cache(content)
+    per_difficulty = -(-size // len(DIFFICULTIES))
+    with stage_timer("lesson-materials", "question_bank"):
+        batches = await asyncio.gather(*(
+            complete_quiz(content, [], per_difficulty, cached_content, difficulty)
+            for difficulty in DIFFICULTIES
+        ))
+    bank = []
+    for difficulty, questions in zip(DIFFICULTIES, batches):
+        bank.extend(dict(question, difficulty=difficulty) for question in questions)
+    return dedupe_questions(bank)
 
-Question: {question}
+ANSWER_CONFIG = {
+    "temperature": 0.7,
+    "max_output_tokens": 1000,
+}
+
+NO_ANSWER = "I apologize, but I couldn't generate an answer. Please try rephrasing your question."
+
+def _answer_prompt(question: str, context: str, cached_content: Optional[str],
+                   history: Optional[str] = None) -> str:
+    conversation = f"{history}\n\n" if history else ""
+    return f"""You are an educational assistant. Answer questions based on the provided lesson content. Be clear and concise.
+
+{_lesson_block(context, cached_content)}
+
+{conversation}Question: {question}
 
 Answer:"""
-        
-        generation_config = {
-            "temperature": 0.7,
-            "max_output_tokens": 1000,
-        }
-        
-        # Remove safety filters for Q&A
-        safety_settings = {
-            genai.types.HarmCategory.HARM_CATEGORY_HARASSMENT: genai.types.HarmBlockThreshold.BLOCK_NONE,
-            genai.types.HarmCategory.HARM_CATEGORY_HATE_SPEECH: genai.types.HarmBlockThreshold.BLOCK_NONE,
-            genai.types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: genai.types.HarmBlockThreshold.BLOCK_NONE,
-            genai.types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: genai.types.HarmBlockThreshold.BLOCK_NONE,
-        }
-        
-        response = model.generate_content(
-            prompt,
-            generation_config=generation_config,
-            safety_settings=safety_settings
-        )
-        
+
+async def answer_question(question: str, context: str, cached_content: Optional[str] = None,
+                          history: Optional[str] = None) -> str:
+    """Answer a question based on lesson context
+
+    With a `cached_content` handle the whole lesson is already in the
+    provider's context cache, so only the question is sent. `history` is
+    the conversation so far for follow-up questions (see `utils.qa_sessions`).
+    Raises LLMUnavailableError when the service cannot be reached.
+    """
+    try:
+        prompt = _answer_prompt(question, context, cached_content, history)
+        response = await generate(prompt, ANSWER_CONFIG, cached_content, operation="answer")
+
         # Check if response was blocked or filtered
-        if not response.candidates or len(response.candidates) == 0:
+        if response.finish_reason == "BLOCKED":
             return "I apologize, but I couldn't generate an answer. The response was blocked. Please try rephrasing your question."
-        
-        candidate = response.candidates[0]
-        if candidate.finish_reason != 1:  # 1 = STOP (normal completion)
-            return f"I apologize, but I couldn't generate an answer (reason: {candidate.finish_reason}). Please try rephrasing your question."
-        
-        try:
-            return response.text.strip()
-        except Exception:
-            # Try to get text from parts
-            if candidate.content and candidate.content.parts:
-                text = "".join([part.text for part in candidate.content.parts if hasattr(part, 'text')])
-                return text.strip() if text else "I apologize, but I couldn't generate an answer. Please try rephrasing your question."
-            return "I apologize, but I couldn't generate an answer. Please try rephrasing your question."
+
+        if response.finish_reason != "STOP":
+            return f"I apologize, but I couldn't generate an answer (reason: {response.finish_reason}). Please try rephrasing your question."
+
+        return response.text or NO_ANSWER
+    except LLMUnavailableError:
+        raise
     except ValueError as e:
         # Re-raise ValueError (API key missing) with clear message
-        return f"Configuration error: {str(e)}. Please set GEMINI_API_KEY in your .env file."
+        return f"Configuration error: {str(e)}. Please check LLM_PROVIDER / GEMINI_API_KEY in your .env file."
     except Exception as e:
         return f"I apologize, but I encountered an error while processing your question: {str(e)}"
+
+async def answer_questions(questions: List[str], context: str, cached_content: Optional[str] = None) -> List[str]:
+    """Answer several questions about a lesson in one structured call
+
+    Questions missing from the response (truncation, invalid items) are
+    answered individually, at most BATCH_ANSWER_CONCURRENCY at a time.
+    Raises LLMUnavailableError when the service cannot be reached.
+    """
+    if len(questions) == 1:
+        return [await answer_question(questions[0], context, cached_content)]
+
+    numbered = "\n".join(f"{number}. {question}" for number, question in enumerate(questions, 1))
+    prompt = f"""You are an educational assistant. Answer each of the questions below based on the provided lesson content. Be clear and concise.
+
+{_lesson_block(context, cached_content)}
+
+Questions:
+{numbered}
+
+Return a JSON array with one {{"question_number": <number>, "answer": "..."}} object per question."""
+
+    generation_config = {
+        "temperature": 0.7,
+        "max_output_tokens": min(8000, ANSWER_CONFIG["max_output_tokens"] * len(questions)),
+        "response_mime_type": "application/json",
+        "response_schema": quiz_schema(len(questions), BATCH_ANSWER_SCHEMA),
+    }
+
+    answers: List[Optional[str]] = [None] * len(questions)
+    try:
+        response = await generate(prompt, generation_config, cached_content, operation="batch_answer")
+        if response.finish_reason != "STOP":
+            print(f"Warning: Batch answer stopped early (reason: {response.finish_reason}), salvaging complete answers")
+        for item in QuizStreamParser(BatchAnswer).feed(response.text or ""):
+            if item["question_number"] <= len(questions):
+                answers[item["question_number"] - 1] = item["answer"]
+    except LLMUnavailableError:
+        raise
+    except Exception as e:
+        # Includes configuration errors: answer_question reports those per question
+        print(f"Error in batch answer: {str(e)}")
+
+    missing = [i for i, answer in enumerate(answers) if answer is None]
+    if missing:
+        print(f"Warning: Batch answer incomplete, answering {len(missing)} of {len(questions)} questions individually")
+        semaphore = asyncio.Semaphore(BATCH_ANSWER_CONCURRENCY)
+
+        async def answer_one(i: int):
+            async with semaphore:
+                answers[i] = await answer_question(questions[i], context, cached_content)
+
+        await asyncio.gather(*(answer_one(i) for i in missing))
+    return answers
+
+async def stream_answer(question: str, context: str, cached_content: Optional[str] = None,
+                        history: Optional[str] = None) -> AsyncIterator[str]:
+    """Answer a question piece by piece, as the LLM generates it
+
+    Raises LLMUnavailableError when the service cannot be reached (before or
+    during the answer); other errors end the answer with an apology.
+    """
+    prompt = _answer_prompt(question, context, cached_content, history)
+    received = False
+    try:
+        async for piece in stream(prompt, ANSWER_CONFIG, cached_content, operation="answer"):
+            received = True
+            yield piece
+    except LLMUnavailableError:
+        raise
+    except ValueError as e:
+        yield f"Configuration error: {str(e)}. Please check LLM_PROVIDER / GEMINI_API_KEY in your .env file."
+        return
+    except Exception as e:
+        yield f"I apologize, but I encountered an error while processing your question: {str(e)}"
+        return
+    if not received:
+        yield NO_ANSWER
+
+async def summarize_conversation(summary: Optional[str], turns: List[Tuple[str, str]],
+                                 max_chars: int) -> Optional[str]:
+    """Fold (question, answer) turns into the running summary of a Q&A session
+
+    Returns None if no summary could be generated; the caller keeps the turns.
+    Raises LLMUnavailableError when the service cannot be reached.
+    """
+    earlier = f"Summary of the conversation so far:\n{summary}\n\n" if summary else ""
+    exchanges = "\n\n".join(f"Student: {question}\nAssistant: {answer}" for question, answer in turns)
+    prompt = f"""You are summarizing a conversation between a student and an educational assistant about a lesson. Update the summary with the new exchanges below. Keep what the student asked about, what they found confusing and the key points of the answers, so that follow-up questions can be understood. Use at most {max_chars} characters. Return only the summary.
+
+{earlier}New exchanges:
+{exchanges}
+
+Summary:"""
+
+    generation_config = {
+        "temperature": 0.3,
+        "max_output_tokens": max(200, max_chars // 3),
+    }
+    try:
+        response = await generate(prompt, generation_config, operation="summarize")
+    except LLMUnavailableError:
+        raise
+    except Exception as e:
+        print(f"Error summarizing conversation: {str(e)}")
+        return None
+    text = (response.text or "").strip()
+    return text[:max_chars] if text else None
+
+async def _request_faqs(content: str, count: int, cached_content: Optional[str] = None) -> List[Dict]:
+    """Ask for the `count` questions students are most likely to ask, with answers"""
+    prompt = f"""You are an educational assistant. List the {count} questions students are most likely to ask about the lesson content, each with a clear, concise answer based on the lesson content.
+
+Return the response as a JSON array of {{"question": "...", "answer": "..."}} objects. Return ONLY the JSON array, no other text.
+
+{_lesson_block(content, cached_content)}"""
+
+    generation_config = {
+        "temperature": 0.5,
+        "max_output_tokens": max(2000, 300 * count),
+        "response_mime_type": "application/json",
+        "response_schema": quiz_schema(count, FAQ_ITEM_SCHEMA),
+    }
+
+    try:
+        response = await generate(prompt, generation_config, cached_content, operation="faq")
+    except ValueError:
+        raise
+    except Exception as e:
+        # FAQs are an optimization: questions still get live answers without them
+        print(f"Error generating FAQs: {str(e)}")
+        return []
+    if response.finish_reason != "STOP":
+        print(f"Warning: FAQ generation stopped early (reason: {response.finish_reason}), salvaging complete answers")
+    return parse_quiz(response.text, FAQItem)
+
+async def generate_faqs(content: str, cached_content: Optional[str] = None) -> List[Dict]:
+    """Generate likely student questions with answers for the lesson and its sections
+
+    Each FAQ has "question", "answer" and "section" (None for the whole
+    lesson, else the index of the FAQ_SECTION_CHARS section it came from).
+    """
+    if cached_content is None:
+        cached_content = await get_lesson_cache(content)
+    sections = [content[i:i + FAQ_SECTION_CHARS] for i in range(0, len(content), FAQ_SECTION_CHARS)]
+    requests = [_request_faqs(content, FAQ_COUNT, cached_content)]
+    if len(sections) > 1 and FAQ_PER_SECTION > 0:
+        # Sections are short: send them inline rather than referencing the cache
+        requests += [_request_faqs(section, FAQ_PER_SECTION) for section in sections]
+
+    with stage_timer("lesson-materials", "faq"):
+        batches = await asyncio.gather(*requests)
+    faqs = [dict(faq, section=None) for faq in batches[0]]
+    for index, batch in enumerate(batches[1:]):
+        faqs.extend(dict(faq, section=index) for faq in batch)
+    return dedupe_questions(faqs)
+
+async def generate_lesson_materials(content: str, num_questions: int = 5) -> Dict:
+    """Generate title, explanation and quiz for a lesson
+
+    With LLM_COMBINED_GENERATION enabled the lesson is sent once and all three
+    fields come back in a single JSON-schema-constrained response. Any field
+    that is missing or invalid is regenerated with its individual function.
+
+    Long lessons are put in the context cache first; the explanation and quiz
+    calls reference it, and so do later questions once the lesson is saved
+    (see `context_cache.assign_lesson_cache`).
+    """
+    cached_content = await get_lesson_cache(content)
+
+    if not LLM_COMBINED_GENERATION:
+        with stage_timer("lesson-materials", "title"):
+            title = await generate_lesson_title(content)
+        with stage_timer("lesson-materials", "explanation"):
+            explanation = await generate_explanation(content, cached_content)
+        with stage_timer("lesson-materials", "quiz"):
+            quiz = await generate_quiz(content, num_questions=num_questions, cached_content=cached_content)
+        return {"title": title, "explanation": explanation, "quiz": quiz}
+
+    prompt = f"""You are an educational content and assessment expert. For the lesson content below, produce:
+- "title": a concise, descriptive title (maximum 10 words)
+- "explanation": a clear, comprehensive explanation of the lesson content in 2-3 paragraphs
+- "quiz": {num_questions} multiple choice questions, each with exactly 4 options and "correct_answer" set to the index (0-3) of the correct option
+
+{_lesson_block(content, cached_content)}"""
+
+    generation_config = {
+        "temperature": 0.7,
+        "max_output_tokens": 4000,
+        "response_mime_type": "application/json",
+        "response_schema": {
+            "type": "object",
+            "properties": {
+                "title": {"type": "string"},
+                "explanation": {"type": "string"},
+                "quiz": {
+                    "type": "array",
+                    "items": QUIZ_QUESTION_SCHEMA,
+                    "min_items": num_questions,
+                    "max_items": num_questions
+                }
+            },
+            "required": ["title", "explanation", "quiz"]
+        }
+    }
+
+    data = {}
+    try:
+        with stage_timer("lesson-materials", "combined"):
+            response = await generate(prompt, generation_config, cached_content, operation="materials")
+    except (ValueError, LLMUnavailableError):
+        # Configuration and availability errors: the fallbacks would fail too
+        raise
+    except Exception as e:
+        print(f"Error in combined generation: {str(e)}")
+        response = None
+
+    salvaged_quiz = []
+    if response is not None and response.finish_reason == "STOP" and response.text:
+        try:
+            data = json.loads(response.text)
+        except json.JSONDecodeError as e:
+            print(f"Error parsing combined generation response: {str(e)}")
+            salvaged_quiz = parse_quiz(response.text)
+    elif response is not None:
+        print(f"Warning: Combined generation stopped early (reason: {response.finish_reason})")
+        # The quiz comes last; keep the questions completed before truncation
+        salvaged_quiz = parse_quiz(response.text)
+    if not isinstance(data, dict):
+        data = {}
+
+    title = data.get("title")
+    title = title.strip() if isinstance(title, str) and 0 < len(title.strip()) <= 200 else None
+    explanation = data.get("explanation")
+    explanation = explanation.strip() if isinstance(explanation, str) and explanation.strip() else None
+    quiz = (validate_questions(data.get("quiz")) or salvaged_quiz)[:num_questions]
+
+    # Per-field fallback, run concurrently
+    fallbacks = {}
+    if title is None:
+        fallbacks["title"] = generate_lesson_title(content)
+    if explanation is None:
+        fallbacks["explanation"] = generate_explanation(content, cached_content)
+    if len(quiz) < num_questions:
+        # Only the missing questions are generated
+        fallbacks["quiz"] = complete_quiz(content, quiz, num_questions, cached_content)
+    if fallbacks:
+        print(f"Warning: Combined generation incomplete, regenerating: {', '.join(fallbacks)}")
+        results = dict(zip(fallbacks, await asyncio.gather(*fallbacks.values())))
+        title = results.get("title", title)
+        explanation = results.get("explanation", explanation)
+        quiz = results.get("quiz", quiz)
+
+    return {"title": title, "explanation": explanation, "quiz": quiz}
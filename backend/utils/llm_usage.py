@@ -0,0 +1,187 @@
+"""Token and latency accounting for every LLM call.
+
+`llm_client` calls `record_usage()` after each call. Records are attributed
+to the current `usage_scope` (endpoint and lesson), aggregated in memory and
+upserted into the `llm_usage` table every LLM_USAGE_FLUSH_SECONDS (in a
+worker thread when the flush comes due on the event loop), so accounting
+adds no database write to the request path.
+
+    with usage_scope("upload-lesson") as scope:
+        ...generate...
+        scope.lesson_id = lesson.id   # known only after the commit
+"""
+import asyncio
+import atexit
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import SessionLocal, LLMUsage, engine
+from utils import metrics
+
+LLM_USAGE_FLUSH_SECONDS = float(os.getenv("LLM_USAGE_FLUSH_SECONDS", "10"))
+
+COUNTERS = ("calls", "errors", "prompt_tokens", "candidate_tokens", "cached_tokens", "latency_ms_total")
+
+# Databases with INSERT ... ON CONFLICT DO UPDATE; others update, then insert if no row matched
+_UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+class UsageScope:
+    """Endpoint/lesson attribution for the LLM calls made inside it"""
+
+    def __init__(self, endpoint: str, lesson_id: Optional[int] = None):
+        self.endpoint = endpoint
+        self.lesson_id = lesson_id
+        self.records: List[dict] = []
+
+_current_scope: contextvars.ContextVar = contextvars.ContextVar("llm_usage_scope", default=None)
+
+# (day, endpoint, operation, lesson_id) -> counters
+_pending: Dict[Tuple[str, str, str, int], Dict[str, float]] = {}
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+@contextmanager
+def usage_scope(endpoint: str, lesson_id: Optional[int] = None):
+    """Attribute LLM calls in this block to an endpoint and (optionally) a lesson"""
+    scope = UsageScope(endpoint, lesson_id)
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+        for record in scope.records:
+            _aggregate(scope.endpoint, scope.lesson_id, record)
+        maybe_flush()
+
+def record_usage(provider: str, operation: str, response=None, latency_ms: float = 0.0, error: bool = False):
+    """Record one LLM call (response is an LLMResponse, or None on error)"""
+    scope = _current_scope.get()
+    endpoint = scope.endpoint if scope else "internal"
+    record = {
+        "operation": operation,
+        "calls": 1,
+        "errors": 1 if error else 0,
+        "prompt_tokens": getattr(response, "prompt_tokens", 0),
+        "candidate_tokens": getattr(response, "candidate_tokens", 0),
+        "cached_tokens": getattr(response, "cached_tokens", 0),
+        "latency_ms_total": latency_ms,
+    }
+
+    metrics.LLM_REQUESTS.labels(provider, endpoint, operation, "error" if error else "ok").inc()
+    metrics.LLM_LATENCY.labels(provider, operation).observe(latency_ms / 1000)
+    for kind in ("prompt", "candidate", "cached"):
+        if record[f"{kind}_tokens"]:
+            metrics.LLM_TOKENS.labels(provider, endpoint, operation, kind).inc(record[f"{kind}_tokens"])
+
+    if scope is not None:
+        # Attributed when the scope closes (its lesson id may not be known yet)
+        scope.records.append(record)
+    else:
+        _aggregate(endpoint, None, record)
+        maybe_flush()
+
+def _aggregate(endpoint: str, lesson_id: Optional[int], record: dict):
+    key = (datetime.utcnow().strftime("%Y-%m-%d"), endpoint, record["operation"], lesson_id or 0)
+    with _pending_lock:
+        totals = _pending.setdefault(key, dict.fromkeys(COUNTERS, 0))
+        for name in COUNTERS:
+            totals[name] += record[name]
+
+def maybe_flush():
+    """Flush if LLM_USAGE_FLUSH_SECONDS have passed; off the event loop when called from it"""
+    global _last_flush
+
+    with _pending_lock:
+        if time.monotonic() - _last_flush < LLM_USAGE_FLUSH_SECONDS:
+            return
+        # Claim this flush so calls until it runs don't schedule another one
+        _last_flush = time.monotonic()
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        flush_usage()
+        return
+    loop.run_in_executor(None, flush_usage)
+
+def flush_usage():
+    """Upsert the pending aggregates into the llm_usage table"""
+    global _pending, _last_flush
+
+    with _pending_lock:
+        pending, _pending = _pending, {}
+        _last_flush = time.monotonic()
+    if not pending:
+        return
+
+    db = SessionLocal()
+    try:
+        for (day, endpoint, operation, lesson_id), totals in pending.items():
+            _upsert(db, dict(day=day, endpoint=endpoint, operation=operation, lesson_id=lesson_id), totals)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Error saving LLM usage: {e}")
+    finally:
+        db.close()
+
+def _upsert(db, key: Dict, totals: Dict):
+    """Add `totals` to the llm_usage row for `key`, creating it if needed"""
+    insert = _UPSERT_INSERTS.get(engine.dialect.name)
+    if insert is not None:
+        statement = insert(LLMUsage).values(**key, **totals)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(key),
+            set_={name: getattr(LLMUsage, name) + getattr(statement.excluded, name) for name in COUNTERS}
+        )
+        db.execute(statement)
+        return
+    # Increment in the UPDATE itself so concurrent workers don't lose each other's counts
+    updated = db.query(LLMUsage).filter_by(**key).update(
+        {name: getattr(LLMUsage, name) + totals[name] for name in COUNTERS}, synchronize_session=False
+    )
+    if not updated:
+        db.add(LLMUsage(**key, **totals))
+        db.flush()
+
+def get_usage_summary(days: int = 7, group_by: str = "endpoint") -> List[dict]:
+    """Totals over the last `days` days grouped by day, endpoint, operation or lesson"""
+    from sqlalchemy import func
+    from datetime import timedelta
+
+    flush_usage()
+    columns = {
+        "day": [LLMUsage.day],
+        "endpoint": [LLMUsage.endpoint, LLMUsage.operation],
+        "operation": [LLMUsage.operation],
+        "lesson": [LLMUsage.lesson_id],
+    }[group_by]
+    since = (datetime.utcnow() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(*columns, *[func.sum(getattr(LLMUsage, name)).label(name) for name in COUNTERS])
+            .filter(LLMUsage.day >= since)
+            .group_by(*columns)
+            .order_by(func.sum(LLMUsage.prompt_tokens).desc())
+            .all()
+        )
+    finally:
+        db.close()
+
+    summary = []
+    for row in rows:
+        item = {column.key: getattr(row, column.key) for column in columns}
+        item.update({name: getattr(row, name) for name in COUNTERS if name != "latency_ms_total"})
+        item["avg_latency_ms"] = round(row.latency_ms_total / row.calls, 1) if row.calls else None
+        summary.append(item)
+    return summary
+
+atexit.register(flush_usage)
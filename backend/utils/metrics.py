@@ -0,0 +1,93 @@
+"""Prometheus metrics shared by the API and the LLM layer (served at /metrics).
+
+With several worker processes set PROMETHEUS_MULTIPROC_DIR (see
+gunicorn.conf.py) so /metrics aggregates all workers instead of reporting
+whichever one answered the scrape.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, make_asgi_app, multiprocess
+
+from utils.tracing import span
+
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "API request latency by route template",
+    ["method", "route", "status"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+)
+
+STAGE_LATENCY = Histogram(
+    "stage_duration_seconds",
+    "Latency of the stages inside an operation (e.g. upload-lesson: extract, db_commit, ...)",
+    ["operation", "stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+)
+
+LLM_IN_FLIGHT = Gauge(
+    "llm_in_flight", "LLM calls currently waiting on the provider", multiprocess_mode="livesum"
+)
+LLM_QUEUE_DEPTH = Gauge(
+    "llm_queue_depth", "LLM calls waiting for a rate-limit token or a retry backoff", multiprocess_mode="livesum"
+)
+
+LLM_SCHEDULER_QUEUED = Gauge(
+    "llm_scheduler_queued", "LLM calls waiting in the scheduler, by priority class",
+    ["priority"], multiprocess_mode="livesum"
+)
+LLM_SCHEDULER_WAIT = Histogram(
+    "llm_scheduler_wait_seconds",
+    "Time LLM calls waited in the scheduler for a rate-limit token, by priority class",
+    ["priority"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+)
+LLM_SCHEDULER_REJECTED = Counter(
+    "llm_scheduler_rejected_total",
+    "Requests turned away by LLM admission control, by priority class and reason (class_full, client_full)",
+    ["priority", "reason"]
+)
+
+LLM_REQUESTS = Counter(
+    "llm_requests_total",
+    "LLM calls by provider, endpoint, operation and outcome",
+    ["provider", "endpoint", "operation", "status"]
+)
+
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "LLM tokens by provider, endpoint, operation and kind (prompt, candidate, cached)",
+    ["provider", "endpoint", "operation", "kind"]
+)
+
+LLM_LATENCY = Histogram(
+    "llm_request_duration_seconds",
+    "LLM call latency including retries",
+    ["provider", "operation"],
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+)
+
+FAQ_LOOKUPS = Counter(
+    "faq_lookups_total",
+    "Questions checked against the pre-generated FAQs, by result (hit, miss)",
+    ["result"]
+)
+
+@contextmanager
+def stage_timer(operation: str, stage: str, **attributes):
+    """Observe the duration of a block in stage_duration_seconds and trace it as a span"""
+    started_at = time.perf_counter()
+    try:
+        with span(f"{operation}.{stage}", **attributes) as stage_span:
+            yield stage_span
+    finally:
+        STAGE_LATENCY.labels(operation, stage).observe(time.perf_counter() - started_at)
+
+def metrics_app():
+    """ASGI app serving the metrics of this process, or of all workers in multiprocess mode"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return make_asgi_app(registry=registry)
+    return make_asgi_app()
@@ -0,0 +1,153 @@
+"""Multi-turn Q&A sessions with bounded history.
+
+A session keeps a student's questions and answers about one lesson in the
+`qa_sessions` / `qa_turns` tables. Follow-up questions are answered with the
+conversation so far in the prompt: every turn not summarized yet verbatim,
+and everything older as a rolling summary. Once 2 * SESSION_RECENT_TURNS
+turns are unsummarized, all but the last SESSION_RECENT_TURNS are folded
+into the summary in one LLM call, in the background at "backfill" priority
+so no answer waits for it. The prompt stays bounded however long the
+conversation gets.
+
+Retrieval for a follow-up searches with the previous question too, so
+"what about the second one?" finds the same part of the lesson. The chunks
+the previous answer was given from are carried over by id and left out of
+the search, so a follow-up gets new material instead of the same chunks.
+"""
+import asyncio
+import json
+import os
+import secrets
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from database import QASession, QATurn, SessionLocal
+from utils.llm_client import llm_priority
+from utils.llm_service import summarize_conversation
+from utils.llm_usage import usage_scope
+
+# Turns kept verbatim after a summary; twice as many trigger the next one
+SESSION_RECENT_TURNS = int(os.getenv("SESSION_RECENT_TURNS", "3"))
+# Longest summary, and longest answer quoted back in the prompt (characters)
+SESSION_SUMMARY_CHARS = int(os.getenv("SESSION_SUMMARY_CHARS", "1500"))
+SESSION_ANSWER_CHARS = int(os.getenv("SESSION_ANSWER_CHARS", "800"))
+# Chunks of the previous answer carried into a follow-up's context
+SESSION_CARRIED_CHUNKS = int(os.getenv("SESSION_CARRIED_CHUNKS", "3"))
+
+# Background summaries by session id, at most one per session
+_summaries: Dict[str, asyncio.Task] = {}
+
+def create_session(db: Session, lesson_id: int) -> QASession:
+    session = QASession(id=secrets.token_hex(16), lesson_id=lesson_id)
+    db.add(session)
+    db.commit()
+    db.refresh(session)
+    return session
+
+def get_session(db: Session, session_id: str, lesson_id: Optional[int] = None) -> Optional[QASession]:
+    """The session, or None if it doesn't exist (or belongs to another lesson)"""
+    session = db.query(QASession).filter(QASession.id == session_id).first()
+    if session is None or (lesson_id is not None and session.lesson_id != lesson_id):
+        return None
+    return session
+
+def recent_turns(db: Session, session: QASession) -> List[Dict]:
+    """Turns not folded into the summary yet, oldest first"""
+    turns = (
+        db.query(QATurn)
+        .filter(QATurn.session_id == session.id, QATurn.position >= session.summarized_turns)
+        .order_by(QATurn.position)
+    )
+    return [turn.to_dict() for turn in turns]
+
+def session_history(db: Session, session_id: str) -> List[Dict]:
+    turns = db.query(QATurn).filter(QATurn.session_id == session_id).order_by(QATurn.position)
+    return [turn.to_dict() for turn in turns]
+
+def history_prompt(session: QASession, turns: List[Dict]) -> Optional[str]:
+    """The conversation so far, for the answer prompt (None for a new session)
+
+    `turns` are the unsummarized ones; should summaries keep failing, only
+    the last 2 * SESSION_RECENT_TURNS are included.
+    """
+    parts = []
+    if session.summary:
+        parts.append(f"Summary of the earlier conversation:\n{session.summary}")
+    if turns:
+        exchanges = "\n\n".join(
+            f"Student: {turn['question']}\nAssistant: {_clip(turn['answer'], SESSION_ANSWER_CHARS)}"
+            for turn in turns[-2 * SESSION_RECENT_TURNS:]
+        )
+        parts.append(f"Recent conversation:\n{exchanges}")
+    if not parts:
+        return None
+    return "\n\n".join(parts) + "\n\nThe student's next question may refer to this conversation."
+
+def retrieval_query(question: str, turns: List[Dict]) -> str:
+    """Search text for a question, including the previous question as context"""
+    if not turns:
+        return question
+    return f"{turns[-1]['question']}\n{question}"
+
+def carried_chunks(turns: List[Dict]) -> List[int]:
+    """Chunk indexes of the previous answer's context, to reuse for a follow-up"""
+    if not turns:
+        return []
+    return turns[-1]["chunks"][:SESSION_CARRIED_CHUNKS]
+
+def record_turn(db: Session, session_id: str, question: str, answer: str, chunks: Optional[List[int]] = None):
+    """Store a turn; schedules a background summary once enough turns have piled up
+
+    `chunks` are the indexes of the lesson chunks the answer was given
+    from, most relevant first. Call from the event loop.
+    """
+    # Take the position in the UPDATE: concurrent questions in a session each get their own
+    claimed = db.query(QASession).filter(QASession.id == session_id).update(
+        {QASession.turn_count: QASession.turn_count + 1}, synchronize_session=False
+    )
+    if not claimed:
+        db.rollback()
+        return
+    turn_count, summarized_turns = (
+        db.query(QASession.turn_count, QASession.summarized_turns).filter(QASession.id == session_id).one()
+    )
+    db.add(QATurn(
+        session_id=session_id, position=turn_count - 1, question=question, answer=answer,
+        chunks=json.dumps(chunks) if chunks else None
+    ))
+    db.commit()
+
+    if turn_count - summarized_turns >= 2 * SESSION_RECENT_TURNS and session_id not in _summaries:
+        task = asyncio.get_running_loop().create_task(_summarize(session_id))
+        _summaries[session_id] = task
+        task.add_done_callback(lambda _: _summaries.pop(session_id, None))
+
+async def _summarize(session_id: str):
+    """Fold all but the last SESSION_RECENT_TURNS unsummarized turns into the summary
+
+    Best effort: on failure the turns are kept and the next turn retries.
+    """
+    db = SessionLocal()
+    try:
+        session = db.query(QASession).filter(QASession.id == session_id).first()
+        turns = recent_turns(db, session)[:-SESSION_RECENT_TURNS] if session else []
+        if not turns:
+            return
+        with llm_priority("backfill", "sessions"), usage_scope("session-summary", session.lesson_id):
+            summary = await summarize_conversation(
+                session.summary,
+                [(turn["question"], _clip(turn["answer"], SESSION_ANSWER_CHARS)) for turn in turns],
+                SESSION_SUMMARY_CHARS
+            )
+        if summary:
+            session.summary = summary
+            session.summarized_turns = turns[-1]["position"] + 1
+            db.commit()
+    except Exception as e:
+        print(f"Warning: Could not summarize session {session_id}: {e}")
+    finally:
+        db.close()
+
+def _clip(text: str, max_chars: int) -> str:
+    return text if len(text) <= max_chars else text[:max_chars] + "..."
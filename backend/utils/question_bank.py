@@ -0,0 +1,55 @@
+"""Question bank storage and local quiz assembly.
+
+Upload generates a bank of questions per lesson (`generate_question_bank`)
+and stores it in the `question_bank` table. Quizzes are then assembled from
+the bank: a seeded sample of questions with shuffled options, so serving a
+quiz costs one indexed query and no LLM call, and the same seed always gives
+the same quiz.
+"""
+import json
+import random
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from database import BankQuestion
+
+def bank_rows(lesson_id: int, questions: List[Dict]) -> List[BankQuestion]:
+    """Rows for the generated questions of a lesson"""
+    return [
+        BankQuestion(
+            lesson_id=lesson_id,
+            question=question["question"],
+            options=json.dumps(question["options"]),
+            correct_answer=question["correct_answer"],
+            difficulty=question["difficulty"],
+            topic=question.get("topic") or None
+        )
+        for question in questions
+    ]
+
+def load_question_bank(db: Session, lesson_id: int, difficulty: Optional[str] = None) -> List[Dict]:
+    query = db.query(BankQuestion).filter(BankQuestion.lesson_id == lesson_id)
+    if difficulty:
+        query = query.filter(BankQuestion.difficulty == difficulty)
+    return [row.to_dict() for row in query.order_by(BankQuestion.id)]
+
+def has_question_bank(db: Session, lesson_id: int) -> bool:
+    return db.query(BankQuestion.id).filter(BankQuestion.lesson_id == lesson_id).first() is not None
+
+def assemble_quiz(questions: List[Dict], num_questions: int, seed: Optional[int] = None) -> List[Dict]:
+    """Pick up to num_questions questions and shuffle their options
+
+    `correct_answer` is remapped to the shuffled position of the right option.
+    """
+    rng = random.Random(seed)
+    quiz = []
+    for question in rng.sample(questions, min(num_questions, len(questions))):
+        order = list(range(len(question["options"])))
+        rng.shuffle(order)
+        quiz.append(dict(
+            question,
+            options=[question["options"][i] for i in order],
+            correct_answer=order.index(question["correct_answer"])
+        ))
+    return quiz
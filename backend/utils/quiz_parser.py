@@ -0,0 +1,176 @@
+"""Schema validation and incremental parsing of generated quizzes.
+
+The model is asked for a JSON array of questions, but responses can be
+wrapped in markdown fences, cut off at MAX_TOKENS, or contain a single bad
+item. Instead of discarding the whole quiz, `QuizStreamParser` scans the
+text incrementally and yields every complete question object as soon as its
+closing brace arrives; each one is validated on its own against
+`QuizQuestion`, so one malformed or truncated item only costs that item.
+"""
+import json
+from typing import Iterable, List, Type
+
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+class QuizQuestion(BaseModel):
+    question: str = Field(min_length=1)
+    options: List[str] = Field(min_length=4, max_length=4)
+    correct_answer: int = Field(ge=0, le=3)
+
+    @field_validator("question")
+    @classmethod
+    def _strip_question(cls, value: str) -> str:
+        value = value.strip()
+        if not value:
+            raise ValueError("question is empty")
+        return value
+
+    @field_validator("options")
+    @classmethod
+    def _strip_options(cls, value: List[str]) -> List[str]:
+        value = [option.strip() for option in value]
+        if not all(value):
+            raise ValueError("options must not be empty")
+        return value
+
+class TaggedQuizQuestion(QuizQuestion):
+    """Question bank entry: a quiz question with the topic it covers"""
+    topic: str = ""
+
+    @field_validator("topic")
+    @classmethod
+    def _strip_topic(cls, value: str) -> str:
+        return value.strip()[:100]
+
+class FAQItem(BaseModel):
+    """Pre-generated student question with its answer (parsed the same way as quiz questions)"""
+    question: str = Field(min_length=1)
+    answer: str = Field(min_length=1)
+
+    @field_validator("question", "answer")
+    @classmethod
+    def _strip(cls, value: str) -> str:
+        value = value.strip()
+        if not value:
+            raise ValueError("must not be empty")
+        return value
+
+class BatchAnswer(BaseModel):
+    """One answer of a multi-question response, keyed by the question's number"""
+    question_number: int = Field(ge=1)
+    answer: str = Field(min_length=1)
+
+# Gemini response schema matching QuizQuestion
+QUIZ_QUESTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "question": {"type": "string"},
+        "options": {"type": "array", "items": {"type": "string"}, "min_items": 4, "max_items": 4},
+        "correct_answer": {"type": "integer"}
+    },
+    "required": ["question", "options", "correct_answer"]
+}
+
+# Gemini response schema matching TaggedQuizQuestion
+TAGGED_QUIZ_QUESTION_SCHEMA = {
+    "type": "object",
+    "properties": {**QUIZ_QUESTION_SCHEMA["properties"], "topic": {"type": "string"}},
+    "required": QUIZ_QUESTION_SCHEMA["required"] + ["topic"]
+}
+
+# Gemini response schema matching FAQItem
+FAQ_ITEM_SCHEMA = {
+    "type": "object",
+    "properties": {"question": {"type": "string"}, "answer": {"type": "string"}},
+    "required": ["question", "answer"]
+}
+
+# Gemini response schema matching BatchAnswer
+BATCH_ANSWER_SCHEMA = {
+    "type": "object",
+    "properties": {"question_number": {"type": "integer"}, "answer": {"type": "string"}},
+    "required": ["question_number", "answer"]
+}
+
+def quiz_schema(num_questions: int, item_schema: dict = QUIZ_QUESTION_SCHEMA) -> dict:
+    """Response schema for a JSON array of num_questions questions"""
+    return {
+        "type": "array",
+        "items": item_schema,
+        "min_items": num_questions,
+        "max_items": num_questions
+    }
+
+class QuizStreamParser:
+    """Incrementally extract question objects from (possibly partial) JSON text
+
+    Every object that appears directly inside a JSON array is emitted once
+    complete, which covers a bare array of questions as well as a "quiz"
+    array nested in a larger object. Text outside JSON (markdown fences,
+    commentary) is ignored.
+    """
+
+    def __init__(self, model: Type[BaseModel] = QuizQuestion):
+        self._model = model
+        self._buffer = ""
+        self._pos = 0
+        self._stack = []  # (bracket, start index)
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text: str) -> List[dict]:
+        """Add more text; return the questions completed by it"""
+        self._buffer += text
+        completed = []
+        while self._pos < len(self._buffer):
+            char = self._buffer[self._pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                # Strings only matter inside JSON; a stray quote outside is prose
+                self._in_string = bool(self._stack)
+            elif char in "{[":
+                self._stack.append((char, self._pos))
+            elif char in "}]" and self._stack:
+                opener, start = self._stack.pop()
+                if opener == "{" and char == "}" and self._stack and self._stack[-1][0] == "[":
+                    question = _validate(self._buffer[start:self._pos + 1], self._model)
+                    if question is not None:
+                        completed.append(question)
+            self._pos += 1
+        return completed
+
+def _validate(raw: str, model: Type[BaseModel]):
+    try:
+        return model.model_validate(json.loads(raw)).model_dump()
+    except (json.JSONDecodeError, ValidationError):
+        return None
+
+def parse_quiz(text: str, model: Type[BaseModel] = QuizQuestion) -> List[dict]:
+    """All valid questions in text, salvaging what precedes any truncation"""
+    return dedupe_questions(QuizStreamParser(model).feed(text or ""))
+
+def validate_questions(items: Iterable, model: Type[QuizQuestion] = QuizQuestion) -> List[dict]:
+    """Keep only items that satisfy QuizQuestion (or `model`)"""
+    valid = []
+    for item in items or []:
+        try:
+            valid.append(model.model_validate(item).model_dump())
+        except ValidationError:
+            continue
+    return dedupe_questions(valid)
+
+def dedupe_questions(questions: List[dict]) -> List[dict]:
+    seen = set()
+    unique = []
+    for question in questions:
+        key = question["question"].lower()
+        if key not in seen:
+            seen.add(key)
+            unique.append(question)
+    return unique
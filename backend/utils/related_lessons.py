@@ -0,0 +1,150 @@
+"""Related-lesson recommendations from precomputed lesson embeddings.
+
+Each lesson is embedded once, at upload, as the normalized mean of its chunk
+vectors (`vector_db.lesson_embedding`), stored in `lesson_embeddings`. Its
+RELATED_LESSONS_K nearest lessons are stored in `related_lessons`, and the
+new lesson replaces the weakest neighbor of every lesson it is closer to.
+Re-embedding a lesson recomputes the lists it was in, which may now be
+missing a neighbor, so the table stays exact without recomputing it all.
+Serving recommendations is one indexed query joined with `lessons`, so a
+deleted lesson is simply not shown (its list slot stays empty until the next
+rebuild); `maintenance rebuild-related` recomputes everything (e.g. after
+changing the embedding model).
+"""
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import Lesson, LessonEmbedding, RelatedLesson
+from utils.vector_db import get_index_state, lesson_embedding
+
+# Neighbors kept per lesson, and the lowest cosine similarity worth recommending
+RELATED_LESSONS_K = int(os.getenv("RELATED_LESSONS_K", "5"))
+RELATED_MIN_SCORE = float(os.getenv("RELATED_MIN_SCORE", "0.3"))
+
+def _vector(row: LessonEmbedding) -> np.ndarray:
+    return np.frombuffer(row.vector, dtype=np.float32)
+
+def _nearest(lesson_id: int, scores: np.ndarray, ids: List[int]) -> List[RelatedLesson]:
+    """Rows for the K best-scoring lessons above RELATED_MIN_SCORE"""
+    return [
+        RelatedLesson(lesson_id=lesson_id, related_lesson_id=ids[i], score=float(scores[i]))
+        for i in np.argsort(-scores)[:RELATED_LESSONS_K]
+        if scores[i] >= RELATED_MIN_SCORE
+    ]
+
+def update_related_lessons(db: Session, lesson_id: int) -> int:
+    """Embed a new or changed lesson and update the neighbor table; returns its number of neighbors
+
+    Call after the lesson's chunks are in the vector store. Commits.
+    """
+    model = get_index_state()["active"]
+    vector = lesson_embedding(lesson_id, model)
+    if vector is None:
+        return 0
+    vector = np.asarray(vector, dtype=np.float32)
+    db.merge(LessonEmbedding(lesson_id=lesson_id, model=model, vector=vector.tobytes()))
+    # Lists the lesson was in: after re-embedding they may have lost it and need their next neighbor
+    affected = {
+        other_id for (other_id,) in
+        db.query(RelatedLesson.lesson_id).filter(RelatedLesson.related_lesson_id == lesson_id)
+    }
+    db.query(RelatedLesson).filter(
+        (RelatedLesson.lesson_id == lesson_id) | (RelatedLesson.related_lesson_id == lesson_id)
+    ).delete(synchronize_session=False)
+
+    others = db.query(LessonEmbedding).filter(LessonEmbedding.model == model, LessonEmbedding.lesson_id != lesson_id).all()
+    if not others:
+        db.commit()
+        return 0
+    ids = [row.lesson_id for row in others]
+    matrix = np.stack([_vector(row) for row in others])
+    scores = matrix @ vector
+    neighbors = _nearest(lesson_id, scores, ids)
+    db.add_all(neighbors)
+
+    # Similarity is symmetric: the new lesson joins the lists it scores high enough for
+    lists = {
+        other_id: (count, weakest)
+        for other_id, count, weakest in db.query(
+            RelatedLesson.lesson_id, func.count(RelatedLesson.id), func.min(RelatedLesson.score)
+        ).group_by(RelatedLesson.lesson_id)
+    }
+    for other_id, score in zip(ids, scores.tolist()):
+        if score < RELATED_MIN_SCORE or other_id in affected:
+            continue
+        count, weakest = lists.get(other_id, (0, None))
+        if count >= RELATED_LESSONS_K:
+            if score <= weakest:
+                continue
+            db.delete(
+                db.query(RelatedLesson)
+                .filter(RelatedLesson.lesson_id == other_id)
+                .order_by(RelatedLesson.score)
+                .first()
+            )
+        db.add(RelatedLesson(lesson_id=other_id, related_lesson_id=lesson_id, score=score))
+
+    if affected:
+        all_ids = ids + [lesson_id]
+        matrix = np.vstack([matrix, vector])
+        for i, other_id in enumerate(ids):
+            if other_id not in affected:
+                continue
+            other_scores = matrix @ matrix[i]
+            other_scores[i] = -np.inf  # not related to itself
+            db.query(RelatedLesson).filter(RelatedLesson.lesson_id == other_id).delete(synchronize_session=False)
+            db.add_all(_nearest(other_id, other_scores, all_ids))
+    db.commit()
+    return len(neighbors)
+
+def index_related_lessons(db: Session, lesson_id: int):
+    """`update_related_lessons` for uploads: recommendations never fail an upload"""
+    try:
+        update_related_lessons(db, lesson_id)
+    except Exception as e:
+        db.rollback()
+        print(f"Warning: Could not update related lessons for lesson {lesson_id}: {e}")
+
+def rebuild_related_lessons(db: Session, batch_size: int = 256) -> int:
+    """Re-embed every lesson with the active model and recompute all neighbors
+
+    Returns the number of lessons embedded.
+    """
+    model = get_index_state()["active"]
+    rows = []
+    for (lesson_id,) in db.query(Lesson.id).order_by(Lesson.id):
+        vector = lesson_embedding(lesson_id, model)
+        if vector is not None:
+            rows.append(LessonEmbedding(lesson_id=lesson_id, model=model, vector=np.asarray(vector, dtype=np.float32).tobytes()))
+    db.query(LessonEmbedding).delete(synchronize_session=False)
+    db.query(RelatedLesson).delete(synchronize_session=False)
+    db.add_all(rows)
+
+    if rows:
+        ids = [row.lesson_id for row in rows]
+        matrix = np.stack([_vector(row) for row in rows])
+        # Score in blocks so memory stays at batch_size x lessons
+        for start in range(0, len(rows), batch_size):
+            block = matrix[start:start + batch_size] @ matrix.T
+            for offset, scores in enumerate(block):
+                scores[start + offset] = -np.inf  # not related to itself
+                db.add_all(_nearest(ids[start + offset], scores, ids))
+    db.commit()
+    return len(rows)
+
+def related_lessons(db: Session, lesson_id: int, limit: Optional[int] = None) -> List[Dict]:
+    rows = (
+        db.query(RelatedLesson, Lesson)
+        .join(Lesson, Lesson.id == RelatedLesson.related_lesson_id)
+        .filter(RelatedLesson.lesson_id == lesson_id)
+        .order_by(RelatedLesson.score.desc())
+        .limit(limit or RELATED_LESSONS_K)
+    )
+    return [
+        {"id": lesson.id, "title": lesson.title, "score": round(related.score, 4)}
+        for related, lesson in rows
+    ]
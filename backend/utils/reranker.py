@@ -0,0 +1,106 @@
+"""Optional cross-encoder reranking of retrieved chunks.
+
+Embedding distance is a cheap first pass; a cross-encoder scores each
+(query, chunk) pair jointly and is a much better judge of which chunks
+actually answer the question. Reranking runs on CPU in a single batch and
+is skipped (falling back to embedding order) when it is disabled, the
+model cannot be loaded, too many reranks are already running, or recent
+reranks have been slower than the latency budget.
+
+Prediction blocks for tens of milliseconds: the API routes search in a
+worker thread (`asyncio.to_thread`), so reranks overlap instead of holding
+up the event loop, and RERANK_MAX_IN_FLIGHT bounds how many run at once.
+"""
+import os
+import threading
+import time
+from typing import List
+
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() in ("1", "true", "yes")
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Candidates fetched from the vector database before reranking
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "12"))
+# Skip reranking while the moving average latency is above this budget
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "250"))
+# Skip reranking when this many reranks are already in progress
+RERANK_MAX_IN_FLIGHT = int(os.getenv("RERANK_MAX_IN_FLIGHT", "4"))
+# After this many skips for latency, try once more to refresh the estimate
+RERANK_PROBE_EVERY = 20
+
+_model = None
+_model_failed = False
+_model_lock = threading.Lock()
+_state_lock = threading.Lock()
+_in_flight = 0
+_avg_latency_ms = 0.0
+_skips_since_probe = 0
+
+def _get_model():
+    """Lazy initialization of the cross-encoder (CPU only)"""
+    global _model, _model_failed
+
+    if _model is None and not _model_failed:
+        with _model_lock:
+            if _model is None and not _model_failed:
+                try:
+                    from sentence_transformers import CrossEncoder
+                    _model = CrossEncoder(RERANK_MODEL, device="cpu")
+                except Exception as e:
+                    print(f"Warning: reranker disabled, could not load {RERANK_MODEL}: {e}")
+                    _model_failed = True
+    return _model
+
+def should_rerank() -> bool:
+    """Decide up front whether to over-fetch candidates for reranking"""
+    global _skips_since_probe
+
+    if not RERANK_ENABLED or _model_failed:
+        return False
+    with _state_lock:
+        if _in_flight >= RERANK_MAX_IN_FLIGHT:
+            return False
+        if _avg_latency_ms > RERANK_BUDGET_MS:
+            _skips_since_probe += 1
+            if _skips_since_probe < RERANK_PROBE_EVERY:
+                return False
+            _skips_since_probe = 0
+    return True
+
+def rerank(query: str, candidates: List[dict], top_k: int) -> List[dict]:
+    """Order candidates by cross-encoder score and return the best top_k"""
+    global _in_flight, _avg_latency_ms
+
+    if len(candidates) <= 1:
+        return candidates[:top_k]
+
+    model = _get_model()
+    if model is None:
+        return candidates[:top_k]
+
+    with _state_lock:
+        # should_rerank only guessed: claim the slot now, several searches may have passed it
+        if _in_flight >= RERANK_MAX_IN_FLIGHT:
+            return candidates[:top_k]
+        _in_flight += 1
+    start = time.perf_counter()
+    try:
+        scores = model.predict(
+            [(query, chunk["content"]) for chunk in candidates],
+            batch_size=len(candidates),
+            show_progress_bar=False
+        )
+    except Exception as e:
+        print(f"Warning: reranking failed, using embedding order: {e}")
+        return candidates[:top_k]
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with _state_lock:
+            _in_flight -= 1
+            # Exponential moving average of rerank latency
+            _avg_latency_ms = elapsed_ms if _avg_latency_ms == 0 else 0.8 * _avg_latency_ms + 0.2 * elapsed_ms
+
+    ranked = sorted(zip(candidates, scores), key=lambda pair: pair[1], reverse=True)
+    results = []
+    for chunk, score in ranked[:top_k]:
+        results.append({**chunk, "rerank_score": float(score)})
+    return results
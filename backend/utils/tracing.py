@@ -0,0 +1,112 @@
+"""Optional OpenTelemetry tracing for the upload and Q&A pipelines.
+
+Spans cover the request, file extraction, every LLM call, database commits
+and each vector_db operation, with attributes such as content length, chunk
+count and token counts. Tracing is off unless TRACING_EXPORTER is set:
+
+    TRACING_EXPORTER=otlp    send spans to an OTLP/HTTP collector
+                             (OTEL_EXPORTER_OTLP_ENDPOINT, default http://localhost:4318)
+    TRACING_EXPORTER=json    append one JSON span per line to TRACING_JSON_PATH
+
+It needs `opentelemetry-sdk` (plus `opentelemetry-exporter-otlp-proto-http`
+for otlp); when those aren't installed, or tracing is off, `span()` is a
+no-op, so instrumented code never depends on them.
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    from opentelemetry import trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+except ImportError:
+    trace = None
+
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "").lower()
+TRACING_JSON_PATH = os.getenv("TRACING_JSON_PATH", "./traces.jsonl")
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "ischool-backend")
+
+_tracer = None
+
+class _NoopSpan:
+    """Stands in for a span when tracing is off"""
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def update_name(self, name):
+        pass
+
+    def record_exception(self, exception):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+if trace is not None:
+    class JsonFileSpanExporter(SpanExporter):
+        """Append finished spans to a file, one JSON object per line"""
+
+        def __init__(self, path: str):
+            self.path = path
+            self._lock = threading.Lock()
+
+        def export(self, spans):
+            lines = [json.dumps(json.loads(span.to_json())) for span in spans]
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            return SpanExportResult.SUCCESS
+
+        def shutdown(self):
+            pass
+
+def setup_tracing():
+    """Configure the tracer from TRACING_EXPORTER; safe to call more than once"""
+    global _tracer
+
+    if _tracer is not None or not TRACING_EXPORTER or TRACING_EXPORTER == "none":
+        return
+    if trace is None:
+        print("Warning: TRACING_EXPORTER is set but opentelemetry-sdk is not installed; tracing disabled")
+        return
+
+    if TRACING_EXPORTER == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            print("Warning: opentelemetry-exporter-otlp-proto-http is not installed; tracing disabled")
+            return
+        exporter = OTLPSpanExporter()
+    elif TRACING_EXPORTER == "json":
+        exporter = JsonFileSpanExporter(TRACING_JSON_PATH)
+    else:
+        print(f"Warning: unknown TRACING_EXPORTER '{TRACING_EXPORTER}'; tracing disabled")
+        return
+
+    provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("ischool")
+
+    # Per-query SQL spans when the SQLAlchemy instrumentation is installed
+    try:
+        from opentelemetry.instrumentation.sqlalchemy import SQLAlchemyInstrumentor
+        from database import engine
+        SQLAlchemyInstrumentor().instrument(engine=engine)
+    except ImportError:
+        pass
+
+@contextmanager
+def span(name: str, **attributes):
+    """Open a span (a child of the current one); yields an object with set_attribute()"""
+    if _tracer is None:
+        yield _NOOP_SPAN
+        return
+    with _tracer.start_as_current_span(name) as current:
+        current.set_attributes({key: value for key, value in attributes.items() if value is not None})
+        yield current
@@ -1,73 +1,324 @@
-import chromadb
 import os
-from typing import List, Optional
+import re
+import threading
+import time
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+from database import SessionLocal, EmbeddingIndex
+from utils import reranker
+from utils.tracing import span
 
 # Initialize ChromaDB with persistence
-os.makedirs("./chroma_db", exist_ok=True)
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma_db")
+
+# The embedded client must only be used by one process. With several API
+# workers (or the API and Streamlit together) run a Chroma server instead
+# (`chroma run --path ./chroma_db --port 8001`) and set CHROMA_SERVER_HOST.
+CHROMA_SERVER_HOST = os.getenv("CHROMA_SERVER_HOST")
+CHROMA_SERVER_PORT = int(os.getenv("CHROMA_SERVER_PORT", "8001"))
+
+_chroma_client = None
+# The startup warm-up opens the client in a thread while requests may too
+_chroma_client_lock = threading.Lock()
 
 # Collection name
 COLLECTION_NAME = "lessons"
+# Pre-generated FAQ questions (see utils/faq.py)
+FAQ_COLLECTION_NAME = "faqs"
+
+# Characters per chunk stored in the vector database
+CHUNK_SIZE = 1000
+
+# Embedding model used when no migration has been recorded yet.
+# "default" is Chroma's built-in MiniLM model and maps to the original
+# unversioned "lessons" collection, so existing data needs no migration.
+DEFAULT_EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "default")
+
+# How long (seconds) a process trusts its cached view of the active/backfilling models
+INDEX_STATE_TTL = float(os.getenv("EMBEDDING_INDEX_STATE_TTL", "5"))
+
+_index_state = None
+_index_state_loaded_at = 0.0
+_embedding_functions = {}
+
+def get_chroma_client():
+    """Chroma client, opened on first use (importing chromadb alone takes most of a second)"""
+    global _chroma_client
+    if _chroma_client is None:
+        with _chroma_client_lock:
+            if _chroma_client is None:
+                import chromadb
+                if CHROMA_SERVER_HOST:
+                    _chroma_client = chromadb.HttpClient(host=CHROMA_SERVER_HOST, port=CHROMA_SERVER_PORT)
+                else:
+                    os.makedirs(CHROMA_PATH, exist_ok=True)
+                    _chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+    return _chroma_client
+
+def collection_name_for_model(model: str, base: str = COLLECTION_NAME) -> str:
+    """Versioned collection name, e.g. lessons__all-mpnet-base-v2"""
+    if model == "default":
+        return base
+    slug = re.sub(r"[^a-zA-Z0-9]+", "-", model).strip("-").lower()
+    return f"{base}__{slug}"[:63].rstrip("-")
 
-def get_or_create_collection():
-    """Get or create the lessons collection"""
+def _get_embedding_function(model: str):
+    """Embedding function for a model id (cached, models are expensive to load)"""
+    if model not in _embedding_functions:
+        from chromadb.utils import embedding_functions
+        if model == "default":
+            _embedding_functions[model] = embedding_functions.DefaultEmbeddingFunction()
+        else:
+            _embedding_functions[model] = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model)
+    return _embedding_functions[model]
+
+def get_index_state(refresh: bool = False) -> dict:
+    """Return {"active": model, "backfilling": [models]} from the embedding_indexes table"""
+    global _index_state, _index_state_loaded_at
+
+    if refresh or _index_state is None or time.monotonic() - _index_state_loaded_at > INDEX_STATE_TTL:
+        db = SessionLocal()
+        try:
+            rows = db.query(EmbeddingIndex).filter(EmbeddingIndex.status.in_(["active", "backfilling"])).all()
+        finally:
+            db.close()
+        active = next((r.model for r in rows if r.status == "active"), DEFAULT_EMBEDDING_MODEL)
+        _index_state = {
+            "active": active,
+            "backfilling": [r.model for r in rows if r.status == "backfilling"]
+        }
+        _index_state_loaded_at = time.monotonic()
+
+    return _index_state
+
+def get_or_create_collection(model: Optional[str] = None, base: str = COLLECTION_NAME):
+    """Get or create the lessons collection for an embedding model (the active one by default)"""
+    model = model or get_index_state()["active"]
+    name = collection_name_for_model(model, base)
+    embedding_function = _get_embedding_function(model)
+    chroma_client = get_chroma_client()
     try:
-        collection = chroma_client.get_collection(name=COLLECTION_NAME)
+        collection = chroma_client.get_collection(name=name, embedding_function=embedding_function)
     except Exception:
-        collection = chroma_client.create_collection(name=COLLECTION_NAME)
+        collection = chroma_client.create_collection(
+            name=name,
+            embedding_function=embedding_function,
+            metadata={"embedding_model": model}
+        )
     return collection
 
-def add_lesson_to_vector_db(lesson_id: int, title: str, content: str):
-    """Add lesson content to vector database"""
-    collection = get_or_create_collection()
-    
+def warm_up():
+    """Open the store and load the active embedding model ahead of the first request"""
+    model = get_index_state()["active"]
+    get_or_create_collection(model)
+    _get_embedding_function(model)(["warm up"])
+
+def _write_models() -> List[str]:
+    """Models that must receive writes: the active one plus any being backfilled"""
+    state = get_index_state()
+    return [state["active"]] + [m for m in state["backfilling"] if m != state["active"]]
+
+def chunk_content(content: str) -> List[str]:
+    """Split lesson content into fixed-size chunks"""
+    return [content[i:i+CHUNK_SIZE] for i in range(0, len(content), CHUNK_SIZE)]
+
+def add_lesson_to_vector_db(lesson_id: int, title: str, content: str, model: Optional[str] = None):
+    """Add lesson content to vector database
+
+    Without an explicit model the lesson is dual-written to the active
+    collection and every collection currently being backfilled.
+    """
     # Split content into chunks (for better retrieval)
-    chunk_size = 1000
-    chunks = [content[i:i+chunk_size] for i in range(0, len(content), chunk_size)]
-    
+    chunks = chunk_content(content)
+
     ids = [f"{lesson_id}_{i}" for i in range(len(chunks))]
     documents = chunks
     metadatas = [{"lesson_id": lesson_id, "title": title, "chunk_index": i} for i in range(len(chunks))]
-    
-    collection.add(
-        ids=ids,
-        documents=documents,
-        metadatas=metadatas
-    )
-
-def search_similar_content(query: str, lesson_id: Optional[int] = None, top_k: int = 3) -> List[dict]:
-    """Search for similar content in vector database"""
+
+    targets = [model] if model else _write_models()
+    with span("vector_db.add_lesson", **{
+        "lesson.id": lesson_id,
+        "content.length": len(content),
+        "vector_db.chunks": len(chunks),
+        "vector_db.models": ",".join(targets)
+    }):
+        for target in targets:
+            # upsert keeps dual-writes and backfill idempotent
+            get_or_create_collection(target).upsert(
+                ids=ids,
+                documents=documents,
+                metadatas=metadatas
+            )
+
+def lesson_embedding(lesson_id: int, model: Optional[str] = None) -> Optional[List[float]]:
+    """Mean of a lesson's chunk vectors, scaled to unit length (None without chunks)"""
+    model = model or get_index_state()["active"]
+    with span("vector_db.lesson_embedding", **{"lesson.id": lesson_id, "vector_db.model": model}):
+        result = get_or_create_collection(model).get(where={"lesson_id": lesson_id}, include=["embeddings"])
+    embeddings = result.get("embeddings")
+    if embeddings is None or len(embeddings) == 0:
+        return None
+    mean = np.asarray(embeddings, dtype=np.float32).mean(axis=0)
+    norm = float(np.linalg.norm(mean))
+    return (mean / norm).tolist() if norm else None
+
+def embed_queries(queries: List[str]) -> List[List[float]]:
+    """Embed queries with the active model in one batch
+
+    Pass the results as `query_embedding` to search several collections (or
+    answer several questions) without embedding the same text twice.
+    """
+    with span("vector_db.embed", **{"vector_db.queries": len(queries)}):
+        embeddings = _get_embedding_function(get_index_state()["active"])(queries)
+    return [list(map(float, embedding)) for embedding in embeddings]
+
+def search_similar_content(query: str, lesson_id: Optional[int] = None, top_k: int = 3,
+                           rerank: bool = False, query_embedding: Optional[List[float]] = None,
+                           exclude_chunks: Optional[List[int]] = None) -> List[dict]:
+    """Search for similar content in vector database
+
+    With rerank=True (and RERANK_ENABLED set) more candidates are fetched
+    and reordered by a cross-encoder before the top_k are returned.
+    `exclude_chunks` skips chunk indexes of the lesson the caller already has.
+    """
+    query_embeddings = [query_embedding] if query_embedding is not None else None
+    return search_similar_content_batch([query], lesson_id, top_k, rerank, query_embeddings, exclude_chunks)[0]
+
+def search_similar_content_batch(queries: List[str], lesson_id: Optional[int] = None, top_k: int = 3,
+                                 rerank: bool = False,
+                                 query_embeddings: Optional[List[List[float]]] = None,
+                                 exclude_chunks: Optional[List[int]] = None) -> List[List[dict]]:
+    """`search_similar_content` for several queries in one vector store query"""
     collection = get_or_create_collection()
-    
+
     # Build query
     where_filter = {"lesson_id": lesson_id} if lesson_id else None
-    
-    results = collection.query(
-        query_texts=[query],
-        n_results=top_k,
-        where=where_filter
-    )
-    
+    if where_filter and exclude_chunks:
+        where_filter = {"$and": [where_filter, {"chunk_index": {"$nin": list(exclude_chunks)}}]}
+
+    use_reranker = rerank and reranker.should_rerank()
+    n_results = max(top_k, reranker.RERANK_CANDIDATES) if use_reranker else top_k
+
+    with span("vector_db.query", **{
+        "lesson.id": lesson_id,
+        "vector_db.n_results": n_results,
+        "vector_db.queries": len(queries)
+    }) as query_span:
+        if query_embeddings is not None:
+            results = collection.query(query_embeddings=query_embeddings, n_results=n_results, where=where_filter)
+        else:
+            results = collection.query(query_texts=queries, n_results=n_results, where=where_filter)
+        query_span.set_attribute("vector_db.results", sum(len(ids) for ids in results['ids'] or []))
+
     # Format results
-    formatted_results = []
-    if results['documents'] and len(results['documents']) > 0:
-        for i in range(len(results['documents'][0])):
-            formatted_results.append({
-                "content": results['documents'][0][i],
-                "metadata": results['metadatas'][0][i] if results['metadatas'] else {},
-                "distance": results['distances'][0][i] if results['distances'] else None
-            })
-    
-    return formatted_results
+    batch_results = []
+    for q in range(len(queries)):
+        formatted_results = []
+        if results['documents'] and len(results['documents']) > q:
+            for i in range(len(results['documents'][q])):
+                formatted_results.append({
+                    "content": results['documents'][q][i],
+                    "metadata": results['metadatas'][q][i] if results['metadatas'] else {},
+                    "distance": results['distances'][q][i] if results['distances'] else None
+                })
+        batch_results.append(formatted_results)
+
+    if use_reranker:
+        with span("vector_db.rerank", **{"rerank.candidates": sum(len(r) for r in batch_results)}):
+            return [reranker.rerank(query, formatted, top_k) for query, formatted in zip(queries, batch_results)]
+    return batch_results
+
+def get_lesson_chunks(lesson_id: int, chunk_indexes: List[int]) -> List[dict]:
+    """Chunks of a lesson by index (no similarity search), in lesson order"""
+    if not chunk_indexes:
+        return []
+    with span("vector_db.get_chunks", **{"lesson.id": lesson_id, "vector_db.chunks": len(chunk_indexes)}):
+        results = get_or_create_collection().get(
+            ids=[f"{lesson_id}_{index}" for index in chunk_indexes], include=["documents", "metadatas"]
+        )
+    chunks = [
+        {"content": document, "metadata": metadata or {}, "distance": None}
+        for document, metadata in zip(results["documents"] or [], results["metadatas"] or [])
+    ]
+    return sorted(chunks, key=lambda chunk: chunk["metadata"].get("chunk_index", 0))
+
+def add_faqs_to_vector_db(lesson_id: int, faqs: List[dict], model: Optional[str] = None):
+    """Index FAQ questions (dicts with "id" and "question") for close-match lookup"""
+    if not faqs:
+        return
+    targets = [model] if model else _write_models()
+    with span("vector_db.add_faqs", **{"lesson.id": lesson_id, "vector_db.faqs": len(faqs)}):
+        for target in targets:
+            get_or_create_collection(target, FAQ_COLLECTION_NAME).upsert(
+                ids=[f"faq_{faq['id']}" for faq in faqs],
+                documents=[faq["question"] for faq in faqs],
+                metadatas=[{"lesson_id": lesson_id, "faq_id": faq["id"]} for faq in faqs]
+            )
+
+def search_faqs(query: str, lesson_id: int, query_embedding: Optional[List[float]] = None) -> Optional[dict]:
+    """Closest FAQ question of a lesson: {"faq_id", "question", "distance"}, or None"""
+    collection = get_or_create_collection(base=FAQ_COLLECTION_NAME)
+    with span("vector_db.query_faqs", **{"lesson.id": lesson_id}):
+        if query_embedding is not None:
+            results = collection.query(query_embeddings=[query_embedding], n_results=1, where={"lesson_id": lesson_id})
+        else:
+            results = collection.query(query_texts=[query], n_results=1, where={"lesson_id": lesson_id})
+    if not results['ids'] or not results['ids'][0]:
+        return None
+    return {
+        "faq_id": results['metadatas'][0][0]["faq_id"],
+        "question": results['documents'][0][0],
+        "distance": results['distances'][0][0]
+    }
 
 def delete_lesson_from_vector_db(lesson_id: int):
     """Delete lesson from vector database"""
-    collection = get_or_create_collection()
+    for model in _write_models():
+        collection = get_or_create_collection(model)
+        try:
+            with span("vector_db.delete_lesson", **{"lesson.id": lesson_id, "vector_db.model": model}):
+                # Get all documents for this lesson
+                results = collection.get(where={"lesson_id": lesson_id})
+                if results['ids']:
+                    collection.delete(ids=results['ids'])
+        except Exception as e:
+            print(f"Error deleting lesson from vector DB: {e}")
+
+def drop_collection(model: str):
+    """Delete the collections (lessons and FAQs) for an embedding model"""
     try:
-        # Get all documents for this lesson
-        results = collection.get(where={"lesson_id": lesson_id})
-        if results['ids']:
-            collection.delete(ids=results['ids'])
+        get_chroma_client().delete_collection(name=collection_name_for_model(model))
     except Exception as e:
-        print(f"Error deleting lesson from vector DB: {e}")
+        print(f"Error dropping collection for {model}: {e}")
+    try:
+        get_chroma_client().delete_collection(name=collection_name_for_model(model, FAQ_COLLECTION_NAME))
+    except Exception:
+        # Only exists if FAQ pre-generation was used with this model
+        pass
+
+def iter_vector_chunks(page_size: int = 500, model: Optional[str] = None) -> Iterator[dict]:
+    """Yield every stored chunk (id and metadata) one page at a time"""
+    collection = get_or_create_collection(model)
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        ids = page['ids']
+        if not ids:
+            break
+        for i, chunk_id in enumerate(ids):
+            yield {
+                "id": chunk_id,
+                "metadata": page['metadatas'][i] if page['metadatas'] else {}
+            }
+        if len(ids) < page_size:
+            break
+        offset += page_size
 
+def delete_chunks(chunk_ids: List[str], batch_size: int = 500, model: Optional[str] = None):
+    """Delete chunks by id in batches"""
+    collection = get_or_create_collection(model)
+    with span("vector_db.delete_chunks", **{"vector_db.chunks": len(chunk_ids)}):
+        for i in range(0, len(chunk_ids), batch_size):
+            collection.delete(ids=chunk_ids[i:i+batch_size])
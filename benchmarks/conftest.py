@@ -0,0 +1,76 @@
+"""Benchmark setup: an isolated database, vector store and fake LLM.
+
+Environment is configured before any backend module is imported, so the
+benchmarks never touch backend/lessons.db or backend/chroma_db and never
+call a real LLM.
+"""
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+WORK_DIR = Path(tempfile.mkdtemp(prefix="ischool-bench-"))
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{WORK_DIR / 'lessons.db'}")
+os.environ.setdefault("CHROMA_PATH", str(WORK_DIR / "chroma_db"))
+os.environ.setdefault("LLM_PROVIDER", "fake")
+# Small fixed LLM latency: the benchmarks measure our pipeline, not the model
+os.environ.setdefault("FAKE_LLM_LATENCY_MS", "20")
+os.environ.setdefault("FAKE_LLM_MS_PER_TOKEN", "0")
+# Keep the client's rate limiter out of the measurements
+os.environ.setdefault("GEMINI_RPM", "1000000")
+os.environ.setdefault("GEMINI_BURST", "1000000")
+os.environ.setdefault("LLM_USAGE_FLUSH_SECONDS", "3600")
+
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+# Relative paths in the backend (uploads/) resolve inside the scratch directory
+os.chdir(WORK_DIR)
+
+_loop = asyncio.new_event_loop()
+
+def run(coroutine):
+    """Run a coroutine to completion (one loop for the session, so loop setup isn't measured)"""
+    return _loop.run_until_complete(coroutine)
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far (MB)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def record_stats(benchmark, items: int = 1, unit: str = "ops"):
+    """Add p50/p95 latency, throughput and peak RSS to the benchmark's extra_info
+
+    Does nothing under --benchmark-disable, where the function runs once untimed.
+    """
+    if benchmark.disabled or benchmark.stats is None:
+        return
+    timings = sorted(benchmark.stats.stats.data)
+    if not timings:
+        return
+
+    def percentile(fraction):
+        return timings[min(len(timings) - 1, int(round(fraction * (len(timings) - 1))))]
+
+    mean = sum(timings) / len(timings)
+    benchmark.extra_info.update({
+        "p50_ms": round(percentile(0.50) * 1000, 3),
+        "p95_ms": round(percentile(0.95) * 1000, 3),
+        f"throughput_{unit}_per_s": round(items / mean, 1) if mean else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    })
+
+@pytest.fixture(scope="session")
+def app_client():
+    """TestClient for the FastAPI app (fake LLM, scratch database)"""
+    from fastapi.testclient import TestClient
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
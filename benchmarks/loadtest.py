@@ -0,0 +1,307 @@
+"""HTTP load generator with latency percentiles, SLO checks and saturation curves.
+
+Closed-loop virtual students (asyncio + httpx) run a scenario at increasing
+concurrency levels. Either point it at a running API, or let it start the
+API itself with the fake LLM provider for each worker count:
+
+    # against a running backend
+    python benchmarks/loadtest.py --url http://localhost:8000 --scenario mixed --users 1,10,50
+
+    # saturation curve vs. gunicorn worker count (fake LLM, scratch database)
+    python benchmarks/loadtest.py --spawn --workers 1,2,4 --users 1,5,10,25,50 --duration 30
+
+Scenarios:
+    browse   list lessons and open one
+    search   semantic lesson search
+    ask      ask a question about a lesson
+    mixed    60% browse, 25% search, 15% ask
+
+For each worker count and concurrency level the report gives throughput and
+p50/p90/p95/p99 latency (overall and per endpoint); `--slo-p95-ms` marks the
+highest concurrency each worker count sustains within the SLO. `--output`
+writes everything as JSON for plotting.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from synthetic import QUESTIONS, SIZES, make_text
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+SEARCH_QUERIES = ["energy", "cell membrane", "force and motion", "trade and empire", "derivative of a function"]
+
+SCENARIOS = {
+    "browse": {"browse": 1.0},
+    "search": {"search": 1.0},
+    "ask": {"ask": 1.0},
+    "mixed": {"browse": 0.60, "search": 0.25, "ask": 0.15},
+}
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+        **{f"p{int(q * 100)}_ms": round(percentile(values, q) * 1000, 1) if values else None
+           for q in (0.50, 0.90, 0.95, 0.99)},
+        "max_ms": round(values[-1] * 1000, 1) if values else None,
+    }
+
+class LoadRun:
+    """One concurrency level: virtual users looping over scenario requests"""
+
+    def __init__(self, client: httpx.AsyncClient, lesson_ids: List[int], weights: Dict[str, float],
+                 think_time: float):
+        self.client = client
+        self.lesson_ids = lesson_ids
+        self.actions = list(weights)
+        self.weights = [weights[action] for action in self.actions]
+        self.think_time = think_time
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_kinds = defaultdict(int)
+
+    async def _request(self, name: str, user_id: int, method: str, url: str, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            # One student each: the LLM queue limits requests per client, and all users share an address
+            response = await self.client.request(method, url, headers={"X-User-Id": f"loadtest-{user_id}"}, **kwargs)
+            error = f"HTTP {response.status_code}" if response.status_code >= 400 else None
+        except httpx.HTTPError as e:
+            error = type(e).__name__
+        if error is None:
+            self.latencies[name].append(time.perf_counter() - started_at)
+        else:
+            self.errors[name] += 1
+            self.error_kinds[error] += 1
+
+    async def _browse(self, rng: random.Random, user_id: int):
+        await self._request("list-lessons", user_id, "GET", "/api/students/lessons")
+        await self._request("get-lesson", user_id, "GET", f"/api/students/lessons/{rng.choice(self.lesson_ids)}")
+
+    async def _search(self, rng: random.Random, user_id: int):
+        await self._request("search-lessons", user_id, "GET", "/api/students/search-lessons",
+                            params={"query": rng.choice(SEARCH_QUERIES)})
+
+    async def _ask(self, rng: random.Random, user_id: int):
+        await self._request("ask-question", user_id, "POST", "/api/students/ask-question",
+                            json={"lesson_id": rng.choice(self.lesson_ids), "question": rng.choice(QUESTIONS)})
+
+    async def _user(self, user_id: int, deadline: float):
+        rng = random.Random(user_id)
+        while time.monotonic() < deadline:
+            action = rng.choices(self.actions, weights=self.weights)[0]
+            await getattr(self, f"_{action}")(rng, user_id)
+            if self.think_time:
+                await asyncio.sleep(rng.uniform(0, 2 * self.think_time))
+
+    async def run(self, users: int, duration: float) -> dict:
+        started_at = time.monotonic()
+        await asyncio.gather(*(self._user(i, started_at + duration) for i in range(users)))
+        elapsed = time.monotonic() - started_at
+
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        return {
+            "users": users,
+            **summarize(all_latencies, sum(self.errors.values()), elapsed),
+            "error_kinds": dict(self.error_kinds),
+            "endpoints": {
+                name: summarize(self.latencies[name], self.errors[name], elapsed)
+                for name in sorted(set(self.latencies) | set(self.errors))
+            },
+        }
+
+async def seed_lessons(client: httpx.AsyncClient, count: int) -> List[int]:
+    """Existing lesson ids; uploads synthetic lessons first if there are fewer than count"""
+    response = await client.get("/api/students/lessons")
+    response.raise_for_status()
+    lesson_ids = [lesson["id"] for lesson in response.json()["lessons"]]
+    for i in range(len(lesson_ids), count):
+        text = make_text(SIZES["small"] * 2, seed=1000 + i)
+        response = await client.post(
+            "/api/teachers/upload-lesson",
+            files={"file": (f"loadtest-{i}.txt", text.encode("utf-8"), "text/plain")},
+            timeout=120
+        )
+        response.raise_for_status()
+        lesson_ids.append(response.json()["lesson"]["id"])
+    return lesson_ids
+
+async def run_levels(url: str, args) -> List[dict]:
+    limits = httpx.Limits(max_connections=max(args.users) + 10, max_keepalive_connections=max(args.users) + 10)
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        lesson_ids = await seed_lessons(client, args.lessons)
+        results = []
+        for users in args.users:
+            result = await LoadRun(client, lesson_ids, SCENARIOS[args.scenario], args.think_time).run(
+                users, args.duration
+            )
+            print_level(result, args.slo_p95_ms)
+            results.append(result)
+        return results
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _wait_until_healthy(process: subprocess.Popen, url: str, what: str):
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{what} exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"{what} did not become healthy within 120s")
+
+class SpawnedServer:
+    """gunicorn with N workers, the fake LLM and a scratch database/vector store
+
+    Started like the multi-worker deployment (backend/start_workers.sh):
+    gunicorn.conf.py, whose master creates the database before forking, and
+    for several workers a Chroma server started alongside them.
+    """
+
+    def __init__(self, workers: int, work_dir: Path):
+        self.workers = workers
+        self.work_dir = work_dir
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.chroma = None
+        env = dict(os.environ)
+        env.setdefault("LLM_PROVIDER", "fake")
+        env.setdefault("DATABASE_URL", f"sqlite:///{work_dir / 'lessons.db'}")
+        env.setdefault("CHROMA_PATH", str(work_dir / "chroma_db"))
+        # Keep the client's rate limiter out of the measurements, like the benchmarks do
+        env.setdefault("GEMINI_RPM", "1000000")
+        env.setdefault("GEMINI_BURST", "1000000")
+        env["WEB_CONCURRENCY"] = str(workers)
+        env["BIND"] = f"127.0.0.1:{self.port}"
+        self.env = env
+
+    def _start_chroma(self):
+        port = _free_port()
+        self.chroma = subprocess.Popen(
+            ["chroma", "run", "--path", self.env["CHROMA_PATH"], "--port", str(port)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        _wait_until_healthy(self.chroma, f"http://127.0.0.1:{port}/api/v2/heartbeat", "chroma")
+        self.env.update({"CHROMA_SERVER_HOST": "127.0.0.1", "CHROMA_SERVER_PORT": str(port)})
+
+    def __enter__(self):
+        if self.workers > 1 and "CHROMA_SERVER_HOST" not in self.env:
+            self._start_chroma()
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--log-level", "warning", "main:app"],
+            cwd=BACKEND_DIR, env=self.env
+        )
+        try:
+            _wait_until_healthy(self.process, f"{self.url}/api/health", "gunicorn")
+        except RuntimeError:
+            self.__exit__()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        for process in (self.process, self.chroma):
+            if process is None:
+                continue
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+def print_level(result: dict, slo_p95_ms: Optional[float]):
+    within = ""
+    if slo_p95_ms is not None and result["p95_ms"] is not None:
+        within = "  SLO ok" if result["p95_ms"] <= slo_p95_ms and not result["errors"] else "  SLO missed"
+    print(f"  users={result['users']:>4}  rps={result['throughput_rps']:>8}  "
+          f"p50={result['p50_ms']}ms  p95={result['p95_ms']}ms  p99={result['p99_ms']}ms  "
+          f"errors={result['errors']}{within}")
+    if result["error_kinds"]:
+        print(f"        errors: {result['error_kinds']}")
+
+def print_saturation(curves: Dict[str, List[dict]], slo_p95_ms: Optional[float]):
+    print("\nSaturation (throughput rps / p95 ms by concurrency):")
+    levels = sorted({result["users"] for results in curves.values() for result in results})
+    print("  workers  " + "".join(f"{users:>18}" for users in levels))
+    for workers, results in curves.items():
+        by_users = {result["users"]: result for result in results}
+        cells = []
+        for users in levels:
+            result = by_users.get(users)
+            cells.append(f"{result['throughput_rps']:>8} / {result['p95_ms'] or '-':>7}" if result else " " * 18)
+        line = f"  {workers:>7}  " + "".join(f"{cell:>18}" for cell in cells)
+        if slo_p95_ms is not None:
+            ok = [r["users"] for r in results if r["p95_ms"] is not None and r["p95_ms"] <= slo_p95_ms and not r["errors"]]
+            line += f"   max users within SLO: {max(ok) if ok else 0}"
+        print(line)
+
+def parse_levels(value: str) -> List[int]:
+    return [int(part) for part in value.split(",") if part.strip()]
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test the API and report latency percentiles")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="base URL of a running backend")
+    target.add_argument("--spawn", action="store_true", help="start gunicorn (fake LLM) for each --workers value")
+    parser.add_argument("--workers", type=parse_levels, default=[1], help="worker counts for --spawn, e.g. 1,2,4")
+    parser.add_argument("--scenario", choices=list(SCENARIOS), default="mixed")
+    parser.add_argument("--users", type=parse_levels, default=[1, 5, 10, 25], help="concurrency levels, e.g. 1,10,50")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per concurrency level")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause between a user's requests (s)")
+    parser.add_argument("--lessons", type=int, default=5, help="lessons to make sure exist before the run")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request timeout (s)")
+    parser.add_argument("--slo-p95-ms", type=float, help="p95 latency objective, e.g. 2000")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    curves = {}
+    if args.url:
+        print(f"[loadtest] {args.scenario} against {args.url}")
+        curves["external"] = asyncio.run(run_levels(args.url, args))
+    else:
+        for workers in args.workers:
+            with tempfile.TemporaryDirectory(prefix="ischool-load-") as work_dir:
+                with SpawnedServer(workers, Path(work_dir)) as server:
+                    print(f"[loadtest] {args.scenario} with {workers} worker(s) at {server.url}")
+                    curves[str(workers)] = asyncio.run(run_levels(server.url, args))
+
+    print_saturation(curves, args.slo_p95_ms)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"scenario": args.scenario, "duration_s": args.duration, "slo_p95_ms": args.slo_p95_ms,
+                       "curves": curves}, f, indent=2)
+        print(f"[loadtest] results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Deterministic synthetic lessons (plain text and PDF) for the benchmarks."""
+import random
+from typing import List
+
+# Lesson sizes in characters
+SIZES = {
+    "small": 5_000,
+    "medium": 50_000,
+    "large": 250_000,
+}
+
+WORDS = (
+    "energy cell plant light water carbon oxygen reaction molecule process system "
+    "structure function membrane protein enzyme nucleus chlorophyll glucose atom "
+    "force motion velocity mass gravity friction momentum wave frequency electron "
+    "history empire trade revolution government society culture economy population "
+    "equation variable function graph slope derivative integral theorem proof ratio"
+).split()
+
+QUESTIONS = [
+    "What is the main idea of this lesson?",
+    "How does energy move through the system?",
+    "Why is the structure of the membrane important?",
+    "What happens to glucose during the reaction?",
+    "Explain the relationship between force and motion.",
+]
+
+def make_text(num_chars: int, seed: int = 0) -> str:
+    """Lesson-like text of about num_chars characters, the same for the same seed"""
+    rng = random.Random(seed)
+    paragraphs = []
+    length = 0
+    while length < num_chars:
+        sentences = []
+        for _ in range(rng.randint(3, 7)):
+            words = rng.choices(WORDS, k=rng.randint(8, 18))
+            sentences.append(" ".join(words).capitalize() + ".")
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    return "\n\n".join(paragraphs)[:num_chars]
+
+def _wrap(text: str, width: int = 90) -> List[str]:
+    lines = []
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split():
+            if len(line) + len(word) + 1 > width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.append(line)
+    return lines
+
+def _escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def make_pdf(text: str, lines_per_page: int = 50) -> bytes:
+    """Minimal text-only PDF (Helvetica, one Tj per line) that PyPDF2 can extract"""
+    lines = _wrap(text)
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+
+    # Objects: 1 catalog, 2 page tree, 3 font, then a (page, content) pair per page
+    objects = {}
+    page_ids = []
+    for index, page_lines in enumerate(pages):
+        page_id, content_id = 4 + 2 * index, 5 + 2 * index
+        page_ids.append(page_id)
+        stream = "BT /F1 10 Tf 12 TL 50 800 Td\n" + "".join(f"({_escape(line)}) '\n" for line in page_lines) + "ET"
+        stream_bytes = stream.encode("latin-1", "replace")
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream_bytes), stream_bytes)
+        objects[page_id] = (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+    objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode()
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+    objects[3] = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(output)
+        output += b"%d 0 obj\n%s\nendobj\n" % (object_id, objects[object_id])
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for object_id in sorted(objects):
+        output += b"%010d 00000 n \n" % offsets[object_id]
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(output)
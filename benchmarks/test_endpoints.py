@@ -0,0 +1,48 @@
+"""End-to-end API benchmarks with the fake LLM provider."""
+import itertools
+
+import pytest
+
+from conftest import record_stats
+from synthetic import QUESTIONS, SIZES, make_pdf, make_text
+
+@pytest.mark.parametrize("file_type", ["txt", "pdf"])
+@pytest.mark.parametrize("size", ["small", "medium"])
+def test_upload_lesson(benchmark, app_client, size, file_type):
+    benchmark.group = f"upload-lesson-{file_type}"
+    text = make_text(SIZES[size], seed=2)
+    if file_type == "pdf":
+        upload = ("lesson.pdf", make_pdf(text), "application/pdf")
+    else:
+        upload = ("lesson.txt", text.encode("utf-8"), "text/plain")
+
+    def upload_lesson():
+        response = app_client.post("/api/teachers/upload-lesson", files={"file": upload})
+        assert response.status_code == 200, response.text
+
+    benchmark.pedantic(upload_lesson, rounds=10, warmup_rounds=1)
+    record_stats(benchmark, unit="uploads")
+
+@pytest.fixture(scope="module")
+def uploaded_lesson_id(app_client):
+    text = make_text(SIZES["medium"], seed=3)
+    response = app_client.post(
+        "/api/teachers/upload-lesson",
+        files={"file": ("qa.txt", text.encode("utf-8"), "text/plain")}
+    )
+    assert response.status_code == 200, response.text
+    return response.json()["lesson"]["id"]
+
+def test_ask_question(benchmark, app_client, uploaded_lesson_id):
+    benchmark.group = "ask-question"
+    questions = itertools.cycle(QUESTIONS)
+
+    def ask():
+        response = app_client.post(
+            "/api/students/ask-question",
+            json={"lesson_id": uploaded_lesson_id, "question": next(questions)}
+        )
+        assert response.status_code == 200, response.text
+
+    benchmark.pedantic(ask, rounds=30, warmup_rounds=2)
+    record_stats(benchmark, unit="questions")
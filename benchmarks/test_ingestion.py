@@ -0,0 +1,50 @@
+"""Ingestion benchmarks: text extraction, chunking and vector indexing."""
+import itertools
+
+import pytest
+
+from conftest import record_stats, run
+from synthetic import SIZES, make_pdf, make_text
+
+_lesson_ids = itertools.count(100_000)
+
+@pytest.fixture(scope="module", params=list(SIZES))
+def lesson(request):
+    text = make_text(SIZES[request.param], seed=1)
+    return {"size": request.param, "text": text, "pdf": make_pdf(text)}
+
+def test_extract_text_from_pdf(benchmark, lesson):
+    from utils.file_processor import extract_text_from_pdf
+
+    benchmark.group = "extract-pdf"
+    text = benchmark(lambda: run(extract_text_from_pdf(lesson["pdf"])))
+    assert len(text) > 0.8 * len(lesson["text"])
+    record_stats(benchmark, items=len(lesson["text"]), unit="chars")
+
+def test_extract_text_from_txt(benchmark, lesson):
+    from utils.file_processor import extract_text_from_txt
+
+    benchmark.group = "extract-txt"
+    data = lesson["text"].encode("utf-8")
+    benchmark(lambda: run(extract_text_from_txt(data)))
+    record_stats(benchmark, items=len(data), unit="chars")
+
+def test_chunk_content(benchmark, lesson):
+    from utils.vector_db import chunk_content
+
+    benchmark.group = "chunking"
+    chunks = benchmark(chunk_content, lesson["text"])
+    assert chunks
+    record_stats(benchmark, items=len(lesson["text"]), unit="chars")
+
+def test_add_lesson_to_vector_db(benchmark, lesson):
+    from utils.vector_db import add_lesson_to_vector_db, chunk_content
+
+    benchmark.group = "vector-add"
+    # A new lesson id per round so every round embeds and inserts (not an idempotent upsert)
+    benchmark.pedantic(
+        lambda: add_lesson_to_vector_db(next(_lesson_ids), f"Bench {lesson['size']}", lesson["text"]),
+        rounds=5 if lesson["size"] == "large" else 10,
+        warmup_rounds=1
+    )
+    record_stats(benchmark, items=len(chunk_content(lesson["text"])), unit="chunks")
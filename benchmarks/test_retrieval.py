@@ -0,0 +1,31 @@
+"""Retrieval benchmarks: semantic search over an indexed set of lessons."""
+import itertools
+
+import pytest
+
+from conftest import record_stats
+from synthetic import QUESTIONS, SIZES, make_text
+
+# Lessons indexed before searching
+NUM_LESSONS = 20
+FIRST_LESSON_ID = 200_000
+
+@pytest.fixture(scope="module")
+def indexed_lessons():
+    from utils.vector_db import add_lesson_to_vector_db
+
+    lesson_ids = list(range(FIRST_LESSON_ID, FIRST_LESSON_ID + NUM_LESSONS))
+    for lesson_id in lesson_ids:
+        add_lesson_to_vector_db(lesson_id, f"Lesson {lesson_id}", make_text(SIZES["medium"], seed=lesson_id))
+    return lesson_ids
+
+@pytest.mark.parametrize("scope", ["lesson", "all"])
+def test_search_similar_content(benchmark, indexed_lessons, scope):
+    from utils.vector_db import search_similar_content
+
+    benchmark.group = "search"
+    questions = itertools.cycle(QUESTIONS)
+    lesson_id = indexed_lessons[0] if scope == "lesson" else None
+    results = benchmark(lambda: search_similar_content(next(questions), lesson_id=lesson_id, top_k=3))
+    assert results
+    record_stats(benchmark, unit="queries")
@@ -1,9 +1,12 @@
 import streamlit as st
 import os
 import asyncio
+import threading
 from dotenv import load_dotenv
 import sys
+import json
 from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
 
 # Add backend directory to path
 backend_path = Path(__file__).parent / "backend"
@@ -12,24 +15,99 @@ sys.path.insert(0, str(backend_path))
 # Load environment variables
 load_dotenv(backend_path / ".env")
 
-# Import backend modules
-from database import init_db, SessionLocal, Lesson
-from utils.file_processor import process_uploaded_file
-from utils.llm_service import generate_lesson_title, generate_explanation, generate_quiz, answer_question
-from utils.vector_db import add_lesson_to_vector_db, search_similar_content
+# Thin-client mode: with BACKEND_API_URL set (e.g. http://localhost:8000) the app
+# calls the FastAPI backend over HTTP instead of importing the backend modules, so
+# Chroma, the embedding model and the LLM client only live in the API processes
+BACKEND_API_URL = os.getenv("BACKEND_API_URL", "").rstrip("/")
+BACKEND_API_TIMEOUT = float(os.getenv("BACKEND_API_TIMEOUT", "180"))
+BACKEND_API_MAX_CONNECTIONS = int(os.getenv("BACKEND_API_MAX_CONNECTIONS", "20"))
+
+if BACKEND_API_URL:
+    import httpx
+else:
+    # Import backend modules
+    from database import init_db, SessionLocal, Lesson
+    from utils.file_processor import process_uploaded_file
+    from utils.llm_service import generate_lesson_title, generate_explanation, generate_quiz, generate_lesson_materials, generate_question_bank, stream_answer, LLM_COMBINED_GENERATION
+    from utils.question_bank import assemble_quiz, bank_rows, has_question_bank, load_question_bank
+    from utils.faq import FAQ_PREGENERATION, find_faq, index_faqs, pregenerate_faqs, save_faqs
+    from utils.related_lessons import index_related_lessons
+    from utils.vector_db import add_lesson_to_vector_db, search_similar_content, get_chroma_client
+    from utils.context_cache import assign_lesson_cache, get_context_cache, get_lesson_cache
+    from utils.llm_providers import get_provider
+
+# How long lesson lists and search results are reused across reruns (seconds);
+# uploads clear them immediately
+LESSONS_CACHE_TTL = int(os.getenv("STREAMLIT_LESSONS_CACHE_TTL", "300"))
+SEARCH_CACHE_TTL = int(os.getenv("STREAMLIT_SEARCH_CACHE_TTL", "600"))
+
+@st.cache_resource
+def init_backend():
+    """Create tables, open the vector store and the LLM provider once per server, not per rerun"""
+    init_db()
+    get_chroma_client()
+    return get_provider()
+
+@st.cache_resource
+def get_event_loop():
+    """One event loop for the whole app, running in a background thread
+
+    The LLM client's rate limiter, request coalescing and context-cache locks
+    belong to a loop, so every session shares this one.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="streamlit-async", daemon=True).start()
+    return loop
 
 # Helper function to run async functions in Streamlit
 def run_async(coro):
-    """Run async function in Streamlit"""
+    """Run async function on the shared background loop and wait for the result"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+def iterate_async(agen):
+    """Iterate an async generator from Streamlit, one item at a time on the shared loop"""
+    while True:
+        try:
+            yield run_async(agen.__anext__())
+        except StopAsyncIteration:
+            return
+
+class BackendError(Exception):
+    """The backend API answered with an error (the message is its `detail`)"""
+
+@st.cache_resource
+def get_api_client():
+    """One keep-alive connection pool to the backend, shared by every session"""
+    return httpx.Client(
+        base_url=BACKEND_API_URL,
+        timeout=httpx.Timeout(BACKEND_API_TIMEOUT, connect=5.0),
+        limits=httpx.Limits(
+            max_connections=BACKEND_API_MAX_CONNECTIONS,
+            max_keepalive_connections=BACKEND_API_MAX_CONNECTIONS
+        )
+    )
+
+def _raise_for_status(response):
+    if response.is_success:
+        return
+    response.read()
     try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    return loop.run_until_complete(coro)
+        detail = response.json().get("detail", response.text)
+    except ValueError:
+        detail = response.text
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        detail = f"{detail} (try again in {retry_after}s)"
+    raise BackendError(detail)
 
-# Initialize database
-init_db()
+def api_request(method: str, path: str, **kwargs) -> Dict:
+    """Call the backend API and return the JSON body"""
+    response = get_api_client().request(method, path, **kwargs)
+    _raise_for_status(response)
+    return response.json()
+
+if not BACKEND_API_URL:
+    init_backend()
 
 # Page configuration
 st.set_page_config(
@@ -85,7 +163,10 @@ st.sidebar.title("Navigation")
 page = st.sidebar.radio("Choose a page", ["🏠 Home", "👨‍🏫 Teacher Portal", "👨‍🎓 Student Portal"])
 
 # Load lessons from database
+@st.cache_data(ttl=LESSONS_CACHE_TTL, show_spinner=False)
 def load_lessons():
+    if BACKEND_API_URL:
+        return api_request("GET", "/api/students/lessons")["lessons"]
     db = get_db_session()
     try:
         lessons = db.query(Lesson).all()
@@ -93,6 +174,197 @@ def load_lessons():
     finally:
         db.close()
 
+@st.cache_data(ttl=SEARCH_CACHE_TTL, show_spinner=False)
+def search_lesson_ids(query: str) -> List[int]:
+    """Ids of the lessons matching a search query"""
+    if BACKEND_API_URL:
+        lessons = api_request("GET", "/api/students/search-lessons", params={"query": query})["lessons"]
+        return [lesson["id"] for lesson in lessons]
+    similar_content = search_similar_content(query, lesson_id=None, top_k=5)
+    lesson_ids = []
+    for chunk in similar_content:
+        lesson_id = chunk.get("metadata", {}).get("lesson_id")
+        if lesson_id is not None and lesson_id not in lesson_ids:
+            lesson_ids.append(lesson_id)
+    return lesson_ids
+
+def invalidate_lesson_caches():
+    """Forget cached lesson lists and search results (after an upload)"""
+    load_lessons.clear()
+    search_lesson_ids.clear()
+
+def upload_lesson_locally(uploaded_file) -> Optional[Tuple[str, str, List[Dict]]]:
+    """Extract, generate and save a lesson in this process
+
+    Returns (title, explanation, quiz), or None after reporting the error.
+    """
+    # Read file contents
+    file_contents = uploaded_file.read()
+    file_type = uploaded_file.type
+    
+    # Process file
+    content = run_async(process_uploaded_file(file_contents, file_type))
+    
+    if not content or len(content.strip()) < 50:
+        st.error("File content is too short or empty. Please upload a valid lesson file.")
+        return None
+    
+    # Generate content
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+    
+    if LLM_COMBINED_GENERATION:
+        status_text.text("Generating title, explanation and quiz...")
+        progress_bar.progress(20)
+        materials = run_async(generate_lesson_materials(content, num_questions=5))
+        title = materials["title"]
+        explanation = materials["explanation"]
+        quiz = materials["quiz"]
+        progress_bar.progress(60)
+    else:
+        status_text.text("Generating title...")
+        progress_bar.progress(20)
+        title = run_async(generate_lesson_title(content))
+        cached_content = run_async(get_lesson_cache(content))
+        
+        status_text.text("Generating explanation...")
+        progress_bar.progress(40)
+        explanation = run_async(generate_explanation(content, cached_content))
+        
+        status_text.text("Generating quiz...")
+        progress_bar.progress(60)
+        quiz = run_async(generate_quiz(content, num_questions=5, cached_content=cached_content))
+    
+    status_text.text("Generating question bank...")
+    progress_bar.progress(70)
+    question_bank = run_async(generate_question_bank(content))
+    
+    faqs = []
+    if FAQ_PREGENERATION:
+        status_text.text("Generating FAQs...")
+        progress_bar.progress(75)
+        faqs = run_async(pregenerate_faqs(content))
+    
+    # Save to database
+    status_text.text("Saving to database...")
+    progress_bar.progress(80)
+    db = get_db_session()
+    try:
+        lesson = Lesson(
+            title=title,
+            filename=uploaded_file.name,
+            file_type="pdf" if file_type == "application/pdf" else "txt",
+            content=content,
+            explanation=explanation
+        )
+        db.add(lesson)
+        db.flush()
+        db.add_all(bank_rows(lesson.id, question_bank))
+        faq_rows = save_faqs(db, lesson.id, faqs)
+        db.commit()
+        db.refresh(lesson)
+        assign_lesson_cache(content, lesson.id)
+        
+        # Add to vector database
+        add_lesson_to_vector_db(lesson.id, title, content)
+        index_faqs(lesson.id, faq_rows)
+        index_related_lessons(db, lesson.id)
+    except Exception as e:
+        db.rollback()
+        st.error(f"Error saving lesson: {str(e)}")
+        return None
+    finally:
+        db.close()
+    
+    progress_bar.progress(100)
+    status_text.text("Complete!")
+    return title, explanation, quiz
+
+def upload_lesson(uploaded_file) -> Optional[Tuple[str, str, List[Dict]]]:
+    """Upload a lesson and generate its content; returns (title, explanation, quiz) or None"""
+    if not BACKEND_API_URL:
+        return upload_lesson_locally(uploaded_file)
+    try:
+        result = api_request(
+            "POST", "/api/teachers/upload-lesson",
+            files={"file": (uploaded_file.name, uploaded_file.read(), uploaded_file.type)}
+        )
+    except BackendError as e:
+        st.error(f"Error processing file: {str(e)}")
+        return None
+    return result["lesson"]["title"], result["lesson"]["explanation"], result["quiz"]
+
+def generate_lesson_quiz(lesson_id: int) -> Optional[List[Dict]]:
+    """A fresh quiz for a saved lesson, from its question bank when it has one"""
+    if BACKEND_API_URL:
+        response = get_api_client().get(f"/api/students/lessons/{lesson_id}/quiz", params={"n": 5})
+        if response.status_code != 404:
+            _raise_for_status(response)
+            return response.json()["quiz"]
+        # No question bank (lessons uploaded before banks): the teacher view generates a quiz
+        return api_request("GET", f"/api/teachers/lessons/{lesson_id}")["quiz"]
+    db = get_db_session()
+    try:
+        if has_question_bank(db, lesson_id):
+            return assemble_quiz(load_question_bank(db, lesson_id), 5)
+        lesson_obj = db.query(Lesson).filter(Lesson.id == lesson_id).first()
+        if not lesson_obj:
+            return None
+        cached_content = run_async(get_lesson_cache(lesson_obj.content, lesson_obj.id))
+        return run_async(generate_quiz(lesson_obj.content, num_questions=5, cached_content=cached_content))
+    finally:
+        db.close()
+
+def ask_lesson_question(lesson_id: int, question: str) -> Iterator[Dict]:
+    """Answer events as the answer is generated
+
+    Same events as the backend's /ask-question/stream: "meta" (relevant
+    sections), "delta" (a piece of the answer), then "done" or "error".
+    """
+    if BACKEND_API_URL:
+        with get_api_client().stream(
+            "POST", "/api/students/ask-question/stream",
+            json={"lesson_id": lesson_id, "question": question}
+        ) as response:
+            _raise_for_status(response)
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+        return
+    
+    db = get_db_session()
+    try:
+        lesson_obj = db.query(Lesson).filter(Lesson.id == lesson_id).first()
+        if not lesson_obj:
+            raise ValueError("Lesson not found")
+        faq = find_faq(db, question, lesson_id)
+        if not faq:
+            # Search for relevant context
+            similar_content = search_similar_content(question, lesson_id=lesson_id, top_k=3, rerank=True)
+            
+            # Combine relevant chunks; the lesson text is only loaded when they are too short
+            context_parts = [chunk["content"] for chunk in similar_content]
+            context = "\n\n".join(context_parts)
+            whole_lesson = not context or len(context) < 100
+            if whole_lesson:
+                context = lesson_obj.content
+    finally:
+        db.close()
+    
+    if faq:
+        yield {"type": "meta", "relevant_sections": [], "source": "faq"}
+        yield {"type": "delta", "text": faq["answer"]}
+        yield {"type": "done"}
+        return
+    
+    yield {"type": "meta", "relevant_sections": [chunk["content"][:200] + "..." for chunk in similar_content[:2]]}
+    
+    # Generate answer
+    cached_content = run_async(get_context_cache(context, whole_lesson, lesson_id))
+    for piece in iterate_async(stream_answer(question, context, cached_content)):
+        yield {"type": "delta", "text": piece}
+    yield {"type": "done"}
+
 # Home Page
 if page == "🏠 Home":
     st.header("Welcome to AI Learning Assistant")
@@ -119,8 +391,17 @@ if page == "🏠 Home":
     """)
     
     # Show API key status
+    provider = os.getenv("LLM_PROVIDER", "gemini").lower()
     api_key = os.getenv("GEMINI_API_KEY")
-    if api_key:
+    if BACKEND_API_URL:
+        try:
+            api_request("GET", "/api/health")
+            st.success(f"✅ Connected to the backend at {BACKEND_API_URL}")
+        except Exception as e:
+            st.error(f"⚠️ Cannot reach the backend at {BACKEND_API_URL}: {str(e)}")
+    elif provider != "gemini":
+        st.info(f"ℹ️ Using the '{provider}' LLM provider (LLM_PROVIDER)")
+    elif api_key:
         st.success("✅ Gemini API key is configured")
     else:
         st.error("⚠️ Gemini API key not found. Please set GEMINI_API_KEY in your .env file")
@@ -147,87 +428,39 @@ elif page == "👨‍🏫 Teacher Portal":
             if st.button("🚀 Upload & Generate Content", type="primary"):
                 with st.spinner("Processing your file and generating content..."):
                     try:
-                        # Read file contents
-                        file_contents = uploaded_file.read()
-                        file_type = uploaded_file.type
-                        
-                        # Process file
-                        content = run_async(process_uploaded_file(file_contents, file_type))
+                        result = upload_lesson(uploaded_file)
                         
-                        if not content or len(content.strip()) < 50:
-                            st.error("File content is too short or empty. Please upload a valid lesson file.")
-                        else:
-                            # Generate content
-                            progress_bar = st.progress(0)
-                            status_text = st.empty()
+                        if result is not None:
+                            title, explanation, quiz = result
+                            invalidate_lesson_caches()
                             
-                            status_text.text("Generating title...")
-                            progress_bar.progress(20)
-                            title = run_async(generate_lesson_title(content))
+                            st.success(f"✅ Lesson '{title}' uploaded successfully!")
                             
-                            status_text.text("Generating explanation...")
-                            progress_bar.progress(40)
-                            explanation = run_async(generate_explanation(content))
+                            # Display results
+                            st.subheader("Generated Content")
                             
-                            status_text.text("Generating quiz...")
-                            progress_bar.progress(60)
-                            quiz = run_async(generate_quiz(content, num_questions=5))
+                            st.markdown("### 📝 Title")
+                            st.write(title)
                             
-                            # Save to database
-                            status_text.text("Saving to database...")
-                            progress_bar.progress(80)
-                            db = get_db_session()
-                            try:
-                                lesson = Lesson(
-                                    title=title,
-                                    filename=uploaded_file.name,
-                                    file_type="pdf" if file_type == "application/pdf" else "txt",
-                                    content=content,
-                                    explanation=explanation
-                                )
-                                db.add(lesson)
-                                db.commit()
-                                db.refresh(lesson)
-                                
-                                # Add to vector database
-                                add_lesson_to_vector_db(lesson.id, title, content)
-                                
-                                progress_bar.progress(100)
-                                status_text.text("Complete!")
-                                
-                                st.success(f"✅ Lesson '{title}' uploaded successfully!")
-                                
-                                # Display results
-                                st.subheader("Generated Content")
-                                
-                                st.markdown("### 📝 Title")
-                                st.write(title)
-                                
-                                st.markdown("### 📖 Explanation")
-                                st.write(explanation)
-                                
-                                st.markdown("### 📝 Quiz (5 MCQs)")
-                                if quiz and len(quiz) > 0:
-                                    for idx, q in enumerate(quiz, 1):
-                                        if isinstance(q, dict) and 'question' in q:
-                                            with st.container():
-                                                st.markdown(f"**Question {idx}:** {q['question']}")
-                                                if 'options' in q and isinstance(q['options'], list):
-                                                    options = q['options']
-                                                    correct_idx = q.get('correct_answer', -1)
-                                                    
-                                                    for opt_idx, option in enumerate(options):
-                                                        prefix = "✅" if opt_idx == correct_idx else "⚪"
-                                                        st.markdown(f"{prefix} {chr(65 + opt_idx)}. {option}")
-                                                st.divider()
-                                else:
-                                    st.warning("⚠️ Quiz generation failed or was blocked by safety filters. The lesson was saved, but no quiz could be generated.")
-                                
-                            except Exception as e:
-                                db.rollback()
-                                st.error(f"Error saving lesson: {str(e)}")
-                            finally:
-                                db.close()
+                            st.markdown("### 📖 Explanation")
+                            st.write(explanation)
+                            
+                            st.markdown("### 📝 Quiz (5 MCQs)")
+                            if quiz and len(quiz) > 0:
+                                for idx, q in enumerate(quiz, 1):
+                                    if isinstance(q, dict) and 'question' in q:
+                                        with st.container():
+                                            st.markdown(f"**Question {idx}:** {q['question']}")
+                                            if 'options' in q and isinstance(q['options'], list):
+                                                options = q['options']
+                                                correct_idx = q.get('correct_answer', -1)
+                                                
+                                                for opt_idx, option in enumerate(options):
+                                                    prefix = "✅" if opt_idx == correct_idx else "⚪"
+                                                    st.markdown(f"{prefix} {chr(65 + opt_idx)}. {option}")
+                                            st.divider()
+                            else:
+                                st.warning("⚠️ Quiz generation failed or was blocked by safety filters. The lesson was saved, but no quiz could be generated.")
                         
                     except ValueError as e:
                         st.error(f"Error processing file: {str(e)}")
@@ -238,6 +471,7 @@ elif page == "👨‍🏫 Teacher Portal":
         st.subheader("My Lessons")
         
         if st.button("🔄 Refresh"):
+            invalidate_lesson_caches()
             st.rerun()
         
         lessons = load_lessons()
@@ -260,15 +494,14 @@ elif page == "👨‍🏫 Teacher Portal":
                     
                     if st.button(f"View Quiz", key=button_key):
                         with st.spinner("Generating quiz..."):
-                            db = get_db_session()
                             try:
-                                lesson_obj = db.query(Lesson).filter(Lesson.id == lesson['id']).first()
-                                if lesson_obj:
-                                    quiz = run_async(generate_quiz(lesson_obj.content, num_questions=5))
+                                quiz = generate_lesson_quiz(lesson['id'])
+                            except Exception as e:
+                                st.error(f"Error: {str(e)}")
+                            else:
+                                if quiz is not None:
                                     st.session_state[quiz_key] = quiz
                                     st.rerun()
-                            finally:
-                                db.close()
                     
                     # Display quiz if it exists in session state
                     if quiz_key in st.session_state:
@@ -307,11 +540,7 @@ elif page == "👨‍🎓 Student Portal":
             # Filter lessons based on search
             if search_query:
                 try:
-                    similar_content = search_similar_content(search_query, lesson_id=None, top_k=5)
-                    lesson_ids = set()
-                    for chunk in similar_content:
-                        if "lesson_id" in chunk.get("metadata", {}):
-                            lesson_ids.add(chunk["metadata"]["lesson_id"])
+                    lesson_ids = set(search_lesson_ids(search_query.strip()))
                     
                     filtered_lessons = [l for l in lessons if l['id'] in lesson_ids]
                     if not filtered_lessons:
@@ -353,36 +582,25 @@ elif page == "👨‍🎓 Student Portal":
                 if question.strip():
                     with st.spinner("Thinking..."):
                         try:
-                            db = get_db_session()
-                            try:
-                                lesson_obj = db.query(Lesson).filter(Lesson.id == selected_lesson_id).first()
-                                if lesson_obj:
-                                    # Search for relevant context
-                                    similar_content = search_similar_content(
-                                        question, 
-                                        lesson_id=selected_lesson_id, 
-                                        top_k=3
-                                    )
-                                    
-                                    # Combine relevant chunks
-                                    context_parts = [chunk["content"] for chunk in similar_content]
-                                    context = "\n\n".join(context_parts)
-                                    
-                                    if not context or len(context) < 100:
-                                        context = lesson_obj.content
-                                    
-                                    # Generate answer
-                                    answer = run_async(answer_question(question, context))
-                                    
-                                    st.markdown("### 💡 Answer")
-                                    st.success(answer)
-                                    
-                                    if similar_content:
-                                        with st.expander("📎 Relevant Sections"):
-                                            for chunk in similar_content[:2]:
-                                                st.markdown(f"*{chunk['content'][:200]}...*")
-                            finally:
-                                db.close()
+                            st.markdown("### 💡 Answer")
+                            answer_box = st.empty()
+                            answer = ""
+                            relevant_sections = []
+                            for event in ask_lesson_question(selected_lesson_id, question):
+                                if event["type"] == "meta":
+                                    relevant_sections = event["relevant_sections"]
+                                    if event.get("source") == "faq":
+                                        st.caption("📌 Answered from the lesson's frequently asked questions")
+                                elif event["type"] == "delta":
+                                    answer += event["text"]
+                                    answer_box.success(answer)
+                                elif event["type"] == "error":
+                                    st.error(f"Error: {event['detail']} (try again in {event['retry_after']}s)")
+                            
+                            if relevant_sections:
+                                with st.expander("📎 Relevant Sections"):
+                                    for section in relevant_sections:
+                                        st.markdown(f"*{section}*")
                         except Exception as e:
                             st.error(f"Error: {str(e)}")
                 else: